@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+# MODA POR GRUPO
+# "Categoria mais comum" de cada grupo (desastre por município, cultura por área, seguradora por
+# número de sinistros) numa passada só sobre os códigos das categorias, sem groupby + sort +
+# drop_duplicates nem uma chamada Python por grupo. Empates ficam com a menor categoria na ordem
+# alfabética, como em Series.mode().iloc[0].
+
+
+def codifica(coluna):
+    # códigos inteiros (-1 para vazio) e a tabela de categorias, ordenada
+    if isinstance(coluna.dtype, pd.CategoricalDtype) and coluna.cat.categories.is_monotonic_increasing:
+        return coluna.cat.codes.to_numpy(dtype=np.int64), coluna.cat.categories
+    codigos, categorias = pd.factorize(coluna, sort=True)
+    return codigos.astype(np.int64), categorias
+
+
+def moda_por_grupo(df, grupo, categoria, peso=None, k=1):
+    # peso=None conta linhas (coluna 'size'); com peso, soma a coluna (ex.: area_total).
+    # Devolve as k categorias de maior peso de cada grupo, em ordem, com o peso de cada uma
+    cod_grupo, grupos = codifica(df[grupo])
+    cod_cat, categorias = codifica(df[categoria])
+    if peso is None:
+        pesos = np.ones(len(df), dtype=np.float64)
+    else:
+        pesos = df[peso].to_numpy(dtype=np.float64, na_value=0)
+
+    validos = (cod_grupo >= 0) & (cod_cat >= 0)
+    chaves = cod_grupo[validos] * max(len(categorias), 1) + cod_cat[validos]
+    unicas, inverso = np.unique(chaves, return_inverse=True)
+    somas = np.bincount(inverso, weights=pesos[validos], minlength=len(unicas))
+    g, c = np.divmod(unicas, max(len(categorias), 1))
+
+    # por grupo, maior peso primeiro e, no empate, a menor categoria
+    ordem = np.lexsort((c, -somas, g))
+    g, c, somas = g[ordem], c[ordem], somas[ordem]
+    inicio_grupo = np.r_[True, g[1:] != g[:-1]][:len(g)]
+    posicao = np.arange(len(g)) - np.maximum.accumulate(np.where(inicio_grupo, np.arange(len(g)), 0))
+    manter = posicao < k
+
+    nome_peso = 'size' if peso is None else peso
+    somas = somas[manter]
+    if peso is None or pd.api.types.is_integer_dtype(df[peso]):
+        somas = somas.astype(np.int64)
+    return pd.DataFrame({
+        grupo: grupos.take(g[manter]),
+        categoria: categorias.take(c[manter]),
+        nome_peso: somas,
+    })
+
+
+# SOMAS EM VÁRIOS NÍVEIS
+# Como GROUPING SETS no SQL: as somas de várias medidas em vários agrupamentos (por uf, por
+# município, por mês, ...) saindo de uma passada só sobre as linhas. As linhas são agrupadas uma
+# vez na célula mais fina (todas as dimensões juntas) e cada nível é somado a partir dessas
+# células, que são bem menos numerosas. Como no groupby, um vazio numa dimensão tira a linha só
+# dos níveis que usam essa dimensão.
+
+
+def somas_por_niveis(df, niveis, medidas, colunas=None):
+    # niveis: {nome: [dimensões]}; colunas: séries derivadas usadas como dimensão (ex.: o mês de
+    # uma data), pelo nome. Devolve {nome: DataFrame com as dimensões e as somas}, ordenado pelas
+    # dimensões como no groupby
+    colunas = colunas or {}
+    dimensoes = list(dict.fromkeys(d for nivel in niveis.values() for d in nivel))
+    codigos, categorias = {}, {}
+    for d in dimensoes:
+        cod, categorias[d] = codifica(colunas[d] if d in colunas else df[d])
+        codigos[d] = cod + 1  # 0 fica para o vazio
+
+    # célula mais fina: um código misto com todas as dimensões. Se o espaço de códigos não é muito
+    # maior que a tabela, as células saem de uma contagem direta; senão, de um factorize
+    chaves = np.zeros(len(df), dtype=np.int64)
+    espaco = 1
+    for d in dimensoes:
+        chaves = chaves * (len(categorias[d]) + 1) + codigos[d]
+        espaco *= len(categorias[d]) + 1
+    if espaco <= 4 * len(df) + 1024:
+        presentes = np.bincount(chaves, minlength=espaco) > 0
+        celulas = np.flatnonzero(presentes)
+        inverso = (np.cumsum(presentes) - 1)[chaves]
+    else:
+        inverso, celulas = pd.factorize(chaves)
+    somas = {m: np.bincount(inverso, weights=df[m].to_numpy(dtype=np.float64, na_value=0), minlength=len(celulas)) for m in medidas}
+
+    cod_celulas = {}
+    for d in reversed(dimensoes):
+        celulas, cod_celulas[d] = np.divmod(celulas, len(categorias[d]) + 1)
+
+    resultado = {}
+    for nome, nivel in niveis.items():
+        validas = np.logical_and.reduce([cod_celulas[d] > 0 for d in nivel])
+        chaves_nivel = np.zeros(int(validas.sum()), dtype=np.int64)
+        for d in nivel:
+            chaves_nivel = chaves_nivel * (len(categorias[d]) + 1) + cod_celulas[d][validas]
+        grupos, inverso_nivel = np.unique(chaves_nivel, return_inverse=True)
+
+        tabela = {}
+        for d in reversed(nivel):
+            grupos, cod = np.divmod(grupos, len(categorias[d]) + 1)
+            tabela[d] = categorias[d].take(cod - 1)
+        tabela = {d: tabela[d] for d in nivel}
+        for m in medidas:
+            soma = np.bincount(inverso_nivel, weights=somas[m][validas], minlength=len(tabela[nivel[0]]))
+            tabela[m] = soma.astype(np.int64) if pd.api.types.is_integer_dtype(df[m]) else soma
+        resultado[nome] = pd.DataFrame(tabela)
+    return resultado
@@ -1,15 +1,29 @@
+import os
+import sys
 import json
 import math
-import requests
+import threading
 import numpy as np
 import pandas as pd
 import streamlit as st
-import geopandas as gpd
-import plotly.express as px
 import pyarrow
 # import plotly.graph_objects as gov
 import plotly.subplots as sp
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import malhas
+import dados
+import risco
+import exporta
+import figuras
+import graficos
+import municipios
+import distintos
+import susep
+from agrega import moda_por_grupo, somas_por_niveis
+from consulta import filtra, linhas, nova_cache
+from cubo import cria_cubo, conta_periodo, ocorrencias_por_municipio
 
 # -------------------- CONFIGURAÇÕES ----------------------
 titulo_pagina = 'OBSERVARIO  2024 - BY ® INTEGRAL SOLUÇÕES E GESTÃO :world_map:'
@@ -18,11 +32,16 @@ layout = 'wide'
 # st.set_page_config(layout=layout)
 st.set_page_config(page_title='Mapa de Eventos Climáticos', layout=layout)
 st.title(titulo_pagina)
+# malhas por URL (static/malhas, ver malhas.py) quando há quem sirva os arquivos; senão vão na figura
+malhas_por_url = bool(os.environ.get('MAPA_URL_MALHAS')) or st.get_option('server.enableStaticServing')
 # ---------------------------------------------------------
 
 @st.cache_resource
 def single():
     pd.set_option('compute.use_numexpr', False)
+    # as tabelas base são compartilhadas entre sessões; com copy-on-write, filtros e visões
+    # derivados delas não copiam dados e qualquer escrita copia só a parte alterada
+    pd.set_option('mode.copy_on_write', True)
 
 single()
 
@@ -38,31 +57,113 @@ def number_to_human(num):
     else:
         return f'R$ {num:.2f}'
 
-@st.cache_data
+@st.cache_resource
 def carrega_geojson(caminho):
     with open(caminho, 'r') as f:
         geoj = json.load(f)
     return geoj
 
-# @st.cache_data
-def filtra_geojson(geojson, iso, prop='codarea'):
-    gdf = gpd.GeoDataFrame.from_features(geojson)
-    return json.loads(gdf[gdf[prop] == iso].to_json())
+@st.cache_resource
+def carrega_versoes_geojson(caminho):
+    return malhas.carrega_versoes(caminho)
+
+@st.cache_resource
+def carrega_indice_malha(caminho):
+    return malhas.carrega_indice(caminho)
 
 @st.cache_data
 def carrega_dados(caminho_arquivo):
     df = pd.read_csv(caminho_arquivo, engine='pyarrow', dtype_backend='pyarrow')
     return df
 
-@st.cache_data
-def carrega_parquet(caminho_arquivo):
-    df = pd.read_parquet(caminho_arquivo, engine='pyarrow', dtype_backend='pyarrow')
+@st.cache_resource
+def tabela_base(caminho_arquivo, regiao=None):
+    # uma única cópia por processo, já com as colunas derivadas; nunca é entregue diretamente.
+    # Com regiao ('brasil' ou 'latam'), lê só as linhas daquela região, conferidas com o manifesto.
+    # Com as tabelas em Arrow IPC (python dados.py --arrow), abre o arquivo em memory map
+    df = dados.le_base(caminho_arquivo, regiao)
+    if os.path.basename(caminho_arquivo) == 'desastres_latam2.parquet':
+        return dados.ordena_atlas(df)
+    return prepara_psr(df) if os.path.basename(caminho_arquivo) == 'PSR_COMPLETO.parquet' else df
+
+def carrega_parquet(caminho_arquivo, regiao=None):
+    # visão copy-on-write da tabela base: não copia dados e escritas não chegam à base compartilhada
+    return tabela_base(caminho_arquivo, regiao).copy(deep=False)
+
+@st.cache_resource
+def particao_base(caminho_arquivo, uf, ano, colunas=None, inicio=None, fim=None):
+    df = dados.le_particao(caminho_arquivo, uf, ano, colunas, inicio, fim)
+    return prepara_psr(df) if caminho_arquivo == 'PSR_COMPLETO.parquet' else df
+
+def carrega_particao(caminho_arquivo, uf, ano, colunas=None, inicio=None, fim=None):
+    return particao_base(caminho_arquivo, uf, ano, colunas, inicio, fim).copy(deep=False)
+
+def modo_particionado(caminho_arquivo):
+    # com as tabelas em Arrow IPC (memory map), ler a base inteira não custa memória: fica o modo não particionado
+    return dados.tem_particoes(caminho_arquivo) and not dados.tem_arrow(caminho_arquivo)
+
+def carrega_fatia(caminho_arquivo, uf, inicio, fim, colunas=None, por_data=False):
+    # lê só as partições (uf, ano) do intervalo; cada partição fica em cache separadamente. Com
+    # por_data, as datas [inicio, fim) também vão para o scan: as partições das pontas trazem só os
+    # dias pedidos e as do meio, inteiras, continuam compartilhadas entre períodos
+    partes = [carrega_particao(caminho_arquivo, uf, ano, colunas,
+                               inicio if por_data and ano == inicio.year else None,
+                               fim if por_data and ano == fim.year else None)
+              for ano in range(inicio.year, fim.year + 1)]
+    return dados.concatena(partes)
+
+@st.cache_resource
+def cache_fatias(caminho_arquivo, regiao=None, uf=None, periodo=None):
+    # linhas já filtradas de uma tabela base (ou de uma fatia uf/período das partições), por plano de
+    # predicados; compartilhada entre sessões e reaproveitada por filtros mais restritos (consulta.py)
+    return nova_cache()
+
+@st.cache_resource
+def esboco_apolices(caminho_arquivo, uf=None, periodo=None, _psr=None):
+    # apólices distintas por (uf, município, cultura, mês) da tabela base ou de uma fatia uf/período
+    # das partições (distintos.py), para as contagens de num_apolice de qualquer período
+    return distintos.cria_esboco(_psr)
+
+@st.cache_resource
+def acumulado_susep(caminho_arquivo, uf=None, anos=None):
+    # valores da SUSEP por (uf, seguradora, ramo), acumulados por data (susep.py), da tabela base
+    # ou, com uf e anos, das partições desses anos
+    if uf is None:
+        return susep.cria_acumulado(tabela_base(caminho_arquivo))
+    return susep.cria_acumulado(carrega_fatia(caminho_arquivo, uf, date(anos[0], 1, 1), date(anos[1], 1, 1), colunas_susep))
+
+@st.cache_resource
+def sinistros_psr_base(particionado):
+    # sinistros por (uf, ano, tipologia), base dos heatmaps e da lista de eventos do Agro
+    if particionado:
+        filtro = dados.ds.field('descricao_tipologia') != '-'
+        return dados.conta_por_grupo('PSR_COMPLETO.parquet', ['uf', 'ano', 'descricao_tipologia'], filtro)
+    psr = tabela_base('PSR_COMPLETO.parquet')
+    return filtra(psr, [('descricao_tipologia', '!=', '-')]).groupby(['uf', 'ano', 'descricao_tipologia'], as_index=False, observed=True).size()
+
+def carrega_sinistros_psr(particionado):
+    return sinistros_psr_base(particionado).copy(deep=False)
+
+def prepara_psr(df):
+    df.seguradora = dados.mapeia_categorias(df.seguradora, seg)
+    df.pe_taxa = df.pe_taxa * 100
     return df
 
-@st.cache_data
+@st.cache_resource
+def carrega_indice_atlas(caminho_arquivo, regiao=None):
+    return dados.indexa_atlas(tabela_base(caminho_arquivo, regiao))
+
+@st.cache_resource
+def carrega_cubo(caminho_arquivo, regiao=None):
+    return cria_cubo(carrega_parquet(caminho_arquivo, regiao))
+
+@st.cache_resource
+def carrega_catalogo():
+    return municipios.cria_catalogo(tabela_base(area_file, 'brasil'), tabela_base(coord_muni_file), tabela_base(pop_pib_file))
+
+@st.cache_resource
 def carrega_malha(tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima'):
-    url = f'https://servicodados.ibge.gov.br/api/v3/malhas/{tipo}/{uf}?formato=application/vnd.geo+json&intrarregiao={intrarregiao}&qualidade={qualidade}'
-    return requests.get(url).json()
+    return malhas.obtem_versoes(tipo=tipo, uf=uf, intrarregiao=intrarregiao, qualidade=qualidade)
 
 def filtra_estado(df, uf):
     return df[(df.uf.eq(uf))]
@@ -74,25 +175,19 @@ def filtra_ano(df, inicio, fim):
     return df[(df.data.ge(f'{inicio}-01-01')) & (df.data.le(f'{fim}-12-30'))]
 
 def calcula_ocorrencias(df, cols_selecionadas, cols_agrupadas):
-    return df.groupby(cols_agrupadas, as_index=False)[cols_selecionadas].count().rename(columns={'protocolo': 'ocorrencias'})
+    return df.groupby(cols_agrupadas, as_index=False, observed=True)[cols_selecionadas].count().rename(columns={'protocolo': 'ocorrencias'})
 
-def classifica_risco(df, col_ocorrencias):
-    # df = dataframe.copy()
-    quartis = df[col_ocorrencias].quantile([0.2, 0.4, 0.6, 0.8]).values
-    risco = []
-    for valor in df[col_ocorrencias]:
-        if valor > quartis[3]:
-            risco.append('Muito Alto')
-        elif valor > quartis[2]:
-            risco.append('Alto')
-        elif valor > quartis[1]:
-            risco.append('Moderado')
-        elif valor > quartis[0]:
-            risco.append('Baixo')
-        else:
-            risco.append('Muito Baixo')
-    df['risco'] = risco
-    return df
+def classifica_risco(df, col_ocorrencias, quebras=None, esquema='quintis'):
+    # não altera df: devolve a classe de cada linha (categórico ordenado de Muito Baixo a Muito Alto).
+    # Sem quebras, elas são calculadas sobre o próprio df com o esquema pedido
+    if quebras is None:
+        quebras = risco.quebras(df[col_ocorrencias], esquema)
+    return risco.classifica(df[col_ocorrencias], quebras)
+
+@st.cache_resource(max_entries=256)
+def quebras_risco(escopo, grupo, tipologia, ano_inicial, ano_final, esquema, _valores):
+    # quebras por (escopo, tipologia, intervalo de anos); _valores fica fora da chave do cache
+    return risco.quebras(_valores, esquema)
 
 def classifica_segurado(df, munis, munis_segurados, munis_sinistrados):
     # df = dataframe.copy()
@@ -122,23 +217,27 @@ def classifica_lossratio(df):
     df['classe_sinistralidade'] = pd.cut(df.loss_ratio, [0.0, 20, 40, 60, 80, 100, 1000], labels=['Abaixo de 20%', 'De 20% a 40%', 'De 40% e 60%', 'De 60% e 80%', 'De 80% e 100%', 'Acima de 100%'])
     return df
 
-def cria_mapa(df, malha, locais='ibge', cor='ocorrencias', tons=None, tons_midpoint=None, nome_hover=None, dados_hover=None, lista_cores=None, lat=-14, lon=-53, zoom=3, titulo_legenda='Risco', featureid='properties.codarea', min_max=None):
-    ordem = {cor: list(lista_cores.keys())} if lista_cores else None
-    fig = px.choropleth_mapbox(
-        df, geojson=malha, color=cor,
-        color_continuous_scale=tons,
-        range_color=min_max,
-        color_continuous_midpoint=tons_midpoint,
-        color_discrete_map=lista_cores,
-        category_orders=ordem,
-        labels={'risco': 'Risco', 'ocorrencias': 'Ocorrências', 'code_muni': 'Código Municipal', 'sinistros': 'Sinistros',
-                'code_state': 'Código', 'desastre_mais_comum': 'Desastre mais comum', 'evento_mais_comum': 'Evento mais comum',
-                'seg': 'Tipo de Área Segurada', 'classe_sinistralidade': 'Classificação', 'loss_ratio': 'Índice de Sinistralidade'},
-        locations=locais, featureidkey=featureid,
-        center={'lat': lat, 'lon': lon}, zoom=zoom, 
-        mapbox_style='carto-positron', height=500,
-        hover_name=nome_hover, hover_data=dados_hover,
-        opacity=0.95
+@figuras.em_cache
+def cria_mapa(df, malha, locais='ibge', cor='ocorrencias', tons=None, tons_midpoint=None, nome_hover=None, dados_hover=None, lista_cores=None, lat=-14, lon=-53, zoom=3, titulo_legenda='Risco', featureid='properties.codarea', min_max=None, barra_cores=None):
+    if 'features' not in malha:
+        # malha em várias resoluções: usa a mais leve que ainda serve para o zoom do mapa
+        malha = malhas.escolhe_versao(malha, zoom)
+    if malhas_por_url:
+        try:
+            # o navegador baixa a malha uma vez; a figura leva só os códigos e as cores
+            malha = malhas.url_publicada(malha)
+        except OSError as e:
+            print(f'Aviso: não foi possível publicar a malha: {e}')
+    fig = graficos.mapa(
+        df, malha, locais, cor, featureid=featureid,
+        rotulos={'risco': 'Risco', 'ocorrencias': 'Ocorrências', 'code_muni': 'Código Municipal', 'sinistros': 'Sinistros',
+                 'code_state': 'Código', 'desastre_mais_comum': 'Desastre mais comum', 'evento_mais_comum': 'Evento mais comum',
+                 'seg': 'Tipo de Área Segurada', 'classe_sinistralidade': 'Classificação', 'loss_ratio': 'Índice de Sinistralidade'},
+        nome_hover=nome_hover, dados_hover=dados_hover,
+        mapa_cores=lista_cores, ordem=list(lista_cores.keys()) if lista_cores else None,
+        tons=tons, tons_midpoint=tons_midpoint, min_max=min_max,
+        centro={'lat': lat, 'lon': lon}, zoom=zoom,
+        estilo='carto-positron', altura=500, opacidade=0.95
     )
 
     fig.update_layout(
@@ -158,72 +257,61 @@ def cria_mapa(df, malha, locais='ibge', cor='ocorrencias', tons=None, tons_midpo
             traceorder="normal"
         )
     )
+    if barra_cores is not None:
+        # a figura volta do cache já serializada: ajustes na barra de cores entram aqui, não depois
+        fig.update_coloraxes(colorbar=barra_cores)
     
     return fig
 
+@figuras.em_cache
+def cria_heatmap(pivot, rotulos, tons, altura=None):
+    fig = graficos.heatmap(pivot, rotulos, tons)
+    fig.update_layout(yaxis_nticks=len(pivot))
+    if altura is not None:
+        fig.update_layout(height=altura)
+    return fig
+
+@figuras.em_cache
+def cria_bolhas(df):
+    fig = graficos.bolhas(df, 'ano', 'descricao_tipologia', 'ocorrencias', 'descricao_tipologia', mapa_de_cores,
+        rotulos={
+            "ano": "Ano",
+            "descricao_tipologia": "Desastre"
+        },
+        tamanho_max=50
+    )
+    fig.update_layout(showlegend=False, legend_orientation='h', margin={"r":0,"t":0,"l":0,"b":0})
+    fig.update_xaxes(showgrid=True)
+    return fig
+
+def botao_exportacao(local, nome_arquivo, tabela, chave, registros=None, sep=';', fontes=()):
+    # o arquivo só é gerado no clique e fica guardado por estado dos filtros (ver exporta.py);
+    # `registros` é uma função que devolve os registros filtrados em partes, para baixar as linhas
+    # brutas em vez da tabela resumida
+    painel = local.popover('Baixar tabela', use_container_width=True)
+    formato = painel.radio('Formato', exporta.disponiveis(), horizontal=True, key=f'formato_{chave[0]}')
+    completo = registros is not None and painel.toggle('Todos os registros filtrados', key=f'registros_{chave[0]}')
+    partes = registros if completo else (lambda: exporta.em_partes(tabela))
+    chave = chave + ('registros' if completo else 'tabela',)
+    extensao, mime = exporta.FORMATOS[formato]
+    painel.download_button(
+        f'Baixar {formato}', lambda: exporta.conteudo(chave, partes, formato, sep, fontes),
+        file_name=f'{nome_arquivo}.{extensao}', mime=mime, on_click='ignore', use_container_width=True,
+    )
+
 
 
 # VARIAVEIS
-import os
-import subprocess
-import sys
 
 # Get the current directory where the script is located
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Function to check if a file is a Git LFS pointer and pull it if needed
-def ensure_lfs_file(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read(100)  # Read just the beginning to check
-            if content.startswith('version https://git-lfs.github.com/spec/v1'):
-                print(f"Downloading LFS file: {file_path}")
-                try:
-                    # Try to pull the actual file content using git lfs
-                    subprocess.run(['git', 'lfs', 'pull', '--include', os.path.basename(file_path)], 
-                                  cwd=current_dir, check=True)
-                except (subprocess.SubprocessError, FileNotFoundError):
-                    print(f"Warning: Could not pull LFS file {file_path}. Git LFS might not be installed.")
-                    print("Please install Git LFS and run 'git lfs pull' in the repository.")
-    return file_path
-
-# Ensure all parquet files are properly downloaded
 desastres_file = os.path.join(current_dir, 'desastres_latam2.parquet')
 area_file = os.path.join(current_dir, 'area2.parquet')
 coord_uf_file = os.path.join(current_dir, 'coord_uf.parquet')
 coord_muni_file = os.path.join(current_dir, 'coord_muni.parquet')
 pop_pib_file = os.path.join(current_dir, 'pop_pib_muni.parquet')
 
-# Ensure files are downloaded from Git LFS if needed
-ensure_lfs_file(desastres_file)
-ensure_lfs_file(area_file)
-ensure_lfs_file(coord_uf_file)
-ensure_lfs_file(coord_muni_file)
-ensure_lfs_file(pop_pib_file)
-
-# Use absolute paths for parquet files
-try:
-    dados_atlas = carrega_parquet(desastres_file)
-    dados_merge = carrega_parquet(area_file)
-    coord_uf = carrega_parquet(coord_uf_file)
-    coord_muni = carrega_parquet(coord_muni_file)
-    pop_pib = carrega_parquet(pop_pib_file)
-except Exception as e:
-    st.error(f"Error loading parquet files: {str(e)}")
-    st.error(f"Current directory: {current_dir}")
-    st.error(f"Files in directory: {os.listdir(current_dir)}")
-    sys.exit(1)
-# pop_pib_uf = carrega_parquet('pop_pib_latam.parquet')
-# malha_america = carrega_geojson('malha_latam.json')
-# malha_brasil = carrega_geojson('malha_brasileira.json')
-
-# dados_susep = carrega_parquet('susep_agro.parquet')
-# psr = carrega_parquet('PSR_COMPLETO.parquet')
-# psr.seguradora = psr.seguradora.map(seg)
-# psr.pe_taxa = psr.pe_taxa * 100
-
-print(dados_atlas.info())
-
 
 estados = {
    'Acre': 'AC',
@@ -303,6 +391,13 @@ cores_risco = {
     'Baixo': '#72B7B2',
     'Muito Baixo': '#4C78A8'
 }
+# opções de classificação do risco: (esquema das quebras, quebras ajustadas no país inteiro)
+classificacoes_risco = {
+    'Quintis da UF': ('quintis', False),
+    'Quebras naturais (Jenks)': ('jenks', False),
+    'Intervalos iguais': ('intervalos', False),
+    'Quintis nacionais': ('quintis', True),
+}
 cores_segurado = {
     'Não Segurada': '#EECA3B',
     'Menos Sinistros que a Média': '#54A24B',
@@ -340,6 +435,10 @@ idx_select_br = {
     'Meteorológico': 3,
     'Outros': 1
 }
+# colunas lidas no modo particionado (o restante do arquivo nem sai do disco)
+colunas_psr = ('uf', 'ibge', 'municipio', 'data_apolice', 'ano', 'cultura', 'num_apolice', 'valor_premio', 'valor_subvencao', 'valor_indenizacao',
+               'descricao_tipologia', 'pe_taxa', 'prod_segurada', 'seguradora', 'area_total')
+colunas_susep = ('uf', 'data', 'seguradora', 'ramo', 'premio_dir', 'sin_dir', 'premio_ret', 'prem_ret_liq', 'salvados', 'recuperacao')
 seg = {
     'BRASILSEG COMPANHIA DE SEGUROS': 'Brasilseg', 
     'Mapfre Seguros Gerais S.A.': 'MAPFRE Seguros',
@@ -360,10 +459,240 @@ seg = {
     'Itaú XL Seguros Corporativos S.A': 'Itaú XL Seguros',
 }
 
-# COLUNAS
-tabs = st.tabs(['UF do Brasil', 'Agro', 'América Latina', 'Créditos'])
+cls_scales = {
+    'Climatológico': 'OrRd',
+    'Hidrológico': 'PuBu',
+    'Meteorológico': 'Tempo',
+    'Outros': 'Brwnyl'
+}
+
+
+
+# INICIALIZAÇÃO DOS DADOS
+# Uma vez por processo, antes de servir: os arquivos são conferidos com o manifesto (arquivos.json,
+# ver dados.py) e as tabelas base, índices e malhas são carregados em paralelo. Os reruns e as
+# sessões seguintes só encontram tudo no cache; nenhum git lfs pull roda no meio de uma requisição.
+@st.cache_resource
+def inicializa_dados():
+    problemas = dados.confere_arquivos()
+    for arquivo, problema in problemas.items():
+        print(f'Arquivo de dados com problema: {arquivo}: {problema}')
+    if problemas:
+        return problemas
+
+    tabelas = [(desastres_file, 'brasil'), (desastres_file, 'latam'), (area_file, 'brasil'), (area_file, 'latam'),
+               (coord_uf_file,), (coord_muni_file,), (pop_pib_file,), ('pop_pib_latam.parquet',), ('coord_latam3.parquet',)]
+    tabelas += [(arquivo,) for arquivo in ['PSR_COMPLETO.parquet', 'susep_agro2.parquet'] if not modo_particionado(arquivo)]
+    # as threads herdam o contexto da execução, como o cache do Streamlit espera
+    contexto = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=8, initializer=lambda: add_script_run_ctx(threading.current_thread(), contexto)) as executor:
+        cargas = [executor.submit(tabela_base, *args) for args in tabelas]
+        cargas += [executor.submit(carrega_versoes_geojson, malha) for malha in ['malha_brasileira.json', 'malha_latam.json']]
+        cargas += [executor.submit(carrega_indice_malha, 'malha_latam.json')]
+        cargas += [executor.submit(carrega_sinistros_psr, modo_particionado('PSR_COMPLETO.parquet'))]
+        try:
+            for carga in cargas:
+                carga.result()
+        except dados.ManifestoDivergente as erro:
+            print(f'Arquivo de dados com problema: {erro}')
+            return {erro.arquivo: str(erro)}
+        # derivados das tabelas base, depois delas
+        derivados = [executor.submit(carrega_indice_atlas, desastres_file, 'brasil'), executor.submit(carrega_cubo, desastres_file, 'brasil'),
+                     executor.submit(carrega_catalogo)]
+        if not modo_particionado('PSR_COMPLETO.parquet'):
+            derivados.append(executor.submit(esboco_apolices, 'PSR_COMPLETO.parquet', _psr=tabela_base('PSR_COMPLETO.parquet')))
+        if not modo_particionado('susep_agro2.parquet'):
+            derivados.append(executor.submit(acumulado_susep, 'susep_agro2.parquet'))
+        for carga in derivados:
+            carga.result()
+    return {}
+
+problemas_dados = inicializa_dados()
+if problemas_dados:
+    st.error('Arquivos de dados com problema, o app não foi iniciado:\n\n'
+             + '\n'.join(f'- `{arquivo}`: {problema}' for arquivo, problema in problemas_dados.items())
+             + '\n\nPara ponteiros do Git LFS, rode `git lfs pull` na pasta do app e reinicie o servidor.')
+    st.stop()
 
-with tabs[0]:
+# Use absolute paths for parquet files
+try:
+    dados_atlas = carrega_parquet(desastres_file, 'brasil')
+    dados_merge = carrega_parquet(area_file, 'brasil')
+    coord_uf = carrega_parquet(coord_uf_file)
+    coord_muni = carrega_parquet(coord_muni_file)
+    pop_pib = carrega_parquet(pop_pib_file)
+    indice_atlas = carrega_indice_atlas(desastres_file, 'brasil')
+    cubo_atlas = carrega_cubo(desastres_file, 'brasil')
+    catalogo_municipios = carrega_catalogo()
+except Exception as e:
+    st.error(f"Error loading parquet files: {str(e)}")
+    st.error(f"Current directory: {current_dir}")
+    st.error(f"Files in directory: {os.listdir(current_dir)}")
+    sys.exit(1)
+# pop_pib_uf = carrega_parquet('pop_pib_latam.parquet')
+# malha_america = carrega_geojson('malha_latam.json')
+# malha_brasil = carrega_geojson('malha_brasileira.json')
+
+# dados_susep = carrega_parquet('susep_agro.parquet')
+# psr = carrega_parquet('PSR_COMPLETO.parquet')
+# psr.seguradora = psr.seguradora.map(seg)
+# psr.pe_taxa = psr.pe_taxa * 100
+
+print(dados_atlas.info())
+
+
+# SEÇÕES DA ABA UF DO BRASIL
+# Cada seção é memoizada exatamente nos widgets que lê: trocar o município do zoom refaz só os
+# dois mapas, trocar a tipologia não refaz as bolhas nem o mapa de desastres comuns, etc.
+# Os resultados ficam em cache_resource (compartilhados e sem cópia), então são só lidos.
+@st.cache_resource(max_entries=64)
+def secao_bolhas(uf, grupo, ano_inicial, ano_final):
+    atlas_yearQ = conta_periodo(cubo_atlas, uf, ano_inicial, ano_final, grupo=grupo, por_ano=True)
+    atlas_year = atlas_yearQ.groupby(['ano', 'descricao_tipologia'], as_index=False, observed=True).ocorrencias.sum()
+    return cria_bolhas(atlas_year)
+
+def centro_mapa(uf, coord_municipio, zoom_uf=5):
+    # coord_municipio é o code_muni escolhido no zoom ('-' para a UF inteira)
+    registro = municipios.municipio(catalogo_municipios, coord_municipio) if coord_municipio != '-' else None
+    if registro is None or registro['lat'] is None:
+        lat, lon = filtra(coord_uf, [('abbrev_state', '==', uf)])[['lat', 'lon']].values[0]
+        return lat, lon, zoom_uf
+    return registro['lat'], registro['lon'], 10
+
+def nome_municipio(codigo):
+    # 'Nome (UF)': o selectbox reconhece o valor pelo rótulo, e só com a UF junto um município de
+    # mesmo nome em outra UF não continua selecionado quando a UF muda
+    return '-' if codigo == '-' else catalogo_municipios['registros'][codigo]['rotulo']
+
+def vai_para_municipio(chave_municipio, chave_uf):
+    # município de outra UF escolhido pela busca: a aba passa para a UF dele
+    registro = municipios.municipio(catalogo_municipios, st.session_state[chave_municipio])
+    if registro is not None:
+        st.session_state[chave_uf] = {sigla: nome for nome, sigla in estados.items()}[registro['uf']]
+
+@st.cache_resource(max_entries=64)
+def secao_desastre_comum(uf, grupo, ano_inicial, ano_final):
+    tipol_com_muni = conta_periodo(cubo_atlas, uf, ano_inicial, ano_final, grupo=grupo)
+    tipologias_mais_comuns_por_muni = moda_por_grupo(tipol_com_muni, 'ibge', 'descricao_tipologia', peso='ocorrencias').rename(columns={'descricao_tipologia': 'desastre_mais_comum'})
+    merge_muni_2 = filtra(dados_merge, [('abbrev_state', '==', uf)]).groupby(['code_muni', 'name_muni'], as_index=False).size().drop('size', axis=1)
+    tipol_merge = merge_muni_2.merge(tipologias_mais_comuns_por_muni, how='left', left_on='code_muni', right_on='ibge').drop('ibge', axis=1)
+    tipol_merge.loc[np.isnan(tipol_merge["ocorrencias"]), 'ocorrencias'] = 0
+    tipol_merge.desastre_mais_comum = tipol_merge.desastre_mais_comum.fillna('Sem Dados')
+    return tipol_merge
+
+@st.cache_resource(max_entries=64)
+def mapa_desastre_comum(uf, grupo, ano_inicial, ano_final, coord_municipio):
+    lat, lon, zoom = centro_mapa(uf, coord_municipio)
+    tipol_merge = secao_desastre_comum(uf, grupo, ano_inicial, ano_final)
+    return cria_mapa(tipol_merge, carrega_malha(uf=uf), locais='code_muni', cor='desastre_mais_comum', lista_cores=mapa_de_cores, nome_hover='name_muni', dados_hover=['desastre_mais_comum', 'ocorrencias'], zoom=zoom, lat=lat, lon=lon, titulo_legenda='Desastre mais comum')
+
+@st.cache_resource(max_entries=64)
+def ocorrencias_nacionais(grupo, tipologia, ano_inicial, ano_final):
+    # ocorrências de todos os municípios do país (zero onde não houve), base das quebras nacionais
+    periodo = conta_periodo(cubo_atlas, None, ano_inicial, ano_final, grupo=grupo, tipologia=tipologia)
+    contagem = periodo.groupby('ibge', observed=True).ocorrencias.sum()
+    return contagem.reindex(dados_merge.code_muni.unique(), fill_value=0).to_numpy()
+
+@st.cache_resource(max_entries=64)
+def secao_risco(uf, grupo, tipologia, ano_inicial, ano_final, esquema='quintis', nacional=False):
+    dados_atlas_query = conta_periodo(cubo_atlas, uf, ano_inicial, ano_final, grupo=grupo, tipologia=tipologia, por_ano=True)
+    ocorrencias = ocorrencias_por_municipio(dados_atlas_query)
+    merge_muni = filtra(dados_merge, [('abbrev_state', '==', uf)]).groupby(['code_muni', 'name_muni', 'AREA_KM2'], as_index=False).size().drop('size', axis=1).drop_duplicates(subset='code_muni', keep='first')
+    ocorrencias_merge = merge_muni.merge(ocorrencias, how='left', left_on='code_muni', right_on='ibge')
+    ocorrencias_merge.loc[np.isnan(ocorrencias_merge["ocorrencias"]), 'ocorrencias'] = 0
+    if nacional:
+        quebras = quebras_risco('Brasil', grupo, tipologia, ano_inicial, ano_final, esquema, ocorrencias_nacionais(grupo, tipologia, ano_inicial, ano_final))
+    else:
+        quebras = quebras_risco(uf, grupo, tipologia, ano_inicial, ano_final, esquema, ocorrencias_merge.ocorrencias)
+    classificacao_ocorrencias = ocorrencias_merge.assign(risco=classifica_risco(ocorrencias_merge, 'ocorrencias', quebras))
+
+    tabela = ocorrencias.copy().reset_index(drop=True).sort_values('ocorrencias', ascending=False).rename(columns={'ibge': 'codigo_municipal'})
+    tabela['ocorrencias_por_ano'] = tabela.ocorrencias / (ano_final - ano_inicial + 1)
+    tabela_merge = tabela.merge(pop_pib, how='left', left_on='codigo_municipal', right_on='code_muni').drop('code_muni', axis=1)
+    return dados_atlas_query, classificacao_ocorrencias, tabela_merge
+
+@st.cache_resource(max_entries=64)
+def mapa_risco(uf, grupo, tipologia, ano_inicial, ano_final, coord_municipio, rotulo, esquema='quintis', nacional=False):
+    lat, lon, zoom = centro_mapa(uf, coord_municipio)
+    classificacao_ocorrencias = secao_risco(uf, grupo, tipologia, ano_inicial, ano_final, esquema, nacional)[1]
+    return cria_mapa(classificacao_ocorrencias, carrega_malha(uf=uf), locais='code_muni', cor='risco', lista_cores=cores_risco, dados_hover='ocorrencias', nome_hover='name_muni', lat=lat, lon=lon, zoom=zoom, titulo_legenda=f'Risco de {rotulo}')
+
+@st.cache_resource(max_entries=64)
+def secao_danos(uf, tipologia):
+    line_query = dados.fatia_atlas(dados_atlas, indice_atlas, uf)
+    if tipologia is not None:
+        line_query = filtra(line_query, [('descricao_tipologia', '==', tipologia)])
+
+    cols_danos = ['agricultura', 'pecuaria', 'industria']  # 'total_danos_materiais'
+    soma_danos = line_query.groupby(['ano'], as_index=False)[cols_danos].sum()
+    fig_line = graficos.linhas(
+        soma_danos, 'ano', cols_danos,
+        rotulos={'value': 'Valor', 'variable': 'Setor', 'ano': 'Ano'},
+    )
+    fig_line.update_layout(
+    legend=dict(orientation="v",
+        font=dict(size=16))
+    )
+    return fig_line
+
+@st.cache_resource(max_entries=64)
+def secao_heatmap(grupo, tipologia):
+    # arrumar depois
+    cor_hm = cls_scales[grupo] if grupo is not None else 'Greys'
+    plano_hm = []
+    if grupo is not None:
+        plano_hm.append(('grupo_de_desastre', '==', grupo))
+    if tipologia is not None:
+        plano_hm.append(('descricao_tipologia', '==', tipologia))
+    heatmap_query = filtra(dados_atlas, plano_hm, cache=cache_fatias(desastres_file, 'brasil'))
+
+    pivot_hm = heatmap_query.pivot_table(index='ano', columns='uf', aggfunc='size', fill_value=0, observed=True)
+    pivot_hm = pivot_hm.reindex(columns=sorted(estados.values()), fill_value=0)
+    pivot_hm = pivot_hm.reindex(index=anos, fill_value=0).transpose()
+    return cria_heatmap(pivot_hm, dict(x="Ano", y="Estado (UF)", color="Total ocorrências"), cor_hm, altura=700)
+
+@st.cache_resource(max_entries=64)
+def secao_sinistralidade(uf, dt_inicial, dt_final, culturas, _psr):
+    # prêmio, subvenção e indenização por uf, município, mês e evento numa passada só sobre as
+    # apólices filtradas (_psr fica fora da chave do cache), com o índice de sinistralidade (%) de
+    # cada nível
+    niveis = somas_por_niveis(_psr, {'uf': ['uf'], 'municipio': ['ibge'], 'mes': ['ano', 'mes'], 'evento': ['descricao_tipologia']},
+                              ['valor_premio', 'valor_subvencao', 'valor_indenizacao'], colunas={'mes': _psr.data_apolice.dt.month})
+    for nivel in niveis.values():
+        nivel['loss_ratio'] = (nivel.valor_indenizacao / (nivel.valor_premio + nivel.valor_subvencao)) * 100
+    return niveis
+
+
+# ABAS
+# Cada aba é uma função e só a aba ativa roda a cada rerun (st.tabs executa o corpo de todas).
+# O Streamlit descarta o estado dos widgets que não foram desenhados no rerun; reatribuir as
+# chaves já existentes mantém as seleções das abas fechadas para quando o usuário voltar a elas.
+# Os widgets de intervalo (INTERVALOS) ficam de fora: guardam a seleção numa cópia (ver intervalo).
+INTERVALOS = {'periodo', 'dt_psr', 'periodo_br'}
+for chave in list(st.session_state.keys()):
+    if chave != 'aba' and chave not in INTERVALOS and not chave.startswith('FormSubmitter:'):
+        st.session_state[chave] = st.session_state[chave]
+
+uf_padrao = list(estados.keys())[17]
+
+
+def valor_inicial(chave, valor, opcoes=None):
+    # o valor inicial dos widgets com chave vem do session_state, não de index= (que conflitaria
+    # com a reatribuição acima); com opcoes, volta a ele também quando o valor guardado deixou de
+    # ser uma das opções
+    if chave not in st.session_state or (opcoes is not None and st.session_state[chave] not in opcoes):
+        st.session_state[chave] = valor
+
+
+def intervalo(elemento, chave, padrao, *args, **kwargs):
+    # select_slider e date_input só viram intervalo com value=, então a seleção não pode vir do
+    # session_state da chave: fica numa cópia (_chave), devolvida como value= quando a aba reabre
+    valor = elemento(*args, value=st.session_state.get(f'_{chave}', padrao), key=chave, **kwargs)
+    st.session_state[f'_{chave}'] = valor
+    return valor
+
+
+def aba_uf():
     secao1_uf = st.container()
     col_mapa1, col_dados1 = secao1_uf.columns([1, 1], gap='large')
     col_dados1.header('Parâmetros de Análise')
@@ -373,33 +702,20 @@ with tabs[0]:
 
 
     # SELECTBOX
-    uf_selectbox = select1.selectbox('Selecione o estado', list(estados.keys()), index=17)
+    valor_inicial('uf', uf_padrao)
+    uf_selectbox = select1.selectbox('Selecione o estado', list(estados.keys()), key='uf')
     uf_selecionado = estados[uf_selectbox]
-    grupo_desastre_selecionado = select2.selectbox('Selecione o grupo de desastre', ['Todos os Grupos de Desastre'] + list(desastres.keys()), index=0)
+    grupo_desastre_selecionado = select2.selectbox('Selecione o grupo de desastre', ['Todos os Grupos de Desastre'] + list(desastres.keys()), index=0, key='gp_desastre')
     # grupo_desastre_selecionado = select2.selectbox('Selecione o grupo de desastre', list(desastres.keys()), index=0)
     # ano_inicial, ano_final = col_dados.date_input('Selecione o Período a ser analisado', (date(1991, 1, 7), date(2022, 12, 30)), date(1991, 1, 7), date(2022, 12, 30), format="DD/MM/YYYY")
-    ano_inicial, ano_final = col_dados1.select_slider('Selecione o Intervalo de Anos', anos, value=(anos[0], anos[-1]))
+    ano_inicial, ano_final = intervalo(col_dados1.select_slider, 'periodo', (anos[0], anos[-1]), 'Selecione o Intervalo de Anos', anos)
 
 
 
     # BUBBLE PLOT
-    atlas_yearQ = dados_atlas.query("uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final")
-    if grupo_desastre_selecionado != 'Todos os Grupos de Desastre':
-        atlas_yearQ = atlas_yearQ.query("grupo_de_desastre == @grupo_desastre_selecionado")
-    atlas_year = atlas_yearQ.groupby(['ano', 'descricao_tipologia'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
+    grupo_cubo = grupo_desastre_selecionado if grupo_desastre_selecionado != 'Todos os Grupos de Desastre' else None
     # atlas_year = dados_atlas.query("grupo_de_desastre == @grupo_desastre_selecionado & uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final").groupby(['ano', 'descricao_tipologia'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
-
-
-
-    fig_grupo_desastre = px.scatter(atlas_year, x="ano", y='descricao_tipologia', size='ocorrencias', 
-        color='descricao_tipologia', size_max=50, color_discrete_map=mapa_de_cores,
-        labels={
-            "ano": "Ano", 
-            "descricao_tipologia": "Desastre"
-        }
-    )
-    fig_grupo_desastre.update_layout(showlegend=False, legend_orientation='h', margin={"r":0,"t":0,"l":0,"b":0})
-    fig_grupo_desastre.update_xaxes(showgrid=True)
+    fig_grupo_desastre = secao_bolhas(uf_selecionado, grupo_cubo, ano_inicial, ano_final)
     # col_dados.caption('Quanto maior o círculo, maior o número de ocorrências do desastre')
     col_dados1.plotly_chart(fig_grupo_desastre)
     # col_dados.title(" ")
@@ -413,68 +729,36 @@ with tabs[0]:
     # selecionando estado
     desastre_col, mun_col = col_dados2.columns([1, 1])
 
-    disasters = desastres[grupo_desastre_selecionado] if grupo_desastre_selecionado != 'Todos os Grupos de Desastre' else dados_atlas.descricao_tipologia.unique().tolist()
+    disasters = desastres[grupo_desastre_selecionado] if grupo_desastre_selecionado != 'Todos os Grupos de Desastre' else sorted(dados_atlas.descricao_tipologia.unique().tolist())
 
     tipol_name = 'Todos os Desasastres' if grupo_desastre_selecionado == 'Todos os Grupos de Desastre' else f'Todos os Desastres ({grupo_desastre_selecionado})'
     tipologia_selecionada = desastre_col.selectbox('Selecione a tipologia do desastre', [tipol_name] + disasters, index=0, key='tipol')
     # tipologia_selecionada = desastre_col.selectbox('Selecione a tipologia do desastre', desastres[grupo_desastre_selecionado], index=idx_select[grupo_desastre_selecionado], key='tipol')
-    coord_municipio = mun_col.selectbox('Encontrar município (zoom)',['-'] + dados_merge.iloc[:-45].query("abbrev_state == @uf_selecionado").name_muni.unique().tolist(), index=0)
-
-
-
-    # MALHA
-    malha_mun_estados = carrega_malha(uf=uf_selecionado)
-    zoom_uf = 5
-    if coord_municipio == '-':
-        lat, lon = coord_uf.query("abbrev_state == @uf_selecionado")[['lat', 'lon']].values[0]
-    else:
-        cod_muni = dados_merge.loc[dados_merge.name_muni == coord_municipio, 'code_muni'].values[0]
-        lat, lon = coord_muni.query("codarea == @cod_muni")[['lat', 'lon']].values[0]
-        zoom_uf = 10
+    busca_municipio = mun_col.text_input('Buscar município (todas as UFs)', key='busca_mun', placeholder='Nome do município')
+    opcoes_municipio = municipios.busca(catalogo_municipios, busca_municipio) if busca_municipio else municipios.opcoes_uf(catalogo_municipios, uf_selecionado)
+    coord_municipio = mun_col.selectbox('Encontrar município (zoom)', ['-'] + opcoes_municipio, index=0, key='coord_mun',
+                                        format_func=nome_municipio,
+                                        on_change=vai_para_municipio, args=('coord_mun', 'uf'))
 
 
 
     # MAPA DE DESASTRES COMUNS
-    tipol_com_muni = dados_atlas.query("uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final")
-    if grupo_desastre_selecionado != 'Todos os Grupos de Desastre':
-        tipol_com_muni = tipol_com_muni.query("grupo_de_desastre == @grupo_desastre_selecionado")
-
-    tipologias_mais_comuns_por_muni = tipol_com_muni.groupby(['ibge', 'descricao_tipologia'], as_index=False).size().sort_values('size', ascending=False).drop_duplicates(subset='ibge', keep='first').rename(columns={'size': 'ocorrencias', 'descricao_tipologia': 'desastre_mais_comum'})
     # tipologias_mais_comuns_por_muni = dados_atlas.query("grupo_de_desastre == @grupo_desastre_selecionado & uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final").groupby(['ibge', 'descricao_tipologia'], as_index=False).size().sort_values('size', ascending=False).drop_duplicates(subset='ibge', keep='first').rename(columns={'size': 'ocorrencias', 'descricao_tipologia': 'desastre_mais_comum'})
-
-    merge_muni_2 = dados_merge.query("abbrev_state == @uf_selecionado").groupby(['code_muni', 'name_muni'], as_index=False).size().drop('size', axis=1)
-    tipol_merge = merge_muni_2.merge(tipologias_mais_comuns_por_muni, how='left', left_on='code_muni', right_on='ibge').drop('ibge', axis=1)
-    tipol_merge.loc[np.isnan(tipol_merge["ocorrencias"]), 'ocorrencias'] = 0
-    tipol_merge.desastre_mais_comum = tipol_merge.desastre_mais_comum.fillna('Sem Dados')
     col_mapa1.header(f'Desastre mais comum por Município')
     # col_mapa1.header(f'Desastre mais comum por Município ({ano_inicial} - {ano_final})')
-    col_mapa1.plotly_chart(cria_mapa(tipol_merge, malha_mun_estados, locais='code_muni', cor='desastre_mais_comum', lista_cores=mapa_de_cores, nome_hover='name_muni', dados_hover=['desastre_mais_comum', 'ocorrencias'], zoom=zoom_uf, lat=lat, lon=lon, titulo_legenda='Desastre mais comum'), use_container_width=True)
-
-
-
+    col_mapa1.plotly_chart(mapa_desastre_comum(uf_selecionado, grupo_cubo, ano_inicial, ano_final, coord_municipio), use_container_width=True)
 
 
 
     # QUERY
-    dados_atlas_query = dados_atlas.query("uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final")
-    # dados_atlas_query = dados_atlas.query("descricao_tipologia == @tipologia_selecionada & uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final")
-    if grupo_desastre_selecionado != 'Todos os Grupos de Desastre':
-        dados_atlas_query = dados_atlas_query.query("grupo_de_desastre == @grupo_desastre_selecionado")
-
-    if tipologia_selecionada != tipol_name:
-        dados_atlas_query = dados_atlas_query.query("descricao_tipologia == @tipologia_selecionada")
-
+    tipologia_cubo = tipologia_selecionada if tipologia_selecionada != tipol_name else None
     # dados_atlas_query = dados_atlas.query("grupo_de_desastre == @grupo_desastre_selecionado & descricao_tipologia == @tipologia_selecionada & uf == @uf_selecionado & ano >= @ano_inicial & ano <= @ano_final")
+    esquema_risco, risco_nacional = classificacoes_risco[col_dados2.selectbox('Classificação do risco', list(classificacoes_risco.keys()), index=0, key='classe_risco')]
+    dados_atlas_query, classificacao_ocorrencias, tabela_merge = secao_risco(uf_selecionado, grupo_cubo, tipologia_cubo, ano_inicial, ano_final, esquema_risco, risco_nacional)
 
 
     # MAPA RISCO
-    ocorrencias = dados_atlas_query.groupby(['ibge', 'municipio'], as_index=False).size().rename(columns={'size': 'ocorrencias'}).sort_values('ocorrencias', ascending=False).drop_duplicates(subset='ibge', keep='first')
-    merge_muni = dados_merge.query("abbrev_state == @uf_selecionado").groupby(['code_muni', 'name_muni', 'AREA_KM2'], as_index=False).size().drop('size', axis=1).drop_duplicates(subset='code_muni', keep='first')
-    ocorrencias_merge = merge_muni.merge(ocorrencias, how='left', left_on='code_muni', right_on='ibge')
-    ocorrencias_merge.loc[np.isnan(ocorrencias_merge["ocorrencias"]), 'ocorrencias'] = 0
-
-    classificacao_ocorrencias = classifica_risco(ocorrencias_merge, 'ocorrencias')  # mudadr classficador
-    fig_mapa = cria_mapa(classificacao_ocorrencias, malha_mun_estados, locais='code_muni', cor='risco', lista_cores=cores_risco, dados_hover='ocorrencias', nome_hover='name_muni', lat=lat, lon=lon, zoom=zoom_uf, titulo_legenda=f'Risco de {tipologia_selecionada}')
+    fig_mapa = mapa_risco(uf_selecionado, grupo_cubo, tipologia_cubo, ano_inicial, ano_final, coord_municipio, tipologia_selecionada, esquema_risco, risco_nacional)
     # fig_mapa = cria_mapa(classificacao_ocorrencias, malha_mun_estados, locais='code_muni', cor='ocorrencias', tons=list(cores_risco.values()), dados_hover='ocorrencias', nome_hover='name_muni', lat=lat, lon=lon, zoom=5, titulo_legenda=f'Risco de {tipologia_selecionada}')
     # col_mapa.divider()
     # col_mapa.title(" ")
@@ -488,21 +772,18 @@ with tabs[0]:
     met1, met2 = col_dados2.columns([1, 1])
     met3, met4 = col_dados2.columns([1, 1])
 
-    met1.metric('Total de Ocorrências', len(dados_atlas_query))
-    med_anual = dados_atlas_query.groupby('ano').size().mean().astype(int) if dados_atlas_query.groupby('ano').size().any() else 0
+    ocorrencias_ano = dados_atlas_query.groupby('ano').ocorrencias.sum()
+    met1.metric('Total de Ocorrências', int(ocorrencias_ano.sum()))
+    med_anual = ocorrencias_ano.mean().astype(int) if ocorrencias_ano.any() else 0
     met2.metric('Média de Ocorrências por Ano', med_anual)
-    muni_ocorr = math.ceil(len(classificacao_ocorrencias.query("ocorrencias > 0")) / len(classificacao_ocorrencias) * 100)
+    muni_ocorr = math.ceil(len(filtra(classificacao_ocorrencias, [('ocorrencias', '>', 0)])) / len(classificacao_ocorrencias) * 100)
     met3.metric('% dos Municípios com no *mínimo* Uma Ocorrência', f'{muni_ocorr}%')
-    area_risco = math.ceil(classificacao_ocorrencias.loc[classificacao_ocorrencias.query("risco == 'Muito Alto' | risco == 'Alto'").index, "AREA_KM2"].sum() / classificacao_ocorrencias.AREA_KM2.sum() * 100)
+    area_risco = math.ceil(filtra(classificacao_ocorrencias, [('risco', 'isin', ['Muito Alto', 'Alto'])]).AREA_KM2.sum() / classificacao_ocorrencias.AREA_KM2.sum() * 100)
     met4.metric('% de Área Classificada como Risco *Alto* e *Muito Alto*', f'{area_risco}%')
 
 
 
     # DATAFRAME E DOWNLOAD
-    tabela = ocorrencias.copy().reset_index(drop=True).sort_values('ocorrencias', ascending=False).rename(columns={'ibge': 'codigo_municipal'})
-    tabela['ocorrencias_por_ano'] = tabela.ocorrencias / (ano_final - ano_inicial + 1)
-    tabela_merge = tabela.merge(pop_pib, how='left', left_on='codigo_municipal', right_on='code_muni').drop('code_muni', axis=1)
-
     expander = col_dados2.expander(f'Municípios com o maior risco de *{tipologia_selecionada}* em {uf_selecionado}', expanded=True)
     expander.dataframe(tabela_merge.head(), hide_index=True,
                        column_config={
@@ -517,46 +798,29 @@ with tabs[0]:
                             'ocorrencias_por_ano': st.column_config.NumberColumn('Média ocorrências/ano', format='%.1f')
                         })
     
-    col_dados2.download_button('Baixar tabela', tabela_merge.to_csv(sep=';', index=False), file_name=f'ocorrencias_{uf_selecionado}.csv', mime='text/csv', use_container_width=True)
+    plano_registros = [('uf', '==', uf_selecionado), ('ano', '>=', ano_inicial), ('ano', '<=', ano_final)]
+    if grupo_cubo is not None:
+        plano_registros.append(('grupo_de_desastre', '==', grupo_cubo))
+    if tipologia_cubo is not None:
+        plano_registros.append(('descricao_tipologia', '==', tipologia_cubo))
+    botao_exportacao(
+        col_dados2, f'ocorrencias_{uf_selecionado}', tabela_merge,
+        ('ocorrencias', uf_selecionado, grupo_cubo, tipologia_cubo, ano_inicial, ano_final, esquema_risco, risco_nacional),
+        registros=lambda: exporta.em_partes(dados_atlas, linhas(dados_atlas, plano_registros, cache_fatias(desastres_file, 'brasil'))),
+        fontes=dados.fontes((desastres_file, 'brasil'), (area_file, 'brasil'), pop_pib_file),
+    )
 
 
 
     # LINEPLOT
-    line_query = dados_atlas.iloc[:62273].query("uf == @uf_selecionado")
-    if tipologia_selecionada != tipol_name:
-        line_query = line_query.query("descricao_tipologia == @tipologia_selecionada")
-
-    cols_danos = ['agricultura', 'pecuaria', 'industria']  # 'total_danos_materiais'
-    soma_danos = line_query.groupby(['ano'], as_index=False)[cols_danos].sum()
     st.header(f'Danos causados por *{tipologia_selecionada}* em *{uf_selecionado} de 1991 a 2022*')
-
-    fig_line = px.line(
-        soma_danos, 'ano', cols_danos, markers=True, 
-        labels={'value': 'Valor', 'variable': 'Setor', 'ano': 'Ano'}, 
-        # line_shape='spline'
-    )
-    print(soma_danos.max())
-    fig_line.update_layout(
-    legend=dict(orientation="v",
-        font=dict(size=16))
-    )
+    fig_line = secao_danos(uf_selecionado, tipologia_cubo)
     st.plotly_chart(fig_line, use_container_width=True)      
 
 
 
     # HEATMAPS
     # aba_hm1, aba_hm2 = st.tabs(['Ocorrências por Grupo de Desastre', 'Ocorrências por Estado'])
-    cls_scales = {
-        'Climatológico': 'OrRd',
-        'Hidrológico': 'PuBu',
-        'Meteorológico': 'Tempo',
-        'Outros': 'Brwnyl'
-    }
-
-    # arrumar depois
-    cor_hm = cls_scales[grupo_desastre_selecionado] if grupo_desastre_selecionado != 'Todos os Grupos de Desastre' else 'Greys'
-
-    
     # with aba_hm1:
     #     heatmap_query2 = dados_atlas.iloc[:62273].query("grupo_de_desastre == @grupo_desastre_selecionado & uf == @uf_selecionado")
     #     pivot_hm2 = heatmap_query2.pivot_table(index='ano', columns='descricao_tipologia', aggfunc='size', fill_value=0)
@@ -593,41 +857,20 @@ with tabs[0]:
     #     st.subheader(f'Ocorrências de *{tipologia_selecionada}* por estado de 1991 a 2022')
     #     st.plotly_chart(fig_hm, use_container_width=True)
 
-    heatmap_query = dados_atlas.iloc[:62273]
-    # heatmap_query = dados_atlas.iloc[:62273].query("descricao_tipologia == @tipologia_selecionada")
-    if grupo_desastre_selecionado != 'Todos os Grupos de Desastre':
-        heatmap_query = heatmap_query.query("grupo_de_desastre == @grupo_desastre_selecionado")
-
-    if tipologia_selecionada != tipol_name:
-        heatmap_query = heatmap_query.query("descricao_tipologia == @tipologia_selecionada")
-
-    # heatmap_query = dados_atlas.iloc[:62273].query("grupo_de_desastre == @grupo_desastre_selecionado & descricao_tipologia == @tipologia_selecionada")
-    pivot_hm = heatmap_query.pivot_table(index='ano', columns='uf', aggfunc='size', fill_value=0)
-    pivot_hm = pivot_hm.reindex(columns=dados_atlas.uf.unique()[:-1], fill_value=0)
-    pivot_hm = pivot_hm.reindex(index=anos, fill_value=0).transpose()
-    fig_hm = px.imshow(
-        pivot_hm,
-        labels=dict(x="Ano", y="Estado (UF)", color="Total ocorrências"),
-        x=pivot_hm.columns,
-        y=pivot_hm.index,
-        color_continuous_scale=cor_hm,
-    )
-    fig_hm.update_layout(
-        yaxis_nticks=len(pivot_hm),
-        height=700
-    )
+    fig_hm = secao_heatmap(grupo_cubo, tipologia_cubo)
     st.header(f'Ocorrências de *{tipologia_selecionada}* por estado de 1991 a 2022')
     st.plotly_chart(fig_hm, use_container_width=True)
 
 
 
-with tabs[1]:
-    dados_susep = carrega_parquet('susep_agro2.parquet')
-    psr = carrega_parquet('PSR_COMPLETO.parquet')
-    psr.seguradora = psr.seguradora.map(seg)
-    psr.pe_taxa = psr.pe_taxa * 100
+def aba_agro():
+    psr_particionado = modo_particionado('PSR_COMPLETO.parquet')
+    susep_particionado = modo_particionado('susep_agro2.parquet')
+    sinistros_psr = carrega_sinistros_psr(psr_particionado)
+    if not psr_particionado:
+        psr = carrega_parquet('PSR_COMPLETO.parquet')
 
-    tipologias_psr = sorted(psr.descricao_tipologia.unique()[1:].tolist())
+    tipologias_psr = sorted(sinistros_psr.descricao_tipologia.unique().tolist())
 
     secao1_agro = st.container()
 
@@ -637,22 +880,33 @@ with tabs[1]:
     form_agro = col_metrics1.form('form_agro', border=False, clear_on_submit=False)
     col_config1, col_config2, col_config3 = form_agro.columns([1, 1, 1])
     
-    estado_psr = col_config1.selectbox('Estado', estados.keys(), index=17, key='uf_psr')
+    valor_inicial('uf_psr', uf_padrao)
+    estado_psr = col_config1.selectbox('Estado', estados.keys(), key='uf_psr')
     uf_psr = estados[estado_psr]
-    psrQ1 = psr.query("uf == @uf_psr")
-    dt_inicial_psr, dt_final_psr = col_config2.date_input('Data das Apólices', (date(2021, 1, 1), date(2021, 12, 31)), date(2006, 1, 7), date(2021, 12, 31), format="DD/MM/YYYY")
+    dt_inicial_psr, dt_final_psr = intervalo(col_config2.date_input, 'dt_psr', (date(2021, 1, 1), date(2021, 12, 31)), 'Data das Apólices', min_value=date(2006, 1, 7), max_value=date(2021, 12, 31), format="DD/MM/YYYY")
+    # todos os recortes do PSR partem da mesma tabela e da mesma cache de fatias: cultura, evento e
+    # pizza só estreitam as linhas de uf + período, sem varrer a tabela de novo
+    if psr_particionado:
+        psr = carrega_fatia('PSR_COMPLETO.parquet', uf_psr, dt_inicial_psr, dt_final_psr, colunas_psr, por_data=True)
+        fatias_psr = cache_fatias('PSR_COMPLETO.parquet', uf=uf_psr, periodo=(dt_inicial_psr, dt_final_psr))
+        esboco_psr = esboco_apolices('PSR_COMPLETO.parquet', uf=uf_psr, periodo=(dt_inicial_psr, dt_final_psr), _psr=psr)
+    else:
+        fatias_psr = cache_fatias('PSR_COMPLETO.parquet')
+        esboco_psr = esboco_apolices('PSR_COMPLETO.parquet', _psr=tabela_base('PSR_COMPLETO.parquet'))
+    plano_psr = [('uf', '==', uf_psr), ('data_apolice', '>=', dt_inicial_psr), ('data_apolice', '<', dt_final_psr)]
     # ano_psr = col_config2.selectbox('Ano de Subscrição', sorted(psrQ1.ano.unique().tolist(), reverse=True), index=0, key='ano_psr')
-    psrQ1 = psrQ1.query("data_apolice >= @dt_inicial_psr & data_apolice < @dt_final_psr")
+    psrQ1 = filtra(psr, plano_psr, cache=fatias_psr)
     # psrQ1 = psrQ1.query("ano == @ano_psr")
 
-    cultura_psr = col_config1.multiselect('Cultura Global', psrQ1.cultura.value_counts().index.tolist(), default=None, placeholder='Selecionar culturas', key='cultura_psr')
+    cultura_psr = col_config1.multiselect('Cultura Global', psrQ1.cultura.value_counts().loc[lambda n: n > 0].index.tolist(), default=None, placeholder='Selecionar culturas', key='cultura_psr')
     # cultura_psr = col_config3.selectbox('Cultura Global', ['Todas as Culturas'] + sorted(psrQ1.cultura.unique().tolist()), index=0, key='cultura_psr')
 
     enviar_form_agro = form_agro.form_submit_button('Aplicar Parâmetros')
     
     # if cultura_psr != 'Todas as Culturas':
+    plano_cultura = [('cultura', 'isin', cultura_psr)] if len(cultura_psr) > 0 else []
     if len(cultura_psr) > 0:
-        psrQ3 = psrQ1.query("cultura.isin(@cultura_psr)")
+        psrQ3 = filtra(psr, plano_psr + plano_cultura, cache=fatias_psr)
         # print(f'CULTURA: {cultura_psr}')
     else:
         psrQ3 = psrQ1
@@ -660,51 +914,40 @@ with tabs[1]:
 
 
     # METRICAS1
-    lr = psrQ3.groupby(['uf'], as_index=False)[['valor_premio', 'valor_subvencao', 'valor_indenizacao']].sum()
-    lr['loss_ratio'] = lr.valor_indenizacao / (lr.valor_premio + lr.valor_subvencao)
+    # uf, município, mês e evento saem da mesma agregação, guardada por uf + período + culturas
+    niveis_psr = secao_sinistralidade(uf_psr, dt_inicial_psr, dt_final_psr, tuple(cultura_psr), psrQ3)
+    lr = niveis_psr['uf']
 
     # metrica_psr_uf1, metrica_psr_uf2 = col_metrics.columns([1, 1])
-    col_config3.metric('Total de Apólices', psrQ3.num_apolice.nunique())
+    col_config3.metric('Total de Apólices', distintos.conta_distintos(esboco_psr, psrQ3, uf_psr, dt_inicial_psr, dt_final_psr, cultura_psr))
     # print(f'LEN APOL: {len(psrQ3.num_apolice)}')
     # col_config3.metric('Total de Apólices', len(psrQ3.num_apolice))
     # print(psrQ3.num_apolice.nunique())
-    lr_metric = f'{lr.loss_ratio.multiply(100).astype(int).values[0]}%' if not psrQ3.empty else '0%'
+    lr_metric = f'{lr.loss_ratio.astype(int).values[0]}%' if not psrQ3.empty else '0%'
     col_config3.metric(f'Índice de Sinistralidade', lr_metric)
 
-    coord_psr = col_config2.selectbox('Encontrar município (zoom)',['-'] + dados_merge.iloc[:-45].query("abbrev_state == @uf_psr").name_muni.unique().tolist(), index=0, key='coord_psr')
+    coord_psr = col_config2.selectbox('Encontrar município (zoom)', ['-'] + municipios.opcoes_uf(catalogo_municipios, uf_psr), index=0, key='coord_psr', format_func=nome_municipio)
 
 
 
-    zoom_uf_psr = 6
-    if coord_psr == '-':
-        lat_psr, lon_psr = coord_uf.query("abbrev_state == @uf_psr")[['lat', 'lon']].values[0]
-    else:
-        cod_muni_psr = dados_merge.loc[dados_merge.name_muni == coord_psr, 'code_muni'].values[0]
-        # print(cod_muni_psr)
-        lat_psr, lon_psr = coord_muni.query("codarea == @cod_muni_psr")[['lat', 'lon']].values[0]
-        # print(coord_muni.head())
-        zoom_uf_psr = 10
+    lat_psr, lon_psr, zoom_uf_psr = centro_mapa(uf_psr, coord_psr, zoom_uf=6)
 
 
 
     malha_psr = carrega_malha(uf=uf_psr)
-    merge_muni_psr = dados_merge.iloc[:-45].query("abbrev_state == @uf_psr")
+    merge_muni_psr = filtra(dados_merge, [('abbrev_state', '==', uf_psr)])
 
     # MAPA SINISTRALIDADE
-    sin_muni = psrQ3.groupby(['ibge'], as_index=False)[['valor_premio', 'valor_subvencao', 'valor_indenizacao']].sum().copy()
-    sin_muni['loss_ratio'] = (sin_muni.valor_indenizacao / (sin_muni.valor_premio + sin_muni.valor_subvencao)) * 100
-
-    sin_muni_merge = merge_muni_psr.merge(sin_muni, how='left', left_on='code_muni', right_on='ibge')
+    sin_muni_merge = merge_muni_psr.merge(niveis_psr['municipio'], how='left', left_on='code_muni', right_on='ibge')
     sin_muni_merge.loss_ratio = sin_muni_merge.loss_ratio.fillna(0)
     # sin_muni_merge.loss_ratio = sin_muni_merge.loss_ratio.fillna(1e-6)
     sin_muni_merge.ibge = sin_muni_merge.ibge.fillna('-')
     # sin_muni_lr = classifica_lossratio(sin_muni_merge)
 
-    fig_sinistralidade_muni = cria_mapa(sin_muni_merge, malha_psr, locais='code_muni', cor='loss_ratio', tons='Reds', min_max=[0, 120], dados_hover='loss_ratio', nome_hover='name_muni', lat=lat_psr, lon=lon_psr, zoom=zoom_uf_psr, titulo_legenda=f'Índice de Sinistralidade (%)')
+    fig_sinistralidade_muni = cria_mapa(sin_muni_merge, malha_psr, locais='code_muni', cor='loss_ratio', tons='Reds', min_max=[0, 120], dados_hover='loss_ratio', nome_hover='name_muni', lat=lat_psr, lon=lon_psr, zoom=zoom_uf_psr, titulo_legenda=f'Índice de Sinistralidade (%)',
+                                         barra_cores=dict(title='Índice de Sinistralidade (%)', tickvals=[0, 20, 40, 60, 80, 100], ticktext=['0', '20', '40', '60', '80', '100+'], orientation='h', yanchor='top', y=0.0))
     # fig_sinistralidade_muni = cria_mapa(sin_muni_lr, malha_psr, locais='code_muni', cor='classe_sinistralidade', lista_cores=cores_sinistralidade, dados_hover='loss_ratio', nome_hover='name_muni', lat=lat_psr, lon=lon_psr, zoom=zoom_uf_psr, titulo_legenda=f'Índice de Sinistralidade')
 
-    fig_sinistralidade_muni.update_coloraxes(colorbar=dict(title='Índice de Sinistralidade (%)', tickvals=[0, 20, 40, 60, 80, 100], ticktext=['0', '20', '40', '60', '80', '100+'], orientation='h', yanchor='top', y=0.0))
-
     col_mapa_agro1.header(f'Índice de Sinistralidade por Município')
     col_mapa_agro1.plotly_chart(fig_sinistralidade_muni, use_container_width=True)
 
@@ -712,18 +955,18 @@ with tabs[1]:
 
     fig_bar = sp.make_subplots(specs=[[{"secondary_y": True}]])
 
-    bar_data = psrQ3.groupby(['ano', psrQ1.data_apolice.dt.month]).num_apolice.nunique()
-    bar_data = bar_data.reset_index(level=['data_apolice', 'ano'])
-    bar_data.data_apolice = bar_data.data_apolice.astype(str).map(meses)
+    bar_data = distintos.conta_distintos(esboco_psr, psrQ3, uf_psr, dt_inicial_psr, dt_final_psr, cultura_psr, por=['ano', 'mes'])
+    bar_data = bar_data.reset_index(level=['mes', 'ano'])
+    bar_data.mes = bar_data.mes.astype(str).map(meses)
     bar_data.ano = bar_data.ano.astype(str)
-    bar_data['Mês'] = bar_data[['data_apolice', 'ano']].agg('-'.join, axis=1)
-    bar_data = bar_data.drop(['ano', 'data_apolice'], axis=1)
+    bar_data['Mês'] = bar_data[['mes', 'ano']].agg('-'.join, axis=1)
+    bar_data = bar_data.drop(['ano', 'mes'], axis=1)
 
     # bar_data = psrQ3.groupby(psrQ3.data_apolice.dt.month, as_index=False).num_apolice.nunique().rename(columns={'num_apolice': 'Apólices'})
     # print(bar_data.head())
     # bar_data = bar_data.set_index(['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez'])
     fig_bar.add_trace(
-        px.bar(bar_data, x='Mês', y='num_apolice', labels={'num_apolice': 'Apólices'}).data[0],
+        graficos.barras(bar_data, 'Mês', 'num_apolice', {'num_apolice': 'Apólices'}).data[0],
         secondary_y=False,
     )
     # fig_bar.add_trace(
@@ -731,17 +974,15 @@ with tabs[1]:
     #     secondary_y=False,
     # )
 
-    line_data = psrQ3.groupby(['ano', psrQ1.data_apolice.dt.month])[['valor_premio', 'valor_subvencao', 'valor_indenizacao']].sum().copy()
-    line_data = line_data.reset_index(level=['data_apolice', 'ano'])
-    line_data.data_apolice = line_data.data_apolice.astype(str).map(meses)
+    line_data = niveis_psr['mes'].copy()
+    line_data.mes = line_data.mes.astype(str).map(meses)
     line_data.ano = line_data.ano.astype(str)
-    line_data['Mês'] = line_data[['data_apolice', 'ano']].agg('-'.join, axis=1)
-    line_data = line_data.drop(['ano', 'data_apolice'], axis=1)
+    line_data['Mês'] = line_data[['mes', 'ano']].agg('-'.join, axis=1)
+    line_data = line_data.drop(['ano', 'mes'], axis=1)
     # line_data = psrQ3.groupby(psrQ3.data_apolice.dt.month, as_index=False)[['valor_premio', 'valor_subvencao', 'valor_indenizacao']].sum().copy()
-    line_data['loss_ratio'] = (line_data.valor_indenizacao / (line_data.valor_premio + line_data.valor_subvencao)) * 100
     fig_bar.add_trace(
         # go.Line(x=[2, 3, 4], y=[4, 5, 6], name="yaxis2 data"),
-        px.line(line_data, x='Mês', y='loss_ratio', labels={'loss_ratio': 'Índice de Sinistralidade (%)'}, color_discrete_sequence=['#ff0000'], markers=True).data[0],
+        graficos.linhas(line_data, 'Mês', 'loss_ratio', {'loss_ratio': 'Índice de Sinistralidade (%)'}, cores=['#ff0000']).data[0],
         secondary_y=True
     )
     # fig_bar.add_trace(
@@ -792,8 +1033,12 @@ with tabs[1]:
     # col_metrics.text(" ")
     # col_metrics.text(" ")
 
-    susepQ = dados_susep.query("uf == @uf_psr & data >= @dt_inicial_psr & data < @dt_final_psr")
-    top_seguradoras = susepQ.groupby(['seguradora'], as_index=False)['premio_dir'].sum().sort_values('premio_dir', ascending=False).seguradora.tolist()
+    # a seção da SUSEP só lê o acumulado: janela, seguradoras, meses e ramos saem dele
+    if susep_particionado:
+        acumulado = acumulado_susep('susep_agro2.parquet', uf=uf_psr, anos=(dt_inicial_psr.year, dt_final_psr.year))
+    else:
+        acumulado = acumulado_susep('susep_agro2.parquet')
+    top_seguradoras = susep.soma_periodo(acumulado, uf_psr, dt_inicial_psr, dt_final_psr, por='seguradora').premio_dir.sort_values(ascending=False).index.tolist()
     
 
 
@@ -807,14 +1052,11 @@ with tabs[1]:
 
 
     # QUERIES
-    psrQ2 = psrQ1.query("descricao_tipologia != '-'")
+    # evento e cultura num plano só, estreitando as linhas de psrQ1/psrQ3 já em cache
+    plano_sinistros = [('descricao_tipologia', '!=', '-')]
     if tipologia_selecionada_psr != 'Todos os Eventos':
-        psrQ2 = psrQ1.query("descricao_tipologia == @tipologia_selecionada_psr")
-
-    if len(cultura_psr) > 0:
-        psrQ2_2 = psrQ2.query("cultura.isin(@cultura_psr)")
-    else:
-        psrQ2_2 = psrQ2
+        plano_sinistros = [('descricao_tipologia', '==', tipologia_selecionada_psr)]
+    psrQ2_2 = filtra(psr, plano_psr + plano_cultura + plano_sinistros, cache=fatias_psr)
 
     # else:
     #     psrQ2 = psrQ1.query("descricao_tipologia != '-'")
@@ -827,7 +1069,7 @@ with tabs[1]:
     sin_merge.sinistros = sin_merge.sinistros.fillna(0)
     sin_merge.ibge = sin_merge.ibge.fillna('-')
     sin_quant = int(sin_merge['sinistros'].mean()) if len(sin) > 0 else 0
-    munis_sinistrados = sin_merge.query("sinistros > @sin_quant").ibge
+    munis_sinistrados = filtra(sin_merge, [('sinistros', '>', sin_quant)]).ibge
     # print(sin_quant)
     sin_segurado = classifica_segurado(sin_merge, merge_muni_psr.code_muni, psrQ1.ibge, munis_sinistrados)
     # sin_segurado = classifica_segurado(sin_merge, merge_muni_psr.code_muni, psrQ1.ibge, psrQ2.ibge)
@@ -852,10 +1094,10 @@ with tabs[1]:
 
 
 
-    atlas_psr = dados_atlas.query("uf == @uf_psr & data >= @dt_inicial_psr & data < @dt_final_psr")
+    atlas_psr = dados.fatia_atlas(dados_atlas, indice_atlas, uf_psr, data_inicial=dt_inicial_psr, data_final=dt_final_psr)
     # atlas_psr = dados_atlas.query("uf == @uf_psr & ano == @ano_psr")
     if tipologia_selecionada_psr != 'Todos os Eventos':
-        atlas_psr = atlas_psr.query("descricao_tipologia == @tipologia_selecionada_psr")
+        atlas_psr = filtra(atlas_psr, [('descricao_tipologia', '==', tipologia_selecionada_psr)])
 
     # METRICAS2
     col_metrics_col1, col_metrics_col2 = col_metrics2.columns([1, 1])
@@ -867,13 +1109,8 @@ with tabs[1]:
     # PIE CHART
     col_metrics2.write(f'**Representatividade dos Eventos Climáticos no Total Indenizado ({uf_psr} - {meses[str(dt_inicial_psr.month)]} {dt_inicial_psr.year} a {meses[str(dt_final_psr.month)]} {dt_final_psr.year})**')
     # col_metrics2.write(f'**Representatividade dos Eventos Climáticos no Total Indenizado ({uf_psr} - {ano_psr})**')
-    psrPie = psrQ3.drop(psrQ3.query("descricao_tipologia == '-'").index).groupby('descricao_tipologia')['valor_indenizacao'].sum()
-    figpie = px.pie(
-        psrPie,
-        values='valor_indenizacao',
-        names=psrPie.index,
-        #title=f'Representatividade dos Eventos Climáticos no Total Indenizado ({uf_psr} - {ano_psr})'
-    )
+    psrPie = filtra(niveis_psr['evento'], [('descricao_tipologia', '!=', '-')]).set_index('descricao_tipologia')['valor_indenizacao']
+    figpie = graficos.pizza(psrPie)
     figpie.update_layout(
         legend=dict(font=dict(size=16)),
         legend_title=dict(font=dict(size=14), text='Evento Climático')
@@ -958,20 +1195,20 @@ with tabs[1]:
     if len(psrQ2_2) > 0:
 
         # print(f'psrQ2_2:\n{psrQ2_2.head()}')
-        psrG_muni = psrQ2_2.groupby('municipio').agg({
+        psrG_muni = psrQ2_2.groupby('municipio', observed=True).agg({
             'descricao_tipologia': 'count',
             # 'NM_CULTURA_GLOBAL': lambda x: x.mode().iloc[0],
             'pe_taxa': 'mean',
             'prod_segurada': 'mean',
-            'seguradora': lambda x: x.mode().iloc[0],
         }).reset_index()
+        psrG_muni['seguradora'] = psrG_muni.municipio.map(moda_por_grupo(psrQ2_2, 'municipio', 'seguradora').set_index('municipio').seguradora)
         # print(f'psrG_muni:\n{psrG_muni.head()}')
 
-        psrApol_muni = psrQ2_2.groupby(['municipio'], as_index=False).size().merge(psrQ1.groupby(['municipio'], as_index=False)['num_apolice'].nunique(), how='left', on='municipio')
+        psrApol_muni = psrQ2_2.groupby(['municipio'], as_index=False, observed=True).size().merge(distintos.conta_distintos(esboco_psr, psrQ1, uf_psr, dt_inicial_psr, dt_final_psr, por=['municipio']).reset_index(), how='left', on='municipio')
         psrG_muni['apolices'] = psrApol_muni['num_apolice']
         psrG_muni['sin/apol'] = (psrApol_muni['size'] / psrApol_muni['num_apolice'])
 
-        psrG_muni = psrQ2_2.groupby(['municipio', 'cultura'], as_index=False)['area_total'].sum().sort_values('area_total', ascending=False).drop_duplicates('municipio', keep='first').merge(psrG_muni, how='right', on='municipio').drop('area_total', axis=1)
+        psrG_muni = moda_por_grupo(psrQ2_2, 'municipio', 'cultura', peso='area_total').merge(psrG_muni, how='right', on='municipio').drop('area_total', axis=1)
 
         col_order = ['municipio', 'cultura', 'apolices', 'descricao_tipologia', 'sin/apol', 'pe_taxa', 'prod_segurada', 'seguradora']
         tabela_cols = {
@@ -1013,7 +1250,13 @@ with tabs[1]:
             height=400,
             use_container_width=True
         )
-        st.download_button('Baixar tabela', psrG_muni.to_csv(sep=',', index=False), file_name=f'psr_{uf_psr}_{meses[str(dt_inicial_psr.month)]}{dt_inicial_psr.year}-{meses[str(dt_final_psr.month)]}{dt_final_psr.year}.csv', use_container_width=True)
+        plano_registros = plano_psr + plano_cultura + plano_sinistros
+        botao_exportacao(
+            st, f'psr_{uf_psr}_{meses[str(dt_inicial_psr.month)]}{dt_inicial_psr.year}-{meses[str(dt_final_psr.month)]}{dt_final_psr.year}', psrG_muni,
+            ('psr', uf_psr, dt_inicial_psr, dt_final_psr, tuple(sorted(cultura_psr)), tipologia_selecionada_psr),
+            registros=lambda: exporta.em_partes(psr, linhas(psr, plano_registros, fatias_psr)),
+            sep=',', fontes=dados.fontes('PSR_COMPLETO.parquet'),
+        )
         # st.download_button('Baixar tabela', psrG_muni.to_csv(sep=',', index=False), file_name=f'psr_{uf_psr}_{ano_psr}.csv', use_container_width=True)
 
 
@@ -1023,43 +1266,26 @@ with tabs[1]:
     st.title(" ")
 
     tabs_psr = st.tabs(['Sinistros por Evento Climático', 'Sinistros por Estado'])
-    hm_query_psr = psr.drop(psr.query("descricao_tipologia == '-'").index)
+    hm_query_psr = sinistros_psr
     if tipologia_selecionada_psr != 'Todos os Eventos':
-        hm_query_psr = psr.query("descricao_tipologia == @tipologia_selecionada_psr")
+        hm_query_psr = filtra(sinistros_psr, [('descricao_tipologia', '==', tipologia_selecionada_psr)])
 
     with tabs_psr[0]:
-        hm_query_psr_1 = psr.drop(psr.query("descricao_tipologia == '-'").index).query("uf == @uf_selecionado")
-        pivot_hm1_psr = hm_query_psr_1.pivot_table(index='ano', columns='descricao_tipologia', aggfunc='size', fill_value=0)
+        # mesma UF escolhida na aba UF do Brasil
+        uf_selecionado = estados[st.session_state.get('uf', uf_padrao)]
+        hm_query_psr_1 = filtra(sinistros_psr, [('uf', '==', uf_selecionado)])
+        pivot_hm1_psr = hm_query_psr_1.pivot_table(index='ano', columns='descricao_tipologia', values='size', aggfunc='sum', fill_value=0, observed=True)
         pivot_hm1_psr = pivot_hm1_psr.reindex(index=anos_psr, fill_value=0).transpose()
-        fig_hm1_psr = px.imshow(
-            pivot_hm1_psr,
-            labels=dict(x="Ano", y="Evento Climático", color="Sinistros"),
-            x=pivot_hm1_psr.columns,
-            y=pivot_hm1_psr.index,
-            color_continuous_scale='Greys',
-        )
-        fig_hm1_psr.update_layout(
-            yaxis_nticks=len(pivot_hm1_psr),
-        )
+        fig_hm1_psr = cria_heatmap(pivot_hm1_psr, dict(x="Ano", y="Evento Climático", color="Sinistros"), 'Greys')
         st.header(f'Número de Sinistros por Evento Climático de 2006 a 2021')
         st.plotly_chart(fig_hm1_psr, use_container_width=True)
 
 
     with tabs_psr[1]:
-        pivot_hm_psr = hm_query_psr.pivot_table(index='ano', columns='uf', aggfunc='size', fill_value=0)
+        pivot_hm_psr = hm_query_psr.pivot_table(index='ano', columns='uf', values='size', aggfunc='sum', fill_value=0, observed=True)
         # pivot_hm_psr = pivot_hm_psr.reindex(columns=psr.uf.unique(), fill_value=0)
         pivot_hm_psr = pivot_hm_psr.reindex(index=anos_psr, fill_value=0).transpose()
-        fig_hm_psr = px.imshow(
-            pivot_hm_psr,
-            labels=dict(x="Ano", y="Estado (UF)", color="Total de Sinistro"),
-            x=pivot_hm_psr.columns,
-            y=pivot_hm_psr.index,
-            color_continuous_scale='Greys',
-        )
-        fig_hm_psr.update_layout(
-            yaxis_nticks=len(pivot_hm_psr),
-            height=700
-        )
+        fig_hm_psr = cria_heatmap(pivot_hm_psr, dict(x="Ano", y="Estado (UF)", color="Total de Sinistro"), 'Greys', altura=700)
         st.header(f'Sinistros de *{tipologia_selecionada_psr}* por estado de 2006 a 2021')
         st.caption('Apenas os estados com pelo menos um sinistro serão exibidos')
         st.plotly_chart(fig_hm_psr, use_container_width=True)
@@ -1080,32 +1306,29 @@ with tabs[1]:
     susep_seg = form_susep.multiselect('Seguradoras', top_seguradoras, default=None, placeholder='Selecionar seguradoras', key='seguradora_psr')
     enviar_form_susep = form_susep.form_submit_button('Selecionar Seguradoras')
 
-    if len(susep_seg) > 0:
-        susepQ2 = susepQ.query("seguradora.isin(@susep_seg)")
-    else:
-        susepQ2 = susepQ
+    totais_susep = susep.soma_periodo(acumulado, uf_psr, dt_inicial_psr, dt_final_psr, susep_seg)
 
 
 
     susep_met_1, susep_met_2 = col_susep2.columns([1, 1])
-    susep_met_1.metric('Prêmios Diretos', number_to_human(susepQ2.premio_dir.sum()))
-    susep_met_2.metric('Sinistro Diretos', number_to_human(susepQ2.sin_dir.sum()))
-    susep_met_1.metric('Prêmios Retidos', number_to_human(susepQ2.premio_ret.sum()))
-    susep_met_2.metric('Prêmios Retidos (Líquido)', number_to_human(susepQ2.prem_ret_liq.sum()))
-    susep_met_1.metric('Salvados de Sinistros', number_to_human(susepQ2.salvados.sum()))
-    susep_met_2.metric('Recuperações', number_to_human(susepQ2.recuperacao.sum()))
+    susep_met_1.metric('Prêmios Diretos', number_to_human(totais_susep.premio_dir))
+    susep_met_2.metric('Sinistro Diretos', number_to_human(totais_susep.sin_dir))
+    susep_met_1.metric('Prêmios Retidos', number_to_human(totais_susep.premio_ret))
+    susep_met_2.metric('Prêmios Retidos (Líquido)', number_to_human(totais_susep.prem_ret_liq))
+    susep_met_1.metric('Salvados de Sinistros', number_to_human(totais_susep.salvados))
+    susep_met_2.metric('Recuperações', number_to_human(totais_susep.recuperacao))
 
     susep_tab1, susep_tab2 = col_susep1.tabs(['Prêmios e Sinsitros', 'Ramos do Seguro Rural'])
 
-    bar_susep = susepQ2.groupby([susepQ2.data.dt.year, susepQ2.data.dt.month], as_index=True)[['premio_dir', 'sin_dir']].sum()
-    bar_susep = bar_susep.reset_index(level=0).rename(columns={'data': 'Ano'})
-    bar_susep = bar_susep.reset_index(level=0).rename(columns={'data': 'Mês'})
+    bar_susep = susep.soma_por_mes(acumulado, uf_psr, dt_inicial_psr, dt_final_psr, susep_seg)[['premio_dir', 'sin_dir']]
+    bar_susep = bar_susep.reset_index(level=0).rename(columns={'ano': 'Ano'})
+    bar_susep = bar_susep.reset_index(level=0).rename(columns={'mes': 'Mês'})
     bar_susep.Mês = bar_susep.Mês.astype(str).map(meses)
     bar_susep.Ano = bar_susep.Ano.astype(str)
     bar_susep['Período'] = bar_susep[['Mês', 'Ano']].agg('-'.join, axis=1)
     bar_susep = bar_susep.drop(['Mês', 'Ano'], axis=1)
     bar_susep = bar_susep.rename(columns={'premio_dir': 'Prêmios Diretos', 'sin_dir': 'Sinistros Diretos'})
-    susepBar = px.bar(bar_susep, x='Período', y=['Prêmios Diretos', 'Sinistros Diretos'], barmode='group', labels={'value': 'Valor', 'variable': 'Tipo', 'Período': 'Período'})
+    susepBar = graficos.barras(bar_susep, 'Período', ['Prêmios Diretos', 'Sinistros Diretos'], {'value': 'Valor', 'variable': 'Tipo', 'Período': 'Período'}, modo='group')
 
     susep_tab1.write(f'**Prêmios e Sinistros diretos ({meses[str(dt_inicial_psr.month)]} {dt_inicial_psr.year} a {meses[str(dt_final_psr.month)]} {dt_final_psr.year})**')
     susep_tab1.plotly_chart(susepBar, use_container_width=True)
@@ -1120,16 +1343,12 @@ with tabs[1]:
         'recuperacao': 'Recuperações'
     }
     inv_susep_cols = {v: k for k, v in susep_cols.items()}
-    met_selecionada = susep_tab2.selectbox('Métrica', list(susep_cols.values()))
+    met_selecionada = susep_tab2.selectbox('Métrica', list(susep_cols.values()), key='met_susep')
 
     susep_tab2.write(f'**Representatividade dos Tipos de Seguro no valor dos {met_selecionada} ({meses[str(dt_inicial_psr.month)]} {dt_inicial_psr.year} a {meses[str(dt_final_psr.month)]} {dt_final_psr.year})**')
 
-    susepPie = susepQ2.groupby(['ramo'])[inv_susep_cols[met_selecionada]].sum()
-    susepPie = px.pie(
-        susepPie,
-        values=inv_susep_cols[met_selecionada],
-        names=susepPie.index
-    )
+    susepPie = susep.soma_periodo(acumulado, uf_psr, dt_inicial_psr, dt_final_psr, susep_seg, por='ramo')[inv_susep_cols[met_selecionada]]
+    susepPie = graficos.pizza(susepPie)
     susepPie.update_layout(
         legend=dict(font=dict(size=16)),
         legend_title=dict(font=dict(size=14), text='Tipo de Seguro')
@@ -1138,11 +1357,14 @@ with tabs[1]:
 
 
 
-with tabs[2]:
+def aba_latam():
     pop_pib_uf = carrega_parquet('pop_pib_latam.parquet')
-    malha_america = carrega_geojson('malha_latam.json')
-    malha_brasil = carrega_geojson('malha_brasileira.json')
+    malha_america = carrega_versoes_geojson('malha_latam.json')
+    malha_brasil = carrega_versoes_geojson('malha_brasileira.json')
     coord_latam = carrega_parquet('coord_latam3.parquet')
+    atlas_latam = carrega_parquet(desastres_file, 'latam')
+    area_latam = carrega_parquet(area_file, 'latam')
+    indice_america = carrega_indice_malha('malha_latam.json')
 
     secao1_latam = st.container()
     col_mapa_br1, col_dados_br1 = secao1_latam.columns([1, 1], gap='large')
@@ -1150,29 +1372,25 @@ with tabs[2]:
 
     # SELECTBOX
     grupo_desastre_selecionado_br = col_dados_br1.selectbox('Selecione o grupo de desastre', list(desastres.keys()), index=0, key='gp_desastre_br')
-    ano_inicial_br, ano_final_br = col_dados_br1.select_slider('Selecione o Intervalo de Anos', anos_latam, value=(anos_latam[0], anos_latam[-1]), key='periodo_br')
+    ano_inicial_br, ano_final_br = intervalo(col_dados_br1.select_slider, 'periodo_br', (anos_latam[0], anos_latam[-1]), 'Selecione o Intervalo de Anos', anos_latam)
 
 
 
     # QUERY
-    dados_atlas_query_br_1 = dados_atlas.query("grupo_de_desastre == @grupo_desastre_selecionado_br & ano >= @ano_inicial_br & ano <= @ano_final_br")
+    filtro_latam = [('grupo_de_desastre', '==', grupo_desastre_selecionado_br), ('ano', '>=', ano_inicial_br), ('ano', '<=', ano_final_br)]
+    dados_atlas_query_br_1 = dados.concatena([
+        filtra(dados_atlas, filtro_latam, cache=cache_fatias(desastres_file, 'brasil')),
+        filtra(atlas_latam, filtro_latam, cache=cache_fatias(desastres_file, 'latam')),
+    ])
     
 
 
     # BUBBLE PLOT
-    atlas_year_br = dados_atlas_query_br_1.groupby(['ano', 'descricao_tipologia'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
+    atlas_year_br = dados_atlas_query_br_1.groupby(['ano', 'descricao_tipologia'], as_index=False, observed=True).size().rename(columns={'size': 'ocorrencias'})
 
 
 
-    fig_grupo_desastre_br = px.scatter(atlas_year_br, x="ano", y='descricao_tipologia', size='ocorrencias', 
-        color='descricao_tipologia', size_max=50, color_discrete_map=mapa_de_cores,
-        labels={
-            "ano": "Ano", 
-            "descricao_tipologia": "Desastre"
-        }
-    )
-    fig_grupo_desastre_br.update_layout(showlegend=False, legend_orientation='h', margin={"r":0,"t":0,"l":0,"b":0})
-    fig_grupo_desastre_br.update_xaxes(showgrid=True)
+    fig_grupo_desastre_br = cria_bolhas(atlas_year_br)
     # col_dados_br.caption('Quanto maior o círculo, maior o número de ocorrências do desastre')
     col_dados_br1.plotly_chart(fig_grupo_desastre_br)
 
@@ -1187,17 +1405,21 @@ with tabs[2]:
     # selecionando estado
     col_pais, col_desastre = col_dados_br2.columns([1, 1])
 
-    pais_selecionado = col_pais.selectbox('Selecione o país', sorted(dados_merge.iloc[-45:].name_state.unique()), index=7, key='pais_br')
-    iso = dados_merge.loc[dados_merge.name_state == pais_selecionado, 'code_state'].values[0]
-    malha_pais_selecionado = malha_brasil if iso == 'BRA' else filtra_geojson(malha_america, iso)
+    paises = sorted(area_latam.name_state.unique())
+    valor_inicial('pais_br', paises[7])
+    pais_selecionado = col_pais.selectbox('Selecione o país', paises, key='pais_br')
+    iso = area_latam.loc[area_latam.name_state == pais_selecionado, 'code_state'].values[0]
+    malha_pais_selecionado = malha_brasil if iso == 'BRA' else malhas.malha_area(indice_america, iso, zoom=1)
     
-    tipologia_selecionada_br = col_desastre.selectbox('Selecione a tipologia do desastre', desastres[grupo_desastre_selecionado_br], index=idx_select_br[grupo_desastre_selecionado_br], key='tipol_br')
+    tipologias_br = desastres[grupo_desastre_selecionado_br]
+    valor_inicial('tipol_br', tipologias_br[idx_select_br[grupo_desastre_selecionado_br]], tipologias_br)
+    tipologia_selecionada_br = col_desastre.selectbox('Selecione a tipologia do desastre', tipologias_br, key='tipol_br')
 
 
 
     # MAPA DE DESASTRES COMUNS
-    tipologias_mais_comuns_por_estado = dados_atlas_query_br_1.groupby(['pais', 'descricao_tipologia'], as_index=False).size().sort_values('size', ascending=False).drop_duplicates(subset='pais', keep='first').rename(columns={'size': 'ocorrencias', 'descricao_tipologia': 'desastre_mais_comum'})
-    tipol_br = dados_merge.groupby(['code_state', 'name_state'], as_index=False).size().drop('size', axis=1)
+    tipologias_mais_comuns_por_estado = moda_por_grupo(dados_atlas_query_br_1, 'pais', 'descricao_tipologia').rename(columns={'size': 'ocorrencias', 'descricao_tipologia': 'desastre_mais_comum'})
+    tipol_br = area_latam.groupby(['code_state', 'name_state'], as_index=False).size().drop('size', axis=1)
     tipol_merge_br = tipol_br.merge(tipologias_mais_comuns_por_estado, how='left', left_on='name_state', right_on='pais').drop('pais', axis=1)
     tipol_merge_br.loc[np.isnan(tipol_merge_br['ocorrencias']), 'ocorrencias'] = 0
     tipol_merge_br.desastre_mais_comum = tipol_merge_br.desastre_mais_comum.fillna('Sem Dados')
@@ -1208,7 +1430,7 @@ with tabs[2]:
 
 
     # QUERY
-    dados_atlas_query_br_2 = dados_atlas_query_br_1.query("descricao_tipologia == @tipologia_selecionada_br")
+    dados_atlas_query_br_2 = filtra(dados_atlas_query_br_1, [('descricao_tipologia', '==', tipologia_selecionada_br)])
 
 
 
@@ -1216,18 +1438,19 @@ with tabs[2]:
     # col_mapa_br.divider()  
     col_mapa_br2.header(f'{pais_selecionado}: Risco de {tipologia_selecionada_br} ({ano_inicial_br} - {ano_final_br})')
 
-    ocorrencias_br = dados_atlas_query_br_2.groupby(['cod_uf', 'pais'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
+    ocorrencias_br = dados_atlas_query_br_2.groupby(['cod_uf', 'pais'], as_index=False, observed=True).size().rename(columns={'size': 'ocorrencias'})
 
-    merge_ufs = dados_merge.iloc[:-45].groupby(['code_state', 'name_state'], as_index=False).size().drop('size', axis=1)
-    merge_paises = dados_merge.iloc[-45:].drop(['code_muni', 'name_muni'], axis=1)
+    merge_ufs = dados_merge.groupby(['code_state', 'name_state'], as_index=False).size().drop('size', axis=1)
+    merge_paises = area_latam.drop(['code_muni', 'name_muni'], axis=1)
     merge_escolhido = merge_ufs if iso == 'BRA' else merge_paises
     ocorrencias_merge_br = merge_escolhido.merge(ocorrencias_br, how='left', left_on='code_state', right_on='cod_uf')
     ocorrencias_merge_br.loc[np.isnan(ocorrencias_merge_br["ocorrencias"]), 'ocorrencias'] = 0
-    classificacao_ocorrencias_br = classifica_risco(ocorrencias_merge_br, 'ocorrencias')
+    quebras_br = quebras_risco(iso, grupo_desastre_selecionado_br, tipologia_selecionada_br, ano_inicial_br, ano_final_br, 'quintis', ocorrencias_merge_br.ocorrencias)
+    classificacao_ocorrencias_br = ocorrencias_merge_br.assign(risco=classifica_risco(ocorrencias_merge_br, 'ocorrencias', quebras_br))
 
     fig_mapa_br = cria_mapa(classificacao_ocorrencias_br, malha_pais_selecionado, locais='code_state', cor='risco', lista_cores=cores_risco, dados_hover='ocorrencias', nome_hover='name_state', titulo_legenda=f'Risco de {tipologia_selecionada_br}', zoom=1, featureid='properties.codarea')
 
-    coord_pais = coord_latam.query("cod_uf == @iso & ano >= @ano_inicial_br & ano <= @ano_final_br & descricao_tipologia == @tipologia_selecionada_br")
+    coord_pais = filtra(coord_latam, [('cod_uf', '==', iso), ('ano', '>=', ano_inicial_br), ('ano', '<=', ano_final_br), ('descricao_tipologia', '==', tipologia_selecionada_br)])
 
     # if iso != 'BRA':
     #     fig_mapa_br.add_trace(
@@ -1244,7 +1467,7 @@ with tabs[2]:
 
 
     # DADOS
-    dados_tabela = dados_atlas_query_br_1.query("descricao_tipologia == @tipologia_selecionada_br").groupby(['pais'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
+    dados_tabela = dados_atlas_query_br_2.groupby(['pais'], as_index=False, observed=True).size().rename(columns={'size': 'ocorrencias'})
     tabela_br = dados_tabela.copy().reset_index(drop=True).sort_values('ocorrencias', ascending=False)
     tabela_br['ocorrencias_por_ano'] = round(tabela_br.ocorrencias.div(ano_final_br - ano_inicial_br + 1), 1)
   
@@ -1252,14 +1475,16 @@ with tabs[2]:
     tabela_merge_br.loc[np.isnan(tabela_merge_br["ocorrencias"]), 'ocorrencias'] = 0
     tabela_merge_br.loc[np.isnan(tabela_merge_br["ocorrencias_por_ano"]), 'ocorrencias_por_ano'] = 0.0
     tabela_merge_br = tabela_merge_br.sort_values('ocorrencias', ascending=False)
-    tabela_merge_br.loc[tabela_merge_br.query("cod_uf == 'VEN'").index, 'pais'] = 'Venezuela'
+    # pais pode sair categórico do merge (mesmas categorias dos dois lados), e 'Venezuela' não é uma delas
+    tabela_merge_br['pais'] = tabela_merge_br.pais.astype(object)
+    tabela_merge_br.loc[filtra(tabela_merge_br, [('cod_uf', '==', 'VEN')]).index, 'pais'] = 'Venezuela'
 
 
 
     # MÉTRICAS
     met1_br, met2_br = col_dados_br2.columns([1, 1])
-    met1_br.metric('Total de ocorrências', tabela_merge_br.query("pais == @pais_selecionado")['ocorrencias'])
-    met2_br.metric('Média de ocorrências por ano', tabela_merge_br.query("pais == @pais_selecionado")['ocorrencias_por_ano'])
+    met1_br.metric('Total de ocorrências', filtra(tabela_merge_br, [('pais', '==', pais_selecionado)])['ocorrencias'])
+    met2_br.metric('Média de ocorrências por ano', filtra(tabela_merge_br, [('pais', '==', pais_selecionado)])['ocorrencias_por_ano'])
 
     
 
@@ -1277,27 +1502,22 @@ with tabs[2]:
                             'ocorrencias_por_ano': st.column_config.NumberColumn('Média ocorrências/ano', format='%.1f')
                         })
 
-    col_dados_br2.download_button('Baixar tabela', tabela_merge_br.to_csv(sep=';', index=False), file_name=f'{tipologia_selecionada_br.replace(" ", "_").lower()}_americalatina.csv', mime='text/csv', use_container_width=True)
+    botao_exportacao(
+        col_dados_br2, f'{tipologia_selecionada_br.replace(" ", "_").lower()}_americalatina', tabela_merge_br,
+        ('americalatina', grupo_desastre_selecionado_br, ano_inicial_br, ano_final_br, tipologia_selecionada_br),
+        registros=lambda: exporta.em_partes(dados_atlas_query_br_2),
+        fontes=dados.fontes((desastres_file, 'brasil'), (desastres_file, 'latam'), 'pop_pib_latam.parquet'),
+    )
 
 
 
     
-    heatmap_query_br = dados_atlas.iloc[62273:].query("descricao_tipologia == @tipologia_selecionada_br & ano >= 2000")
-    pivot_hm_br = heatmap_query_br.pivot_table(index='ano', columns='pais', aggfunc='size', fill_value=0)
+    heatmap_query_br = filtra(atlas_latam, [('descricao_tipologia', '==', tipologia_selecionada_br), ('ano', '>=', 2000)])
+    pivot_hm_br = heatmap_query_br.pivot_table(index='ano', columns='pais', aggfunc='size', fill_value=0, observed=True)
     # pivot_hm_br = pivot_hm_br.reindex(columns=dados_atlas.pais.unique(), fill_value=0)
     pivot_hm_br = pivot_hm_br.reindex(index=anos_latam, fill_value=0).transpose()
     # print(pivot_hm_br.head())
-    fig_hm_br = px.imshow(
-        pivot_hm_br,
-        labels=dict(x="Ano", y="País", color="Total ocorrências"),
-        x=pivot_hm_br.columns,
-        y=pivot_hm_br.index,
-        color_continuous_scale=cls_scales[grupo_desastre_selecionado_br],
-    )
-    fig_hm_br.update_layout(
-        yaxis_nticks=len(pivot_hm_br),
-        height=700
-    )
+    fig_hm_br = cria_heatmap(pivot_hm_br, dict(x="Ano", y="País", color="Total ocorrências"), cls_scales[grupo_desastre_selecionado_br], altura=700)
     st.header(f'Ocorrências de *{tipologia_selecionada_br}* por País de 2000 a 2023')
     st.caption('Países sem ocorrências não aparecem no gráfico')
     st.plotly_chart(fig_hm_br, use_container_width=True)
@@ -1347,7 +1567,7 @@ with tabs[2]:
 #     # secao1_clima.image("sant'ana.jpeg", use_column_width=True)
 
 
-with tabs[-1]:
+def aba_creditos():
     col_creditos1, col_creditos2 = st.columns([1, 1], gap='large')
 
     col_creditos1.subheader('INTEGRAL SOLUCOES E GESTAO (https://aisistens.com.br)')
@@ -1368,3 +1588,18 @@ with tabs[-1]:
     ''')
                         
     
+
+
+abas = {
+    'UF do Brasil': aba_uf,
+    'Agro': aba_agro,
+    'América Latina': aba_latam,
+    'Créditos': aba_creditos,
+}
+aba = st.radio('Aba', list(abas.keys()), horizontal=True, key='aba', label_visibility='collapsed')
+abas[aba]()
+
+# contadores da cache de figuras (do processo, somados desde a subida), uma linha por rerun
+uso = figuras.contagem()
+print(f'Figuras em cache: {uso["acertos"]} acertos, {uso["faltas"]} faltas, {uso["descartes"]} descartes; '
+      f'{uso["figuras"]} guardadas, {uso["bytes"] / 2 ** 20:.1f} MB')
@@ -0,0 +1,274 @@
+import os
+import operator
+import importlib.util
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# CONSULTAS
+# Os filtros do app são planos de predicados (coluna, operador, valor) em vez de strings do
+# DataFrame.query. Um plano é só uma lista: filtros encadeados viram a concatenação das listas e
+# rodam numa passada, gerando uma máscara única e uma única cópia da tabela. O motor padrão é o
+# pyarrow.compute (colunas categóricas são comparadas no dicionário e espalhadas pelos códigos);
+# DuckDB é opcional. Para escolher: MAPA_MOTOR_CONSULTA=pandas|arrow|duckdb; o motor é resolvido
+# na importação e, se não estiver disponível, fica o pyarrow (com um aviso). O pandas só responde
+# no lugar do motor escolhido quando ele não sabe avaliar um predicado (NaoSuportado: tipos que o
+# Arrow não converte ou não compara); outros erros do motor sobem.
+# Conferência dos motores contra o DataFrame.query: pytest tests/test_consulta.py
+#
+# FATIAS EM CACHE
+# Com cache=nova_cache(), filtra guarda as posições das linhas de cada plano já calculado (int32,
+# chaveadas pelo plano normalizado). Um plano igual volta direto; um plano mais restrito que outro
+# já guardado (mais predicados, isin menor, intervalo de datas dentro do anterior) só avalia o que
+# falta sobre as linhas daquele plano, sem varrer a tabela inteira. A cache vale para uma tabela
+# base; se chega outra tabela (recarregada, reparticionada), a cache recomeça. A tabela é
+# reconhecida pelo número de carga (attrs['carga'], posto por dados.para_pandas e mantido pelas
+# visões) ou, sem ele, pelo próprio objeto, que a cache segura para o id não ser reaproveitado.
+OPERADORES = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+FUNCOES_ARROW = {
+    '==': pc.equal,
+    '!=': pc.not_equal,
+    '<': pc.less,
+    '<=': pc.less_equal,
+    '>': pc.greater,
+    '>=': pc.greater_equal,
+}
+
+
+class NaoSuportado(Exception):
+    # o motor não sabe avaliar o plano; mascara responde com o pandas
+    pass
+
+
+def vazio_passa(operador):
+    # mesma semântica do pandas: valor vazio só satisfaz !=
+    return operador == '!='
+
+
+# PANDAS
+def compara_pandas(serie, operador, valor):
+    if operador == 'isin':
+        resultado = serie.isin(valor)
+    else:
+        resultado = OPERADORES[operador](serie, valor)
+    return resultado.to_numpy(dtype=bool, na_value=vazio_passa(operador))
+
+
+def mascara_pandas(df, predicados):
+    mascara = np.ones(len(df), dtype=bool)
+    for coluna, operador, valor in predicados:
+        mascara &= compara_pandas(df[coluna], operador, valor)
+    return mascara
+
+
+# PYARROW.COMPUTE
+def escalar(valor, tipo):
+    if pa.types.is_timestamp(tipo) or pa.types.is_date(tipo):
+        valor = pd.Timestamp(valor).to_pydatetime()
+        return pa.scalar(valor).cast(tipo)
+    return pa.scalar(valor, type=tipo)
+
+
+def compara_arrow(arr, operador, valor):
+    if isinstance(arr, pa.ChunkedArray):
+        return pa.chunked_array([compara_arrow(parte, operador, valor) for parte in arr.chunks], type=pa.bool_())
+    if pa.types.is_dictionary(arr.type):
+        # compara só os valores do dicionário e leva o resultado para cada linha pelos códigos
+        return pc.take(compara_arrow(arr.dictionary, operador, valor), arr.indices).fill_null(vazio_passa(operador))
+    if operador == 'isin':
+        return pc.is_in(arr, value_set=pa.array(list(valor)).cast(arr.type)).fill_null(False)
+    return FUNCOES_ARROW[operador](arr, escalar(valor, arr.type)).fill_null(vazio_passa(operador))
+
+
+def compara_serie_arrow(serie, operador, valor):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Categorical do pandas: o mesmo esquema, com os códigos já em numpy (código -1 é vazio)
+        no_dicionario = compara_arrow(pa.array(serie.cat.categories), operador, valor).to_numpy(zero_copy_only=False)
+        return np.append(no_dicionario, vazio_passa(operador))[serie.cat.codes.to_numpy()]
+    resultado = compara_arrow(pa.array(serie), operador, valor)
+    if isinstance(resultado, pa.ChunkedArray):
+        resultado = resultado.combine_chunks()
+    return resultado.to_numpy(zero_copy_only=False)
+
+
+def mascara_arrow(df, predicados):
+    mascara = np.ones(len(df), dtype=bool)
+    for coluna, operador, valor in predicados:
+        try:
+            mascara &= compara_serie_arrow(df[coluna], operador, valor)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as erro:
+            raise NaoSuportado(f'{coluna} {operador} {valor!r}: {erro}') from erro
+    return mascara
+
+
+# DUCKDB (opcional)
+def mascara_duckdb(df, predicados):
+    import duckdb
+
+    condicoes, parametros = [], []
+    for coluna, operador, valor in predicados:
+        nome = '"' + coluna.replace('"', '""') + '"'
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            nome = f'CAST({nome} AS VARCHAR)'
+        if operador == 'isin':
+            condicoes.append(f'coalesce(list_contains(?, {nome}), false)')
+            parametros.append(list(valor))
+        else:
+            sql = '<>' if operador == '!=' else '=' if operador == '==' else operador
+            condicoes.append(f'coalesce({nome} {sql} ?, {str(vazio_passa(operador)).lower()})')
+            parametros.append(valor)
+
+    tabela = df[list(dict.fromkeys(c for c, _, _ in predicados))]
+    try:
+        with duckdb.connect() as conexao:
+            conexao.register('tabela', tabela)
+            resultado = conexao.execute(f'SELECT {" AND ".join(condicoes)} AS m FROM tabela', parametros).fetchnumpy()
+    except (duckdb.ConversionException, duckdb.BinderException, duckdb.NotImplementedException) as erro:
+        raise NaoSuportado(str(erro)) from erro
+    return np.asarray(resultado['m'], dtype=bool)
+
+
+MOTORES = {
+    'pandas': mascara_pandas,
+    'arrow': mascara_arrow,
+    'duckdb': mascara_duckdb,
+}
+
+
+def disponivel(motor):
+    if motor == 'duckdb':
+        return importlib.util.find_spec('duckdb') is not None
+    return motor in MOTORES
+
+
+def resolve_motor(motor):
+    if disponivel(motor):
+        return motor
+    print(f'Aviso: motor de consulta {motor!r} indisponível (MAPA_MOTOR_CONSULTA); usando o pyarrow')
+    return 'arrow'
+
+
+MOTOR = resolve_motor(os.environ.get('MAPA_MOTOR_CONSULTA', 'arrow'))
+
+
+def mascara(df, predicados, motor=None):
+    predicados = list(predicados)
+    if any(operador == 'isin' and len(valor) == 0 for _, operador, valor in predicados):
+        return np.zeros(len(df), dtype=bool)
+    motor = motor or MOTOR
+    if motor != 'pandas':
+        try:
+            return MOTORES[motor](df, predicados)
+        except NaoSuportado:
+            pass
+    return mascara_pandas(df, predicados)
+
+
+def filtra(df, predicados, motor=None, cache=None):
+    # equivale a df.query(...) com todos os predicados ligados por &; mantém o índice original
+    if not predicados:
+        return df
+    if cache is not None:
+        return df.take(linhas(df, predicados, cache, motor))
+    return df[mascara(df, predicados, motor)]
+
+
+# FATIAS EM CACHE
+def nova_cache(max_planos=64):
+    return {'planos': OrderedDict(), 'max_planos': max_planos, 'tabela': None, 'referencia': None,
+            'trava': threading.Lock(), 'contagem': {'acertos': 0, 'estreitados': 0, 'varreduras': 0}}
+
+
+def normaliza_valor(operador, valor):
+    if operador == 'isin':
+        return tuple(sorted({normaliza_valor('==', v) for v in valor}, key=str))
+    if isinstance(valor, (pd.Timestamp, np.datetime64)) or hasattr(valor, 'isoformat'):
+        return pd.Timestamp(valor)
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+def normaliza(predicados):
+    # mesma chave para o mesmo filtro, qualquer que seja a ordem dos predicados ou o tipo da data
+    return tuple(sorted({(coluna, operador, normaliza_valor(operador, valor)) for coluna, operador, valor in predicados}, key=str))
+
+
+def implica(p, q):
+    # toda linha que satisfaz p satisfaz q? (p e q normalizados; na dúvida, não)
+    (coluna, operador, valor), (coluna_q, operador_q, valor_q) = p, q
+    if coluna != coluna_q:
+        return False
+    if p == q:
+        return True
+    try:
+        if operador_q == 'isin':
+            valores = valor if operador == 'isin' else (valor,) if operador == '==' else ()
+            return len(valores) > 0 and set(valores) <= set(valor_q)
+        if operador == '==':
+            return bool(OPERADORES[operador_q](valor, valor_q))
+        if operador_q == '!=':
+            return operador == 'isin' and valor_q not in valor
+        if operador in ('>', '>=') and operador_q in ('>', '>='):
+            return valor > valor_q or (valor == valor_q and (operador == '>' or operador_q == '>='))
+        if operador in ('<', '<=') and operador_q in ('<', '<='):
+            return valor < valor_q or (valor == valor_q and (operador == '<' or operador_q == '<='))
+    except TypeError:
+        pass
+    return False
+
+
+def linhas(df, predicados, cache, motor=None):
+    # posições das linhas que passam no plano, reaproveitando o plano guardado mais estreito que o contém
+    chave = normaliza(predicados)
+    carga = df.attrs.get('carga')
+    tabela = ('carga', carga, len(df)) if carga is not None else ('objeto', id(df), len(df))
+    with cache['trava']:
+        if cache['tabela'] != tabela:
+            cache['planos'].clear()
+            cache['tabela'] = tabela
+            cache['referencia'] = df if carga is None else None
+        if chave in cache['planos']:
+            cache['planos'].move_to_end(chave)
+            cache['contagem']['acertos'] += 1
+            return cache['planos'][chave]
+        candidatos = [
+            (len(posicoes), guardado, posicoes) for guardado, posicoes in cache['planos'].items()
+            if all(any(implica(p, q) for p in chave) for q in guardado)
+        ]
+
+    if candidatos:
+        _, guardado, base = min(candidatos, key=lambda c: c[0])
+        resto = [p for p in chave if p not in guardado]
+        colunas = list(dict.fromkeys(coluna for coluna, _, _ in resto))
+        posicoes = base[mascara(df[colunas].take(base), resto, motor)] if resto else base
+        contador = 'estreitados'
+    else:
+        posicoes = np.flatnonzero(mascara(df, chave, motor))
+        contador = 'varreduras'
+    posicoes = posicoes.astype(np.int32 if len(df) < 2 ** 31 else np.int64, copy=False)
+
+    with cache['trava']:
+        cache['contagem'][contador] += 1
+        cache['planos'][chave] = posicoes
+        while len(cache['planos']) > cache['max_planos']:
+            cache['planos'].popitem(last=False)
+    return posicoes
+
+
+def expressao(predicados):
+    # plano -> string do DataFrame.query, usada como referência na conferência dos motores
+    partes, variaveis = [], {}
+    for i, (coluna, operador, valor) in enumerate(predicados):
+        variaveis[f'v{i}'] = valor
+        partes.append(f'`{coluna}`.isin(@v{i})' if operador == 'isin' else f'`{coluna}` {operador} @v{i}')
+    return ' & '.join(partes), variaveis
+
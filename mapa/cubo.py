@@ -0,0 +1,68 @@
+import numpy as np
+
+# Cubo de ocorrências do atlas: uma célula por (uf, ibge, municipio, grupo_de_desastre,
+# descricao_tipologia) e, em cada célula, a contagem de ocorrências acumulada ao longo dos anos. A
+# contagem de qualquer intervalo [ano_inicial, ano_final] é a diferença entre duas colunas do
+# acumulado. Valores vazios formam células próprias (como linhas da tabela, elas contam no total;
+# como nos filtros, nenhuma comparação as seleciona).
+DIMENSOES = ['uf', 'ibge', 'municipio', 'grupo_de_desastre', 'descricao_tipologia']
+
+
+def cria_cubo(df):
+    anos = np.arange(int(df.ano.min()), int(df.ano.max()) + 1)
+    contagem = df.groupby(DIMENSOES + ['ano'], observed=True, dropna=False).size().unstack('ano', fill_value=0)
+    contagem = contagem.reindex(columns=anos, fill_value=0)
+
+    # as células saem ordenadas por uf no groupby, então cada uf ocupa um intervalo contíguo
+    celulas = contagem.index.to_frame(index=False)
+    acumulado = np.zeros((len(celulas), len(anos) + 1), dtype=np.int64)
+    np.cumsum(contagem.to_numpy(dtype=np.int64), axis=1, out=acumulado[:, 1:])
+    faixas = {uf: (pos[0], pos[-1] + 1) for uf, pos in celulas.groupby('uf', observed=True).indices.items()}
+    return {'anos': anos, 'celulas': celulas, 'acumulado': acumulado, 'faixas': faixas}
+
+
+def fatia_cubo(cubo, uf, grupo=None, tipologia=None):
+    # uf=None: o país inteiro
+    ini, fim = cubo['faixas'].get(uf, (0, 0)) if uf is not None else (0, len(cubo['celulas']))
+    celulas = cubo['celulas'].iloc[ini:fim]
+    acumulado = cubo['acumulado'][ini:fim]
+
+    mascara = np.ones(len(celulas), dtype=bool)
+    if grupo is not None:
+        mascara &= (celulas.grupo_de_desastre == grupo).to_numpy(dtype=bool)
+    if tipologia is not None:
+        mascara &= (celulas.descricao_tipologia == tipologia).to_numpy(dtype=bool)
+    return celulas[mascara], acumulado[mascara]
+
+
+def indices_anos(cubo, ano_inicial, ano_final):
+    anos = cubo['anos']
+    i0 = int(np.clip(ano_inicial - anos[0], 0, len(anos)))
+    i1 = int(np.clip(ano_final - anos[0] + 1, i0, len(anos)))
+    return i0, i1
+
+
+def conta_periodo(cubo, uf, ano_inicial, ano_final, grupo=None, tipologia=None, por_ano=False):
+    celulas, acumulado = fatia_cubo(cubo, uf, grupo, tipologia)
+    i0, i1 = indices_anos(cubo, ano_inicial, ano_final)
+
+    if not por_ano:
+        ocorrencias = acumulado[:, i1] - acumulado[:, i0]
+        presentes = ocorrencias > 0
+        resultado = celulas[presentes].reset_index(drop=True)
+        resultado['ocorrencias'] = ocorrencias[presentes]
+        return resultado
+
+    anuais = np.diff(acumulado[:, i0:i1 + 1], axis=1)
+    linhas, colunas = np.nonzero(anuais)
+    resultado = celulas.iloc[linhas].reset_index(drop=True)
+    resultado['ano'] = cubo['anos'][i0 + colunas]
+    resultado['ocorrencias'] = anuais[linhas, colunas]
+    return resultado
+
+
+def ocorrencias_por_municipio(periodo):
+    # ocorrências de cada par (ibge, municipio) no período; cada código fica com o nome de maior
+    # contagem, como no groupby(['ibge', 'municipio']).size() + drop_duplicates da tabela filtrada
+    ocorrencias = periodo.groupby(['ibge', 'municipio'], as_index=False, observed=True).ocorrencias.sum()
+    return ocorrencias.sort_values('ocorrencias', ascending=False).drop_duplicates(subset='ibge', keep='first')
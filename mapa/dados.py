@@ -0,0 +1,426 @@
+import os
+import json
+import hashlib
+import argparse
+import itertools
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Modo particionado: as bases grandes do Agro são regravadas como datasets hive particionados
+# por uf e pelo ano da coluna de data (uf=PI/ano_data=2021/...). O app passa a ler só as
+# partições da UF e dos anos em tela, com as colunas que usa. Para gerar: python dados.py
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PARTICIONADOS = {
+    'PSR_COMPLETO.parquet': 'data_apolice',
+    'susep_agro2.parquet': 'data',
+}
+COLUNA_ANO = 'ano_data'
+
+# COLUNAS CATEGÓRICAS
+# Colunas de texto com poucos valores distintos são lidas do parquet como dicionário e chegam ao
+# pandas como Categorical: filtros de igualdade e groupbys trabalham nos códigos inteiros e cada
+# texto fica guardado uma vez só. As categorias saem ordenadas e sem valores que não aparecem.
+CATEGORICAS = ['uf', 'descricao_tipologia', 'grupo_de_desastre', 'municipio', 'pais', 'seguradora', 'cultura', 'ramo']
+
+
+def tipo_pandas(tipo):
+    return None if pa.types.is_dictionary(tipo) else pd.ArrowDtype(tipo)
+
+
+def ordena_categorias(serie):
+    serie = serie.cat.remove_unused_categories()
+    return serie.cat.reorder_categories(serie.cat.categories.sort_values())
+
+
+# cada tabela lida recebe um número de carga em attrs['carga'], que acompanha as visões e cópias
+# rasas dela; as caches de fatias (consulta.py) usam o número para saber que a tabela é a mesma
+CARGAS = itertools.count()
+
+
+def para_pandas(tabela):
+    df = tabela.to_pandas(types_mapper=tipo_pandas)
+    for coluna in df.columns:
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = ordena_categorias(df[coluna])
+    df.attrs['carga'] = next(CARGAS)
+    return df
+
+
+def concatena(partes):
+    # pd.concat só mantém uma coluna categórica quando todas as partes têm as mesmas categorias;
+    # senão ela vira object. As categorias de cada coluna são unidas (e ordenadas) antes
+    partes = list(partes)
+    for coluna in partes[0].columns:
+        if all(isinstance(parte[coluna].dtype, pd.CategoricalDtype) for parte in partes):
+            categorias = pd.Index(np.concatenate([parte[coluna].cat.categories.to_numpy() for parte in partes])).unique().sort_values()
+            partes = [parte.assign(**{coluna: parte[coluna].cat.set_categories(categorias)}) for parte in partes]
+    df = pd.concat(partes, ignore_index=True)
+    cargas = tuple(parte.attrs.get('carga') for parte in partes)
+    df.attrs['carga'] = cargas if None not in cargas else None
+    return df
+
+
+def le_parquet(caminho_arquivo, filtro=None, colunas=None):
+    nomes = pq.read_schema(caminho_arquivo).names
+    dicionario = [c for c in CATEGORICAS if c in nomes]
+    return para_pandas(pq.read_table(caminho_arquivo, columns=colunas, filters=filtro, read_dictionary=dicionario))
+
+
+def mapeia_categorias(serie, mapa):
+    # Series.map aplicado ao dicionário: cada categoria é traduzida uma vez e as linhas só
+    # trocam de código. Valores fora do mapa ficam vazios, como no map
+    traduzidas = serie.cat.categories.map(mapa)
+    categorias = pd.Index(traduzidas.dropna().unique()).sort_values()
+    codigos = np.append(categorias.get_indexer(traduzidas), -1)[serie.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=serie.index, name=serie.name)
+
+
+def pasta_particionada(caminho_arquivo):
+    return os.path.splitext(os.path.join(BASE_DIR, caminho_arquivo))[0] + '_particionado'
+
+
+def tem_particoes(caminho_arquivo):
+    return os.path.isdir(pasta_particionada(caminho_arquivo))
+
+
+def particiona(caminho_arquivo, coluna_data):
+    tabela = pq.read_table(os.path.join(BASE_DIR, caminho_arquivo))
+    tabela = tabela.append_column(COLUNA_ANO, pc.year(tabela[coluna_data]))
+    esquema = pa.schema([tabela.schema.field('uf'), tabela.schema.field(COLUNA_ANO)])
+    ds.write_dataset(
+        tabela, pasta_particionada(caminho_arquivo), format='parquet',
+        partitioning=ds.partitioning(esquema, flavor='hive'),
+        existing_data_behavior='delete_matching',
+    )
+
+
+@lru_cache(maxsize=None)
+def abre_dataset(caminho_arquivo):
+    formato = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=CATEGORICAS))
+    particoes = ds.HivePartitioning.discover(infer_dictionary=True)
+    return ds.dataset(pasta_particionada(caminho_arquivo), format=formato, partitioning=particoes)
+
+
+def le_particao(caminho_arquivo, uf, ano, colunas=None, inicio=None, fim=None):
+    # com inicio/fim, o intervalo [inicio, fim) da coluna de data também vai para o scan: os row
+    # groups fora dele nem são lidos
+    dataset = abre_dataset(caminho_arquivo)
+    colunas = [c for c in (colunas or dataset.schema.names) if c != COLUNA_ANO]
+    filtro = (ds.field('uf') == uf) & (ds.field(COLUNA_ANO) == ano)
+    coluna_data = PARTICIONADOS[os.path.basename(caminho_arquivo)]
+    tipo = dataset.schema.field(coluna_data).type
+    if inicio is not None:
+        filtro &= ds.field(coluna_data) >= pa.scalar(pd.Timestamp(inicio).to_pydatetime()).cast(tipo)
+    if fim is not None:
+        filtro &= ds.field(coluna_data) < pa.scalar(pd.Timestamp(fim).to_pydatetime()).cast(tipo)
+    return para_pandas(dataset.to_table(columns=colunas, filter=filtro))
+
+
+def conta_por_grupo(caminho_arquivo, grupos, filtro=None):
+    # contagem agregada direto no scan, lendo só as colunas do agrupamento
+    # cada arquivo traz o próprio dicionário; o group_by do Arrow exige um só por coluna
+    tabela = abre_dataset(caminho_arquivo).to_table(columns=grupos, filter=filtro).unify_dictionaries()
+    contagem = tabela.group_by(grupos).aggregate([([], 'count_all')]).rename_columns(grupos + ['size'])
+    return para_pandas(contagem)
+
+
+# REGIÕES
+# O atlas e a tabela de áreas misturam linhas do Brasil (UFs e municípios) e da América Latina
+# (países). Cada região é lida como uma tabela própria, pela coluna de UF, e o número de linhas
+# lido é conferido com o manifesto (regioes.json; para regenerá-lo: python dados.py --manifesto).
+UFS_BRASIL = ['AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA', 'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO']
+REGIOES = {
+    'desastres_latam2.parquet': 'uf',
+    'area2.parquet': 'abbrev_state',
+}
+MANIFESTO_REGIOES = os.path.join(BASE_DIR, 'regioes.json')
+
+
+def filtro_regiao(coluna, regiao):
+    brasil = pc.field(coluna).isin(UFS_BRASIL)
+    return brasil if regiao == 'brasil' else ~brasil
+
+
+@lru_cache(maxsize=None)
+def le_manifesto(caminho=MANIFESTO_REGIOES):
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, 'r') as f:
+        return json.load(f)
+
+
+class ManifestoDivergente(ValueError):
+    def __init__(self, arquivo, mensagem):
+        super().__init__(mensagem)
+        self.arquivo = arquivo
+
+
+def confere_manifesto(arquivo, regiao, linhas):
+    # região sem contagem no manifesto fica sem conferência (com um aviso); contagem diferente é erro
+    esperadas = le_manifesto().get(arquivo, {}).get(regiao)
+    if esperadas is None:
+        print(f'Aviso: {arquivo} ({regiao}) sem contagem de linhas em {os.path.basename(MANIFESTO_REGIOES)}, não conferido; '
+              'regenere com python dados.py --manifesto')
+        return
+    if esperadas != linhas:
+        raise ManifestoDivergente(arquivo, f'{arquivo} ({regiao}): o manifesto prevê {esperadas} linhas, mas foram lidas {linhas}')
+
+
+def le_regiao(caminho_arquivo, regiao):
+    arquivo = os.path.basename(caminho_arquivo)
+    df = le_parquet(caminho_arquivo, filtro_regiao(REGIOES[arquivo], regiao))
+    confere_manifesto(arquivo, regiao, len(df))
+    return df
+
+
+def gera_manifesto(caminho=MANIFESTO_REGIOES):
+    manifesto = {}
+    for arquivo, coluna in REGIOES.items():
+        uf = pq.read_table(os.path.join(BASE_DIR, arquivo), columns=[coluna])
+        manifesto[arquivo] = {regiao: uf.filter(filtro_regiao(coluna, regiao)).num_rows for regiao in ['brasil', 'latam']}
+    with open(caminho, 'w') as f:
+        json.dump(manifesto, f, indent=4)
+        f.write('\n')
+    return manifesto
+
+
+# MANIFESTO DOS ARQUIVOS
+# arquivos.json lista os arquivos de dados do app com tamanho e sha256. Cada processo do app confere
+# os arquivos uma vez, antes de servir, e reporta pelo nome os que ainda são ponteiros do Git LFS
+# (falta o git lfs pull) ou que não batem com o manifesto. Para regenerá-lo: python dados.py
+# --arquivos (para um arquivo que ainda é ponteiro LFS, valem o tamanho e o oid do ponteiro).
+MANIFESTO_ARQUIVOS = os.path.join(BASE_DIR, 'arquivos.json')
+ARQUIVOS_APP = [
+    'desastres_latam2.parquet', 'area2.parquet', 'coord_uf.parquet', 'coord_muni.parquet', 'coord_latam3.parquet',
+    'pop_pib_muni.parquet', 'pop_pib_latam.parquet', 'PSR_COMPLETO.parquet', 'susep_agro2.parquet',
+    'malha_brasileira.json', 'malha_latam.json',
+]
+PREFIXO_LFS = b'version https://git-lfs.github.com/spec/v1'
+
+
+def ponteiro_lfs(caminho):
+    # tamanho e sha256 do arquivo real, se `caminho` é só o ponteiro do Git LFS; senão None
+    with open(caminho, 'rb') as f:
+        inicio = f.read(1024)
+    if not inicio.startswith(PREFIXO_LFS):
+        return None
+    campos = dict(linha.split(' ', 1) for linha in inicio.decode('utf-8', errors='ignore').splitlines() if ' ' in linha)
+    return {'tamanho': int(campos['size']), 'sha256': campos['oid'].split(':', 1)[-1]}
+
+
+def sha256(caminho, bloco=1 << 20):
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b''):
+            resumo.update(parte)
+    return resumo.hexdigest()
+
+
+def descreve_arquivo(caminho):
+    return ponteiro_lfs(caminho) or {'tamanho': os.path.getsize(caminho), 'sha256': sha256(caminho)}
+
+
+def gera_manifesto_arquivos(caminho=MANIFESTO_ARQUIVOS, arquivos=ARQUIVOS_APP):
+    manifesto = {arquivo: descreve_arquivo(os.path.join(BASE_DIR, arquivo)) for arquivo in arquivos}
+    with open(caminho, 'w') as f:
+        json.dump(manifesto, f, indent=4)
+        f.write('\n')
+    return manifesto
+
+
+def confere_arquivo(arquivo, esperado=None):
+    # None se o arquivo está em ordem; senão, a descrição do problema
+    caminho = os.path.join(BASE_DIR, arquivo)
+    if not os.path.exists(caminho):
+        return 'não encontrado'
+    if ponteiro_lfs(caminho) is not None:
+        return 'ponteiro do Git LFS, sem o conteúdo (falta o git lfs pull)'
+    if esperado is None:
+        return None
+    tamanho = os.path.getsize(caminho)
+    if tamanho != esperado['tamanho']:
+        return f'{tamanho} bytes, mas o manifesto prevê {esperado["tamanho"]}'
+    if sha256(caminho) != esperado['sha256']:
+        return 'sha256 diferente do manifesto'
+    return None
+
+
+def confere_arquivos(caminho=MANIFESTO_ARQUIVOS, trabalhadores=8):
+    # confere todos os arquivos em paralelo (a leitura e o sha256 liberam o GIL)
+    manifesto = le_manifesto(caminho)
+    arquivos = list(manifesto) or ARQUIVOS_APP
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        problemas = executor.map(lambda arquivo: confere_arquivo(arquivo, manifesto.get(arquivo)), arquivos)
+        return {arquivo: problema for arquivo, problema in zip(arquivos, problemas) if problema is not None}
+
+
+# ÍNDICE ORDENADO DO ATLAS
+# O atlas fica ordenado por (uf, ano, data). Cada uf ocupa um bloco contíguo e, dentro dele,
+# filtros por ano ou por data viram um intervalo encontrado com searchsorted, sem máscara
+# sobre a tabela inteira.
+ORDEM_ATLAS = ['uf', 'ano', 'data']
+
+
+def ordena_atlas(df):
+    # já ordenado (como o atlas salvo em Arrow IPC): devolve a mesma tabela, sem copiar
+    if df.index.equals(pd.RangeIndex(len(df))) and pd.MultiIndex.from_frame(df[ORDEM_ATLAS]).is_monotonic_increasing:
+        return df
+    return df.sort_values(ORDEM_ATLAS, kind='stable', ignore_index=True)
+
+
+def indexa_atlas(df):
+    ufs = df.uf.to_numpy(dtype=object)
+    mudancas = np.flatnonzero(ufs[1:] != ufs[:-1]) + 1
+    inicios = np.r_[0, mudancas]
+    fins = np.r_[mudancas, len(df)]
+    faixas = {ufs[i]: (int(i), int(f)) for i, f in zip(inicios, fins) if f > i}
+
+    anos = df.ano.to_numpy(dtype=np.int64)
+    datas = df.data.to_numpy(dtype='datetime64[ns]')
+    # a busca binária por data só vale se, dentro de cada uf, a data também sai ordenada
+    datas_ordenadas = all(not np.any(np.isnat(datas[i:f])) and np.all(np.diff(datas[i:f]) >= np.timedelta64(0)) for i, f in faixas.values())
+    return {'faixas': faixas, 'anos': anos, 'datas': datas, 'datas_ordenadas': datas_ordenadas}
+
+
+def posicoes_atlas(indice, uf, ano_inicial=None, ano_final=None):
+    ini, fim = indice['faixas'].get(uf, (0, 0))
+    anos = indice['anos'][ini:fim]
+    if ano_final is not None:
+        fim = ini + int(np.searchsorted(anos, ano_final, side='right'))
+    if ano_inicial is not None:
+        ini = ini + int(np.searchsorted(anos, ano_inicial, side='left'))
+    return ini, max(ini, fim)
+
+
+def fatia_atlas(df, indice, uf, ano_inicial=None, ano_final=None, data_inicial=None, data_final=None):
+    # data_inicial é inclusiva e data_final exclusiva, como nos filtros do Agro
+    ini, fim = posicoes_atlas(indice, uf, ano_inicial, ano_final)
+    if data_inicial is None and data_final is None:
+        return df.iloc[ini:fim]
+
+    inicio = np.datetime64(data_inicial, 'ns') if data_inicial is not None else None
+    final = np.datetime64(data_final, 'ns') if data_final is not None else None
+    datas = indice['datas'][ini:fim]
+    if indice['datas_ordenadas']:
+        a = int(np.searchsorted(datas, inicio, side='left')) if inicio is not None else 0
+        b = int(np.searchsorted(datas, final, side='left')) if final is not None else len(datas)
+        return df.iloc[ini + a:ini + max(a, b)]
+
+    mascara = np.ones(len(datas), dtype=bool)
+    if inicio is not None:
+        mascara &= datas >= inicio
+    if final is not None:
+        mascara &= datas < final
+    return df.iloc[ini:fim][mascara]
+
+
+# ARROW IPC
+# Com vários processos do app na mesma máquina, cada um lendo os parquets guarda a sua cópia das
+# tabelas. python dados.py --arrow regrava as tabelas base como Arrow IPC (Feather v2) sem
+# compressão em DIR_ARROW; o app abre esses arquivos com memory map e as colunas ArrowDtype
+# apontam direto para as páginas do arquivo, que o sistema compartilha entre os processos (só os
+# códigos das colunas categóricas vão para o heap). O atlas e as áreas saem separados por região,
+# com o atlas já ordenado. Um arquivo mais antigo que o parquet de origem é ignorado.
+DIR_ARROW = os.path.join(BASE_DIR, 'arrow')
+BASES_ARROW = [
+    'desastres_latam2.parquet', 'area2.parquet', 'coord_uf.parquet', 'coord_muni.parquet', 'coord_latam3.parquet',
+    'pop_pib_muni.parquet', 'pop_pib_latam.parquet', 'PSR_COMPLETO.parquet', 'susep_agro2.parquet',
+]
+
+
+def arquivo_arrow(caminho_arquivo, regiao=None):
+    nome = os.path.splitext(os.path.basename(caminho_arquivo))[0]
+    return os.path.join(DIR_ARROW, f'{nome}.{regiao}.arrow' if regiao is not None else f'{nome}.arrow')
+
+
+def tem_arrow(caminho_arquivo, regiao=None):
+    destino = arquivo_arrow(caminho_arquivo, regiao)
+    origem = os.path.join(BASE_DIR, caminho_arquivo)
+    if not os.path.exists(destino):
+        return False
+    return not os.path.exists(origem) or os.path.getmtime(destino) >= os.path.getmtime(origem)
+
+
+def salva_arrow(caminho_arquivo):
+    arquivo = os.path.basename(caminho_arquivo)
+    origem = os.path.join(BASE_DIR, caminho_arquivo)
+    destinos = []
+    for regiao in (['brasil', 'latam'] if arquivo in REGIOES else [None]):
+        df = le_regiao(origem, regiao) if regiao is not None else le_parquet(origem)
+        if arquivo == 'desastres_latam2.parquet':
+            df = ordena_atlas(df)
+        # um único lote por arquivo: cada coluna fica contígua e o dicionário é um só
+        tabela = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+        destino = arquivo_arrow(arquivo, regiao)
+        os.makedirs(DIR_ARROW, exist_ok=True)
+        with pa.OSFile(destino + '.tmp', 'wb') as saida, pa.ipc.new_file(saida, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+        os.replace(destino + '.tmp', destino)
+        destinos.append(destino)
+    return destinos
+
+
+def le_arrow(caminho_arquivo, regiao=None):
+    # os buffers da tabela seguram o memory map aberto enquanto houver colunas usando o arquivo
+    tabela = pa.ipc.open_file(pa.memory_map(arquivo_arrow(caminho_arquivo, regiao), 'r')).read_all()
+    return para_pandas(tabela)
+
+
+def fontes(*tabelas):
+    # arquivos de onde cada tabela (caminho ou (caminho, regiao)) é lida de fato: o Arrow IPC quando
+    # em dia, senão os arquivos das partições, senão o parquet. Servem de assinatura dos dados
+    arquivos = []
+    for tabela in tabelas:
+        caminho_arquivo, regiao = (tabela, None) if isinstance(tabela, str) else tabela
+        if tem_arrow(caminho_arquivo, regiao):
+            arquivos.append(arquivo_arrow(caminho_arquivo, regiao))
+        elif regiao is None and tem_particoes(caminho_arquivo):
+            arquivos.extend(sorted(os.path.join(pasta, nome) for pasta, _, nomes in os.walk(pasta_particionada(caminho_arquivo)) for nome in nomes))
+        else:
+            arquivos.append(os.path.join(BASE_DIR, caminho_arquivo))
+    return tuple(arquivos)
+
+
+def le_base(caminho_arquivo, regiao=None):
+    # tabela base do app: do Arrow IPC quando gerado e em dia; senão, direto do parquet
+    if not tem_arrow(caminho_arquivo, regiao):
+        return le_regiao(caminho_arquivo, regiao) if regiao is not None else le_parquet(caminho_arquivo)
+    df = le_arrow(caminho_arquivo, regiao)
+    if regiao is not None:
+        confere_manifesto(os.path.basename(caminho_arquivo), regiao, len(df))
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera os datasets particionados por uf/ano usados pelo modo particionado do app.')
+    parser.add_argument('arquivos', nargs='*')
+    parser.add_argument('--manifesto', action='store_true', help='apenas regrava o manifesto de linhas por região (regioes.json)')
+    parser.add_argument('--arrow', action='store_true', help='regrava as tabelas base como Arrow IPC para leitura com memory map')
+    parser.add_argument('--arquivos', action='store_true', dest='manifesto_arquivos', help='regrava o manifesto de tamanhos e sha256 dos arquivos de dados (arquivos.json)')
+    args = parser.parse_args()
+
+    if args.manifesto:
+        print(gera_manifesto())
+        raise SystemExit(0)
+
+    if args.manifesto_arquivos:
+        print(json.dumps(gera_manifesto_arquivos(arquivos=args.arquivos or ARQUIVOS_APP), indent=4))
+        raise SystemExit(0)
+
+    if args.arrow:
+        for arquivo in args.arquivos or BASES_ARROW:
+            for destino in salva_arrow(arquivo):
+                print(f'{arquivo} -> {destino}')
+        raise SystemExit(0)
+
+    args.arquivos = args.arquivos or list(PARTICIONADOS)
+
+    for arquivo in args.arquivos:
+        particiona(arquivo, PARTICIONADOS[arquivo])
+        print(f'{arquivo} -> {pasta_particionada(arquivo)}')
@@ -0,0 +1,134 @@
+import os
+import hashlib
+import tempfile
+import threading
+import importlib.util
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# EXPORTAÇÕES
+# As tabelas para download só são geradas no clique (o download_button recebe uma função). O arquivo
+# é escrito em partes num diretório temporário, sem montar a tabela inteira nem o texto do CSV em
+# memória, e fica guardado pelo estado dos filtros: outro clique, de qualquer sessão, com os mesmos
+# filtros e os mesmos arquivos de origem só relê o arquivo pronto. Os mais antigos saem quando o
+# diretório passa de MAX_ARQUIVOS. XLSX depende do openpyxl.
+DIRETORIO = os.environ.get('MAPA_DIR_EXPORTACOES', os.path.join(tempfile.gettempdir(), 'mapa_exportacoes'))
+MAX_ARQUIVOS = 32
+LINHAS_POR_PARTE = 100_000
+LINHAS_XLSX = 1_048_575  # limite de linhas de uma planilha, sem o cabeçalho
+FORMATOS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def disponiveis():
+    return [formato for formato in FORMATOS if formato != 'XLSX' or importlib.util.find_spec('openpyxl') is not None]
+
+
+def em_partes(df, posicoes=None, tamanho=LINHAS_POR_PARTE):
+    # a tabela (ou só as linhas `posicoes` dela) em pedaços; só um pedaço é copiado por vez
+    total = len(df) if posicoes is None else len(posicoes)
+    if total == 0:
+        yield df.iloc[:0]
+    for inicio in range(0, total, tamanho):
+        if posicoes is None:
+            yield df.iloc[inicio:inicio + tamanho]
+        else:
+            yield df.take(posicoes[inicio:inicio + tamanho])
+
+
+# ESCRITA POR FORMATO
+def escreve_csv(partes, destino, sep):
+    with open(destino, 'w', encoding='utf-8', newline='') as arquivo:
+        for i, parte in enumerate(partes):
+            parte.to_csv(arquivo, sep=sep, index=False, header=i == 0)
+
+
+def escreve_parquet(partes, destino, sep):
+    escritor = None
+    try:
+        for parte in partes:
+            tabela = pa.Table.from_pandas(parte, preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(destino, tabela.schema)
+            elif not tabela.schema.equals(escritor.schema):
+                # um pedaço só com vazios pode vir com tipo nulo; vale o esquema do primeiro
+                tabela = tabela.cast(escritor.schema)
+            escritor.write_table(tabela)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def escreve_xlsx(partes, destino, sep):
+    from openpyxl import Workbook
+
+    # modo write_only: as linhas vão direto para o arquivo em vez de ficarem na planilha em memória
+    livro = Workbook(write_only=True)
+    folha, linhas_folha = None, 0
+    for parte in partes:
+        colunas = parte.columns.tolist()
+        valores = parte.astype(object).where(parte.notna(), None)
+        if folha is None:
+            folha = livro.create_sheet('dados')
+            folha.append(colunas)
+        for linha in valores.itertuples(index=False, name=None):
+            if linhas_folha == LINHAS_XLSX:
+                folha = livro.create_sheet(f'dados_{len(livro.worksheets) + 1}')
+                folha.append(colunas)
+                linhas_folha = 0
+            folha.append(linha)
+            linhas_folha += 1
+    livro.save(destino)
+
+
+ESCRITORES = {
+    'CSV': escreve_csv,
+    'Parquet': escreve_parquet,
+    'XLSX': escreve_xlsx,
+}
+
+
+def limpa():
+    try:
+        arquivos = [os.path.join(DIRETORIO, nome) for nome in os.listdir(DIRETORIO) if not nome.endswith('.tmp')]
+        arquivos.sort(key=os.path.getmtime, reverse=True)
+        for caminho in arquivos[MAX_ARQUIVOS:]:
+            os.remove(caminho)
+    except OSError:
+        # outro processo pode ter removido o mesmo arquivo antes
+        pass
+
+
+def arquivo(chave, partes, formato, sep=';', fontes=()):
+    # caminho da exportação do estado `chave`; `partes` (função que devolve os pedaços da tabela)
+    # só é chamada se o arquivo ainda não existe. `fontes` são os arquivos de dados de origem: se
+    # mudarem, a chave muda junto
+    assinatura = [chave, formato, sep]
+    for fonte in fontes:
+        if os.path.exists(fonte):
+            estado = os.stat(fonte)
+            assinatura.append((fonte, estado.st_size, estado.st_mtime_ns))
+    nome = hashlib.sha1(repr(assinatura).encode('utf-8')).hexdigest()
+    destino = os.path.join(DIRETORIO, f'{nome}.{FORMATOS[formato][0]}')
+    if os.path.exists(destino):
+        os.utime(destino)
+        return destino
+
+    os.makedirs(DIRETORIO, exist_ok=True)
+    temporario = f'{destino}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        ESCRITORES[formato](partes(), temporario, sep)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    limpa()
+    return destino
+
+
+def conteudo(chave, partes, formato, sep=';', fontes=()):
+    with open(arquivo(chave, partes, formato, sep, fontes), 'rb') as entrada:
+        return entrada.read()
@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+import plotly.graph_objects as go
+
+# FIGURAS EM CACHE
+# Montar um mapa ou um heatmap no plotly.express e depois serializá-lo (to_dict valida e copia a
+# figura inteira, to_json percorre tudo de novo) custa centenas de milissegundos com uma malha
+# municipal, e o app fazia isso a cada rerun mesmo com os dados iguais. Com @em_cache, a figura
+# pronta fica guardada já serializada, chaveada pelo conteúdo dos argumentos (hash das linhas das
+# tabelas, da malha e dos parâmetros) e compartilhada por todas as sessões do processo. Uma figura
+# repetida volta como FiguraPronta: o st.plotly_chart recebe o dicionário JSON guardado e só falta
+# o orjson escrevê-lo. As menos usadas saem quando passam de MAX_FIGURAS ou de MAX_BYTES (tamanho
+# do JSON). Os contadores ficam em contagem() e o app os registra no log a cada rerun;
+# conferência: python figuras.py
+MAX_FIGURAS = int(os.environ.get('MAPA_MAX_FIGURAS', 128))
+MAX_BYTES = int(os.environ.get('MAPA_MAX_BYTES_FIGURAS', 256 * 2 ** 20))
+MAX_MALHAS = 256  # as versões de cada UF por zoom contam separadas
+
+
+def nova_cache(max_figuras=MAX_FIGURAS, max_bytes=MAX_BYTES):
+    return {'figuras': OrderedDict(), 'bytes': 0, 'max_figuras': max_figuras, 'max_bytes': max_bytes,
+            'malhas': OrderedDict(), 'trava': threading.Lock(),
+            'contagem': {'acertos': 0, 'faltas': 0, 'descartes': 0}}
+
+
+CACHE = nova_cache()
+
+
+class FiguraPronta(go.Figure):
+    # figura já serializada: to_dict devolve o JSON guardado, sem validar nem copiar. Só serve para
+    # ser desenhada; alterações (update_layout etc.) não chegam ao dicionário
+    def __init__(self, dicionario):
+        super().__init__()
+        self._dicionario = dicionario
+
+    def to_dict(self):
+        return self._dicionario
+
+    def to_plotly_json(self):
+        return self._dicionario
+
+
+# ASSINATURA DOS ARGUMENTOS
+def resumo_malha(cache, malha):
+    # o hash de uma malha (GeoJSON de vários MB) é calculado uma vez por objeto; a malha fica
+    # referenciada enquanto está na lista, então o id não é reaproveitado por outro objeto
+    with cache['trava']:
+        guardado = cache['malhas'].get(id(malha))
+        if guardado is not None:
+            cache['malhas'].move_to_end(id(malha))
+            return guardado[1]
+    resumo = hashlib.blake2b(json.dumps(malha, separators=(',', ':')).encode('utf-8'), digest_size=16).digest()
+    with cache['trava']:
+        cache['malhas'][id(malha)] = (malha, resumo)
+        while len(cache['malhas']) > MAX_MALHAS:
+            cache['malhas'].popitem(last=False)
+    return resumo
+
+
+def atualiza(cache, h, valor):
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        tipos = valor.dtypes if isinstance(valor, pd.DataFrame) else pd.Series([valor.dtype], index=[valor.name])
+        h.update(repr((type(valor).__name__, valor.shape, list(valor.axes[-1]) if valor.ndim > 1 else valor.name,
+                       [valor.index.names, getattr(valor, 'columns', pd.Index([])).names],
+                       [(str(t), list(t.categories) if isinstance(t, pd.CategoricalDtype) else None) for t in tipos])).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(valor, index=True).to_numpy().tobytes())
+    elif isinstance(valor, np.ndarray):
+        h.update(repr((valor.dtype.str, valor.shape)).encode('utf-8'))
+        h.update(np.ascontiguousarray(valor).tobytes() if valor.dtype != object else repr(valor.tolist()).encode('utf-8'))
+    elif isinstance(valor, pd.Index):
+        atualiza(cache, h, valor.to_series(index=None))
+    elif isinstance(valor, dict) and valor.get('type') == 'FeatureCollection':
+        h.update(b'malha')
+        h.update(resumo_malha(cache, valor))
+    elif isinstance(valor, dict):
+        h.update(b'{')
+        for chave, item in valor.items():
+            h.update(repr(chave).encode('utf-8'))
+            atualiza(cache, h, item)
+        h.update(b'}')
+    elif isinstance(valor, (list, tuple)):
+        h.update(b'[' if isinstance(valor, list) else b'(')
+        for item in valor:
+            atualiza(cache, h, item)
+        h.update(b']')
+    else:
+        h.update(repr((type(valor).__name__, valor)).encode('utf-8'))
+
+
+def chave(cache, construtor, args, kwargs):
+    h = hashlib.blake2b(f'{construtor.__module__}.{construtor.__qualname__}'.encode('utf-8'), digest_size=16)
+    atualiza(cache, h, list(args))
+    atualiza(cache, h, dict(sorted(kwargs.items())))
+    return h.digest()
+
+
+# CACHE
+def figura(cache, construtor, args, kwargs):
+    k = chave(cache, construtor, args, kwargs)
+    with cache['trava']:
+        guardada = cache['figuras'].get(k)
+        if guardada is not None:
+            cache['figuras'].move_to_end(k)
+            cache['contagem']['acertos'] += 1
+            return FiguraPronta(guardada[0])
+
+    texto = pio.to_json(construtor(*args, **kwargs), validate=False)
+    dicionario = json.loads(texto)
+    with cache['trava']:
+        cache['contagem']['faltas'] += 1
+        if k not in cache['figuras']:
+            cache['figuras'][k] = (dicionario, len(texto))
+            cache['bytes'] += len(texto)
+        while cache['figuras'] and (len(cache['figuras']) > cache['max_figuras'] or cache['bytes'] > cache['max_bytes']):
+            _, (_, tamanho) = cache['figuras'].popitem(last=False)
+            cache['bytes'] -= tamanho
+            cache['contagem']['descartes'] += 1
+    return FiguraPronta(dicionario)
+
+
+def em_cache(construtor=None, cache=None):
+    # decorador: @em_cache ou @em_cache(cache=nova_cache(...))
+    if construtor is None:
+        return lambda f: em_cache(f, cache)
+
+    @wraps(construtor)
+    def guardada(*args, **kwargs):
+        return figura(CACHE if cache is None else cache, construtor, args, kwargs)
+    return guardada
+
+
+def contagem(cache=CACHE):
+    with cache['trava']:
+        return {**cache['contagem'], 'figuras': len(cache['figuras']), 'bytes': cache['bytes']}
+
+
+def limpa(cache=CACHE):
+    with cache['trava']:
+        cache['figuras'].clear()
+        cache['malhas'].clear()
+        cache['bytes'] = 0
+
+
+if __name__ == '__main__':
+    import time
+    import plotly.express as px
+
+    rng = np.random.default_rng(0)
+    malha = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'codarea': str(i)},
+         'geometry': {'type': 'Polygon', 'coordinates': [(np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]) + i + rng.random((5, 2)) / 10).tolist()]}}
+        for i in range(500)]}
+    df = pd.DataFrame({'codarea': [str(i) for i in range(500)], 'ocorrencias': rng.integers(0, 100, 500)})
+
+    def mapa(df, malha, zoom=3):
+        return px.choropleth_mapbox(df, geojson=malha, color='ocorrencias', locations='codarea', featureidkey='properties.codarea', zoom=zoom)
+
+    cache = nova_cache(max_figuras=2)
+    guardado = em_cache(mapa, cache=cache)
+    mapa(df, malha)
+    t = time.perf_counter()
+    original = pio.to_json(mapa(df, malha), validate=False)
+    t_sem = time.perf_counter() - t
+    assert pio.to_json(guardado(df, malha), validate=False) == original
+    t = time.perf_counter()
+    repetida = pio.to_json(guardado(df.copy(), malha), validate=False)
+    t_com = time.perf_counter() - t
+    assert repetida == original
+    assert contagem(cache)['acertos'] == 1 and contagem(cache)['faltas'] == 1
+
+    # conteúdo diferente, parâmetro diferente e malha diferente não reaproveitam a figura
+    outra = df.assign(ocorrencias=df.ocorrencias[::-1].to_numpy())
+    assert pio.to_json(guardado(outra, malha), validate=False) == pio.to_json(mapa(outra, malha), validate=False)
+    guardado(df, malha, zoom=5)
+    guardado(df, {**malha, 'features': malha['features'][:-1]})
+    c = contagem(cache)
+    assert (c['acertos'], c['faltas'], c['descartes'], c['figuras']) == (1, 4, 2, 2), c
+    print(c)
+    print(f'sem cache {t_sem * 1000:.1f} ms, com cache {t_com * 1000:.1f} ms')
@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+import plotly.colors
+import plotly.graph_objects as go
+
+# FIGURAS SEM O PLOTLY EXPRESS
+# O plotly.express monta a figura inteira com validação de cada propriedade, agrupa a tabela com
+# o pandas e descarta a maior parte do que calculou (nos gráficos de barra e linha do Agro só o
+# .data[0] é usado). Aqui ficam moldes em graph_objects para cada tipo de gráfico do app: os
+# arrays dos traços são preenchidos direto das colunas e a figura é criada com _validate=False,
+# porque os dados vêm das nossas tabelas e os nomes das propriedades estão fixos nos moldes. A
+# saída é a mesma do px (rótulos, ordem e cores dos grupos, hovertemplate, eixos e layout); a
+# conferência contra o px e o tempo de cada gráfico: python graficos.py
+MARGEM_PX = {'t': 60}
+
+
+def modelo():
+    return pio.templates[pio.templates.default] if pio.templates.default else go.layout.Template()
+
+
+def figura(tracos, layout):
+    # o molde padrão entra no layout como o px faz; sem validação, a figura só guarda os dicionários
+    layout = {'template': modelo().to_plotly_json(), **layout}
+    return go.Figure({'data': tracos, 'layout': layout}, _validate=False)
+
+
+def cores_padrao():
+    return list(modelo().layout.colorway or plotly.colors.qualitative.Plotly)
+
+
+def escala(tons):
+    # mesma escala contínua que o px monta a partir do nome ou da lista de cores
+    if tons is None:
+        tons = modelo().layout.colorscale.sequential or plotly.colors.sequential.Viridis
+    if isinstance(tons, str):
+        return [list(par) for par in plotly.colors.get_colorscale(tons)]
+    if isinstance(tons[0], (list, tuple)):
+        return [list(par) for par in tons]
+    return [list(par) for par in plotly.colors.make_colorscale(list(tons))]
+
+
+def valores(dados):
+    # arrays para os traços; categóricas viram objetos, como o validador do plotly faz
+    if isinstance(dados, pd.DataFrame):
+        return dados.to_numpy()
+    return dados.to_numpy(dtype=object) if isinstance(dados.dtype, pd.CategoricalDtype) else dados.to_numpy()
+
+
+def rotulo(rotulos, coluna):
+    return (rotulos or {}).get(coluna, coluna)
+
+
+def grupos(coluna, ordem=None):
+    # valores de `coluna` na ordem do px: primeiro os de `ordem`, depois os da tabela pela ordem em
+    # que aparecem; cada um com as posições das suas linhas (NaN fica de fora, como no groupby)
+    unicos = list(pd.unique(valores(coluna)))
+    if len(unicos) == 1:
+        return [(unicos[0], np.arange(len(coluna)))]
+    ordem = list(dict.fromkeys(list(ordem or []) + unicos))
+    codigos, categorias = pd.factorize(valores(coluna))
+    posicoes = {categoria: np.flatnonzero(codigos == i) for i, categoria in enumerate(categorias)}
+    return [(valor, posicoes[valor]) for valor in ordem if valor in posicoes]
+
+
+def cor_grupos(nomes, mapa_cores=None, cores=None):
+    # como o px: valores fora do mapa pegam a próxima cor da sequência (contando os já mapeados)
+    mapa = dict(mapa_cores or {})
+    cores = cores or cores_padrao()
+    for nome in nomes:
+        if mapa.get(nome) is None:
+            mapa[nome] = cores[len(mapa) % len(cores)]
+    return mapa
+
+
+def eixos(rotulo_x, rotulo_y, **extras):
+    eixo_x = {'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': rotulo_x}}
+    eixo_y = {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': rotulo_y}}
+    eixo_x.update(extras.get('x', {}))
+    eixo_y.update(extras.get('y', {}))
+    return {'xaxis': eixo_x, 'yaxis': eixo_y}
+
+
+def modelo_hover(linhas, cabecalho=''):
+    return cabecalho + '<br>'.join(f'{chave}={valor}' for chave, valor in linhas.items()) + '<extra></extra>'
+
+
+# MAPA (choropleth_mapbox)
+def mapa(df, geojson, locais, cor, featureid=None, rotulos=None, nome_hover=None, dados_hover=None,
+         mapa_cores=None, ordem=None, tons=None, tons_midpoint=None, min_max=None, centro=None, zoom=None,
+         estilo=None, altura=None, opacidade=None):
+    dados_hover = [dados_hover] if isinstance(dados_hover, str) else list(dados_hover or [])
+    locacoes = valores(df[locais])
+    textos = valores(df[nome_hover]) if nome_hover else None
+    extra = valores(df[dados_hover]) if dados_hover else None
+    base = {'type': 'choroplethmapbox', 'geojson': geojson, 'subplot': 'mapbox'}
+    if featureid is not None:
+        base['featureidkey'] = featureid
+    if opacidade is not None:
+        base['marker'] = {'opacity': opacidade}
+    cabecalho = '<b>%{hovertext}</b><br><br>' if nome_hover else ''
+
+    def preenche(traco, linhas, posicoes):
+        traco['locations'] = locacoes[posicoes]
+        linhas[rotulo(rotulos, locais)] = '%{location}'
+        if textos is not None:
+            traco['hovertext'] = textos[posicoes]
+        for i, coluna in enumerate(dados_hover):
+            linhas[rotulo(rotulos, coluna)] = f'%{{customdata[{i}]}}'
+        if extra is not None:
+            traco['customdata'] = extra[posicoes]
+        return traco
+
+    layout = {'mapbox': {'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]}}, 'legend': {'tracegroupgap': 0}, 'margin': MARGEM_PX}
+    for chave, valor in (('center', centro), ('zoom', zoom), ('style', estilo)):
+        if valor is not None:
+            layout['mapbox'][chave] = valor
+    if altura:
+        layout['height'] = altura
+
+    tracos = []
+    if pd.api.types.is_numeric_dtype(df[cor]) and not pd.api.types.is_bool_dtype(df[cor]):
+        linhas = {}
+        traco = preenche({**base, 'name': ''}, linhas, slice(None))
+        traco['z'] = df[cor].to_numpy()
+        traco['coloraxis'] = 'coloraxis'
+        linhas[rotulo(rotulos, cor)] = '%{z}'
+        traco['hovertemplate'] = modelo_hover(linhas, cabecalho)
+        tracos.append(traco)
+        layout['coloraxis'] = {'colorscale': escala(tons), 'colorbar': {'title': {'text': rotulo(rotulos, cor)}}}
+        for chave, valor in (('cmid', tons_midpoint), ('cmin', (min_max or [None, None])[0]), ('cmax', (min_max or [None, None])[1])):
+            if valor is not None:
+                layout['coloraxis'][chave] = valor
+    else:
+        separados = grupos(df[cor], ordem)
+        cores = cor_grupos([nome for nome, _ in separados], mapa_cores)
+        for nome, posicoes in separados:
+            linhas = {rotulo(rotulos, cor): str(nome)}
+            traco = preenche({**base, 'name': str(nome), 'showlegend': True, 'showscale': False,
+                              'colorscale': [[0.0, cores[nome]], [1.0, cores[nome]]]}, linhas, posicoes)
+            traco['z'] = np.ones(len(posicoes), dtype=np.int64)
+            traco['hovertemplate'] = modelo_hover(linhas, cabecalho)
+            tracos.append(traco)
+        layout['legend']['title'] = {'text': rotulo(rotulos, cor)}
+    return figura(tracos, layout)
+
+
+# HEATMAP (imshow)
+def heatmap(pivot, rotulos, tons=None):
+    rotulo_x, rotulo_y, rotulo_cor = rotulos['x'], rotulos['y'], rotulos['color']
+    traco = {
+        'type': 'heatmap', 'name': '0', 'coloraxis': 'coloraxis', 'xaxis': 'x', 'yaxis': 'y',
+        'x': pivot.columns.to_numpy(), 'y': pivot.index.to_numpy(), 'z': pivot.to_numpy(),
+        'hovertemplate': f'{rotulo_x}: %{{x}}<br>{rotulo_y}: %{{y}}<br>{rotulo_cor}: %{{z}}<extra></extra>',
+    }
+    layout = eixos(rotulo_x, rotulo_y, x={'constrain': 'domain', 'scaleanchor': 'y'}, y={'autorange': 'reversed', 'constrain': 'domain'})
+    layout['coloraxis'] = {'colorscale': escala(tons), 'colorbar': {'title': {'text': rotulo_cor}}}
+    layout['margin'] = MARGEM_PX
+    return figura([traco], layout)
+
+
+# BOLHAS (scatter com tamanho)
+def bolhas(df, x, y, tamanho, cor, mapa_cores=None, rotulos=None, tamanho_max=20):
+    # y categórico e x numérico: orientação 'h', eixo y na ordem inversa dos grupos, como no px
+    separados = grupos(df[cor])
+    cores = cor_grupos([nome for nome, _ in separados], mapa_cores)
+    referencia = df[tamanho].max() / tamanho_max ** 2
+    xs, ys, tamanhos = valores(df[x]), valores(df[y]), df[tamanho].to_numpy()
+    tracos = []
+    for nome, posicoes in separados:
+        linhas = {rotulo(rotulos, cor): str(nome)}
+        linhas[rotulo(rotulos, x)] = '%{x}'
+        linhas[rotulo(rotulos, y)] = '%{y}'
+        linhas[rotulo(rotulos, tamanho)] = '%{marker.size}'
+        tracos.append({
+            'type': 'scatter', 'mode': 'markers', 'orientation': 'h', 'name': str(nome), 'legendgroup': str(nome),
+            'showlegend': True, 'xaxis': 'x', 'yaxis': 'y', 'x': xs[posicoes], 'y': ys[posicoes],
+            'marker': {'color': cores[nome], 'symbol': 'circle', 'size': tamanhos[posicoes], 'sizemode': 'area', 'sizeref': referencia},
+            'hovertemplate': modelo_hover(linhas),
+        })
+    ordem_y = [nome for nome, _ in separados] if y == cor else list(pd.unique(ys))
+    layout = eixos(rotulo(rotulos, x), rotulo(rotulos, y), y={'categoryorder': 'array', 'categoryarray': ordem_y[::-1]})
+    layout['legend'] = {'tracegroupgap': 0, 'title': {'text': rotulo(rotulos, cor)}, 'itemsizing': 'constant'}
+    layout['margin'] = MARGEM_PX
+    return figura(tracos, layout)
+
+
+# BARRAS E LINHAS
+def series(df, x, y, rotulos, tipo, cores=None):
+    # traços de um gráfico de barras ou de linhas: y uma coluna (um traço sem nome) ou várias
+    # colunas (formato largo do px: um traço por coluna, com legenda 'variable')
+    cores = cores or cores_padrao()
+    xs = valores(df[x])
+    colunas = [y] if isinstance(y, str) else list(y)
+    largo = not isinstance(y, str)
+    tracos = []
+    for i, coluna in enumerate(colunas):
+        nome = str(coluna) if largo else ''
+        linhas = {rotulo(rotulos, 'variable'): nome} if largo else {}
+        linhas[rotulo(rotulos, x)] = '%{x}'
+        linhas[rotulo(rotulos, 'value' if largo else coluna)] = '%{y}'
+        cor = cores[i % len(cores)]
+        traco = {'type': tipo, 'name': nome, 'legendgroup': nome, 'showlegend': largo, 'orientation': 'v',
+                 'xaxis': 'x', 'yaxis': 'y', 'x': xs, 'y': valores(df[coluna]), 'hovertemplate': modelo_hover(linhas)}
+        if tipo == 'bar':
+            traco.update({'alignmentgroup': 'True', 'offsetgroup': nome, 'textposition': 'auto',
+                          'marker': {'color': cor, 'pattern': {'shape': ''}}})
+        else:
+            traco.update({'mode': 'lines+markers', 'line': {'color': cor, 'dash': 'solid'}, 'marker': {'symbol': 'circle'}})
+        tracos.append(traco)
+    layout = eixos(rotulo(rotulos, x), rotulo(rotulos, 'value' if largo else colunas[0]))
+    layout['legend'] = {'tracegroupgap': 0}
+    if largo:
+        layout['legend']['title'] = {'text': rotulo(rotulos, 'variable')}
+    layout['margin'] = MARGEM_PX
+    return tracos, layout
+
+
+def barras(df, x, y, rotulos=None, modo=None, cores=None):
+    tracos, layout = series(df, x, y, rotulos, 'bar', cores)
+    layout['barmode'] = modo or 'relative'
+    return figura(tracos, layout)
+
+
+def linhas(df, x, y, rotulos=None, cores=None):
+    # sempre com marcadores (markers=True no px)
+    return figura(*series(df, x, y, rotulos, 'scatter', cores))
+
+
+# PIZZA
+def pizza(serie, rotulos=None):
+    # valores de `serie`, fatias pelo índice
+    nome_valores = serie.name
+    nome_fatias = serie.index.name or 'index'
+    traco = {
+        'type': 'pie', 'name': '', 'legendgroup': '', 'showlegend': True, 'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]},
+        'labels': valores(serie.index.to_series()), 'values': serie.to_numpy(),
+        'hovertemplate': modelo_hover({rotulo(rotulos, nome_fatias): '%{label}', rotulo(rotulos, nome_valores): '%{value}'}),
+    }
+    return figura([traco], {'legend': {'tracegroupgap': 0}, 'margin': MARGEM_PX})
+
+
+if __name__ == '__main__':
+    import json
+    import time
+    import warnings
+    import plotly.express as px
+
+    warnings.simplefilter('ignore')
+    rng = np.random.default_rng(0)
+    n = 853  # municípios de MG
+    tipologias = [f'Tipologia {i}' for i in range(12)]
+    cores_tipologias = {t: c for t, c in zip(tipologias, plotly.colors.qualitative.Dark24)}
+    classes = ['Muito Baixo', 'Baixo', 'Moderado', 'Alto', 'Muito Alto']
+    cores_classes = dict(zip(classes, ['#54A24B', '#72B7B2', '#EECA3B', '#F58518', '#E45756']))
+    rotulos = {'risco': 'Risco', 'ocorrencias': 'Ocorrências', 'code_muni': 'Código Municipal', 'loss_ratio': 'Índice de Sinistralidade',
+               'desastre_mais_comum': 'Desastre mais comum', 'ano': 'Ano', 'descricao_tipologia': 'Desastre'}
+    municipios = pd.DataFrame({
+        'code_muni': [str(3100000 + i) for i in range(n)], 'name_muni': [f'Município {i}' for i in range(n)],
+        'risco': pd.Categorical(rng.choice(classes, n), categories=classes, ordered=True),
+        'desastre_mais_comum': rng.choice(tipologias, n), 'ocorrencias': rng.integers(0, 400, n),
+        'loss_ratio': rng.random(n) * 150,
+    })
+    anos = np.arange(1991, 2023)
+    por_ano = pd.DataFrame([(a, t, int(rng.integers(1, 50))) for t in tipologias for a in anos], columns=['ano', 'descricao_tipologia', 'ocorrencias'])
+    pivot = pd.DataFrame(rng.integers(0, 90, (27, len(anos))), index=pd.Index([f'U{i:02d}' for i in range(27)], name='uf'), columns=pd.Index(anos, name='ano'))
+    meses = pd.DataFrame({'Mês': [f'M{i}-2021' for i in range(12)], 'num_apolice': rng.integers(50, 90, 12), 'loss_ratio': rng.random(12) * 100,
+                          'Prêmios Diretos': rng.random(12) * 1e6, 'Sinistros Diretos': rng.random(12) * 1e6})
+    fatias = pd.Series(rng.random(8) * 1e5, index=pd.Index(tipologias[:8], name='descricao_tipologia'), name='valor_indenizacao')
+    malha = 'app/static/malhas/exemplo.json'
+    comum = dict(locations='code_muni', featureidkey='properties.codarea', center={'lat': -18.5, 'lon': -44.5}, zoom=5,
+                 mapbox_style='carto-positron', height=500, hover_name='name_muni', opacity=0.95, labels=rotulos)
+    comum_go = dict(locais='code_muni', featureid='properties.codarea', rotulos=rotulos, centro={'lat': -18.5, 'lon': -44.5}, zoom=5, estilo='carto-positron',
+                    altura=500, nome_hover='name_muni', opacidade=0.95)
+
+    casos = {
+        'mapa por classe': (
+            lambda: px.choropleth_mapbox(municipios, geojson=malha, color='risco', color_discrete_map=cores_classes, category_orders={'risco': classes}, hover_data='ocorrencias', **comum),
+            lambda: mapa(municipios, malha, cor='risco', mapa_cores=cores_classes, ordem=classes, dados_hover='ocorrencias', **comum_go)),
+        'mapa do mais comum': (
+            lambda: px.choropleth_mapbox(municipios, geojson=malha, color='desastre_mais_comum', color_discrete_map=cores_tipologias, category_orders={'desastre_mais_comum': tipologias}, hover_data=['desastre_mais_comum', 'ocorrencias'], **comum),
+            lambda: mapa(municipios, malha, cor='desastre_mais_comum', mapa_cores=cores_tipologias, ordem=tipologias, dados_hover=['desastre_mais_comum', 'ocorrencias'], **comum_go)),
+        'mapa contínuo': (
+            lambda: px.choropleth_mapbox(municipios, geojson=malha, color='loss_ratio', color_continuous_scale='Reds', range_color=[0, 120], hover_data='loss_ratio', **comum),
+            lambda: mapa(municipios, malha, cor='loss_ratio', tons='Reds', min_max=[0, 120], dados_hover='loss_ratio', **comum_go)),
+        'heatmap': (
+            lambda: px.imshow(pivot, labels=dict(x='Ano', y='Estado (UF)', color='Total ocorrências'), x=pivot.columns, y=pivot.index, color_continuous_scale='Greys'),
+            lambda: heatmap(pivot, dict(x='Ano', y='Estado (UF)', color='Total ocorrências'), 'Greys')),
+        'bolhas': (
+            lambda: px.scatter(por_ano, x='ano', y='descricao_tipologia', size='ocorrencias', color='descricao_tipologia', size_max=50, color_discrete_map=cores_tipologias, labels=rotulos),
+            lambda: bolhas(por_ano, 'ano', 'descricao_tipologia', 'ocorrencias', 'descricao_tipologia', cores_tipologias, rotulos, tamanho_max=50)),
+        'barras': (
+            lambda: px.bar(meses, x='Mês', y='num_apolice', labels={'num_apolice': 'Apólices'}),
+            lambda: barras(meses, 'Mês', 'num_apolice', {'num_apolice': 'Apólices'})),
+        'barras agrupadas': (
+            lambda: px.bar(meses, x='Mês', y=['Prêmios Diretos', 'Sinistros Diretos'], barmode='group', labels={'value': 'Valor', 'variable': 'Tipo'}),
+            lambda: barras(meses, 'Mês', ['Prêmios Diretos', 'Sinistros Diretos'], {'value': 'Valor', 'variable': 'Tipo'}, modo='group')),
+        'linha': (
+            lambda: px.line(meses, x='Mês', y='loss_ratio', labels={'loss_ratio': 'Índice de Sinistralidade (%)'}, color_discrete_sequence=['#ff0000'], markers=True),
+            lambda: linhas(meses, 'Mês', 'loss_ratio', {'loss_ratio': 'Índice de Sinistralidade (%)'}, cores=['#ff0000'])),
+        'pizza': (
+            lambda: px.pie(fatias, values='valor_indenizacao', names=fatias.index),
+            lambda: pizza(fatias)),
+    }
+
+    def normaliza(fig):
+        # o px junta o modo de linhas e marcadores a partir de um set: a ordem varia entre processos
+        spec = json.loads(pio.to_json(fig, validate=False))
+        for traco in spec['data']:
+            if traco.get('mode') == 'markers+lines':
+                traco['mode'] = 'lines+markers'
+        return spec
+
+    def cronometra(construir, vezes=20):
+        construir()
+        inicio = time.perf_counter()
+        for _ in range(vezes):
+            construir()
+        return (time.perf_counter() - inicio) / vezes * 1000
+
+    print(f'{"gráfico":<20}{"px (ms)":>10}{"go (ms)":>10}{"ganho":>8}')
+    for nome, (com_px, com_go) in casos.items():
+        assert normaliza(com_px()) == normaliza(com_go()), nome
+        t_px, t_go = cronometra(com_px), cronometra(com_go)
+        print(f'{nome:<20}{t_px:>10.1f}{t_go:>10.1f}{t_px / t_go:>7.1f}x')
@@ -0,0 +1,402 @@
+import os
+import json
+import math
+import argparse
+import hashlib
+import tempfile
+import threading
+import requests
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Armazém local das malhas municipais do IBGE. Cada malha fica em um arquivo identificado por
+# (tipo, uf, intrarregiao, qualidade); o app lê do disco e só vai à API do IBGE quando a malha
+# ainda não foi baixada. Para preencher o armazém (e o índice por codarea) de uma vez:
+# python malhas.py (conferência offline, contra um servidor HTTP local no lugar da API:
+# pytest tests/test_malhas.py)
+URL_IBGE = 'https://servicodados.ibge.gov.br/api/v3/malhas'
+DIR_MALHAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'malhas')
+TIMEOUT = (5, 30)
+# níveis de zoom para os quais guardamos uma versão simplificada da malha; acima do maior
+# deles o mapa usa a malha original
+ZOOMS = [1, 3, 5, 7]
+UFS = ['AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA', 'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO']
+
+
+def cria_sessao(conexoes=10, tentativas=3):
+    retry = Retry(total=tentativas, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+    adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=retry)
+    sessao = requests.Session()
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    return sessao
+
+
+# sessão única do processo para as malhas que faltam no armazém (o pool e o retry são reaproveitados)
+SESSAO = cria_sessao(conexoes=4)
+
+
+def url_malha(tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima', base=URL_IBGE):
+    return f'{base}/{tipo}/{uf}?formato=application/vnd.geo+json&intrarregiao={intrarregiao}&qualidade={qualidade}'
+
+
+def arquivo_malha(tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima', destino=DIR_MALHAS):
+    return os.path.join(destino, f'{tipo}_{uf}_{intrarregiao}_{qualidade}.json')
+
+
+def baixa_malha(sessao, tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima', base=URL_IBGE, timeout=TIMEOUT):
+    resposta = sessao.get(url_malha(tipo, uf, intrarregiao, qualidade, base), timeout=timeout)
+    resposta.raise_for_status()
+    return resposta.json()
+
+
+def salva_malha(malha, caminho):
+    # grava em arquivo temporário e troca de nome, para um leitor concorrente nunca ver JSON pela metade
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    os.makedirs(pasta, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=pasta, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(malha, f, separators=(',', ':'))
+        os.chmod(temporario, 0o644)
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.remove(temporario)
+        raise
+
+
+def obtem_malha(tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima', destino=DIR_MALHAS, base=URL_IBGE, sessao=None):
+    caminho = arquivo_malha(tipo, uf, intrarregiao, qualidade, destino)
+    if os.path.exists(caminho):
+        with open(caminho, 'r') as f:
+            return json.load(f)
+
+    malha = baixa_malha(sessao or SESSAO, tipo, uf, intrarregiao, qualidade, base)
+    try:
+        salva_malha(malha, caminho)
+        salva_versoes(malha, caminho)
+    except OSError as e:
+        print(f'Aviso: não foi possível salvar a malha em {caminho}: {e}')
+    return malha
+
+
+def obtem_versoes(tipo='estados', uf='PI', intrarregiao='municipio', qualidade='minima', destino=DIR_MALHAS, base=URL_IBGE, sessao=None):
+    malha = obtem_malha(tipo, uf, intrarregiao, qualidade, destino, base, sessao)
+    return carrega_versoes(arquivo_malha(tipo, uf, intrarregiao, qualidade, destino), malha)
+
+
+# SIMPLIFICAÇÃO POR NÍVEL DE ZOOM
+# As fronteiras compartilhadas entre dois polígonos são quebradas em arcos nos pontos de junção
+# (onde três ou mais áreas se encontram) e cada arco é simplificado uma única vez, com
+# Douglas-Peucker; os dois vizinhos recebem exatamente a mesma linha, sem frestas nem sobreposições.
+def tolerancia_zoom(zoom):
+    # meio pixel de um tile de 256 px, em graus
+    return 0.5 * 360 / (256 * 2 ** zoom)
+
+
+def _douglas_peucker(pontos, tolerancia):
+    if len(pontos) < 3:
+        return pontos
+    manter = np.zeros(len(pontos), dtype=bool)
+    manter[0] = manter[-1] = True
+    pilha = [(0, len(pontos) - 1)]
+    while pilha:
+        i, j = pilha.pop()
+        if j <= i + 1:
+            continue
+        a, b = pontos[i], pontos[j]
+        trecho = pontos[i + 1:j]
+        dx, dy = b - a
+        comprimento = math.hypot(dx, dy)
+        if comprimento == 0:
+            distancias = np.hypot(trecho[:, 0] - a[0], trecho[:, 1] - a[1])
+        else:
+            distancias = np.abs(dx * (trecho[:, 1] - a[1]) - dy * (trecho[:, 0] - a[0])) / comprimento
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            k += i + 1
+            manter[k] = True
+            pilha.extend([(i, k), (k, j)])
+    return pontos[manter]
+
+
+def _aneis(malha):
+    for feature in malha['features']:
+        geometria = feature['geometry']
+        poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+        for poligono in poligonos:
+            for anel in poligono:
+                yield [tuple(p[:2]) for p in anel[:-1]]
+
+
+def _juncoes(malha):
+    vizinhos = {}
+    juncoes = set()
+    for anel in _aneis(malha):
+        n = len(anel)
+        for i, ponto in enumerate(anel):
+            par = frozenset((anel[i - 1], anel[(i + 1) % n]))
+            anterior = vizinhos.setdefault(ponto, par)
+            if anterior != par:
+                juncoes.add(ponto)
+    return juncoes
+
+
+def _simplifica_anel(anel, juncoes, arcos, tolerancia, casas):
+    anel = [tuple(p[:2]) for p in anel[:-1]]
+    cortes = [i for i, p in enumerate(anel) if p in juncoes]
+    if not cortes:
+        # anel sem junções (ilha, ou buraco preenchido por um único vizinho): corta no menor
+        # ponto, que é o mesmo nos dois lados
+        cortes = [anel.index(min(anel))]
+
+    inicio = cortes[0]
+    anel = anel[inicio:] + anel[:inicio]
+    cortes = [c - inicio for c in cortes] + [len(anel)]
+    anel.append(anel[0])
+
+    resultado = []
+    for a, b in zip(cortes[:-1], cortes[1:]):
+        arco = tuple(anel[a:b + 1])
+        invertido = arco[::-1]
+        chave = min(arco, invertido)
+        if chave not in arcos:
+            simplificado = _douglas_peucker(np.array(chave), tolerancia).round(casas).tolist()
+            arcos[chave] = simplificado
+        simplificado = arcos[chave] if chave == arco else arcos[chave][::-1]
+        resultado.extend(simplificado if not resultado else simplificado[1:])
+    return resultado
+
+
+def simplifica_malha(malha, tolerancia):
+    juncoes = _juncoes(malha)
+    arcos = {}
+    casas = max(0, math.ceil(-math.log10(tolerancia)) + 1)
+
+    features = []
+    for feature in malha['features']:
+        geometria = feature['geometry']
+        poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+        novos = []
+        for poligono in poligonos:
+            aneis = [_simplifica_anel(anel, juncoes, arcos, tolerancia, casas) for anel in poligono]
+            # polígonos e buracos menores que a tolerância somem
+            if len(aneis[0]) >= 4:
+                novos.append([anel for anel in aneis if len(anel) >= 4])
+        if not novos:
+            # a área inteira é menor que a tolerância: mantém o contorno original para ela não sumir do mapa
+            novos = [[np.array(poligono[0])[:, :2].round(casas).tolist()] for poligono in poligonos]
+        coordenadas = novos[0] if geometria['type'] == 'Polygon' else novos
+        features.append({**feature, 'geometry': {'type': geometria['type'], 'coordinates': coordenadas}})
+    return {**malha, 'features': features}
+
+
+def arquivo_versao(caminho, zoom):
+    raiz, extensao = os.path.splitext(caminho)
+    return f'{raiz}_z{zoom}{extensao}'
+
+
+def salva_versoes(malha, caminho, zooms=ZOOMS):
+    for zoom in zooms:
+        salva_malha(simplifica_malha(malha, tolerancia_zoom(zoom)), arquivo_versao(caminho, zoom))
+
+
+def carrega_versoes(caminho, malha=None, zooms=ZOOMS):
+    if malha is None:
+        with open(caminho, 'r') as f:
+            malha = json.load(f)
+
+    versoes = {math.inf: malha}
+    for zoom in zooms:
+        arquivo = arquivo_versao(caminho, zoom)
+        if os.path.exists(arquivo):
+            with open(arquivo, 'r') as f:
+                versoes[zoom] = json.load(f)
+        else:
+            versoes[zoom] = simplifica_malha(malha, tolerancia_zoom(zoom))
+    return versoes
+
+
+def escolhe_versao(versoes, zoom):
+    # a versão feita para o menor zoom que ainda cobre o zoom pedido
+    return versoes[min(z for z in versoes if z >= zoom)]
+
+
+# ÍNDICE POR CODAREA
+# Cada área (país ou UF) vira uma linha de um parquet ordenado por codarea, com a feature GeoJSON
+# já serializada em cada resolução. O índice é gerado junto com o armazém (python malhas.py, ou só
+# ele: python malhas.py --indice) e o app apenas o lê, com o pyarrow. Sem o arquivo (ou numa cópia
+# só de leitura), o app monta o mesmo índice em memória a partir do GeoJSON, sem gravar nada.
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+INDICES = [os.path.join(DIR_APP, 'malha_latam.json'), os.path.join(DIR_APP, 'malha_brasileira.json')]
+
+
+def arquivo_indice(caminho_geojson, destino=DIR_MALHAS):
+    return os.path.join(destino, os.path.splitext(os.path.basename(caminho_geojson))[0] + '.parquet')
+
+
+def coluna_geojson(zoom):
+    return 'geojson' if zoom == math.inf else f'geojson_z{zoom}'
+
+
+def tabela_indice(caminho_geojson, zooms=ZOOMS):
+    versoes = carrega_versoes(caminho_geojson, zooms=zooms)
+    colunas = {'codarea': [str(feature['properties']['codarea']) for feature in versoes[math.inf]['features']]}
+    for zoom, versao in versoes.items():
+        colunas[coluna_geojson(zoom)] = [json.dumps(feature, separators=(',', ':')) for feature in versao['features']]
+    return pa.table(colunas).sort_by('codarea')
+
+
+def salva_indice(caminho_geojson, destino=DIR_MALHAS, zooms=ZOOMS):
+    caminho = arquivo_indice(caminho_geojson, destino)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    pq.write_table(tabela_indice(caminho_geojson, zooms), caminho, row_group_size=8)
+    return caminho
+
+
+def carrega_indice(caminho_geojson, destino=DIR_MALHAS, zooms=ZOOMS):
+    caminho = arquivo_indice(caminho_geojson, destino)
+    colunas = ['codarea'] + [coluna_geojson(zoom) for zoom in [math.inf] + zooms]
+    if os.path.exists(caminho):
+        tabela = pq.read_table(caminho, columns=colunas)
+    else:
+        print(f'Aviso: índice {caminho} não encontrado (gere com python malhas.py --indice); montando em memória')
+        tabela = tabela_indice(caminho_geojson, zooms).select(colunas)
+    posicoes = {}
+    for i, codarea in enumerate(tabela.column('codarea').to_pylist()):
+        posicoes.setdefault(codarea, []).append(i)
+    return {'tabela': tabela, 'posicoes': posicoes, 'zooms': [math.inf] + zooms}
+
+
+def malha_area(indice, codarea, zoom=math.inf):
+    # lê só as linhas da área pedida, na resolução adequada ao zoom
+    coluna = indice['tabela'].column(coluna_geojson(min(z for z in indice['zooms'] if z >= zoom)))
+    linhas = indice['posicoes'].get(str(codarea), [])
+    return {'type': 'FeatureCollection', 'features': [json.loads(coluna[i].as_py()) for i in linhas]}
+
+
+def prefetch(ufs=UFS, tipo='estados', intrarregiao='municipio', qualidade='minima', destino=DIR_MALHAS, base=URL_IBGE, trabalhadores=8, sobrescrever=False):
+    sessao = cria_sessao(conexoes=trabalhadores)
+    pendentes = [uf for uf in ufs if sobrescrever or not os.path.exists(arquivo_malha(tipo, uf, intrarregiao, qualidade, destino))]
+    falhas = {}
+
+    def baixa_e_salva(uf):
+        malha = baixa_malha(sessao, tipo, uf, intrarregiao, qualidade, base)
+        caminho = arquivo_malha(tipo, uf, intrarregiao, qualidade, destino)
+        salva_malha(malha, caminho)
+        salva_versoes(malha, caminho)
+
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        futuros = {executor.submit(baixa_e_salva, uf): uf for uf in pendentes}
+        for futuro in as_completed(futuros):
+            uf = futuros[futuro]
+            try:
+                futuro.result()
+                print(f'{uf}: ok')
+            except (requests.RequestException, ValueError, OSError) as e:
+                falhas[uf] = e
+                print(f'{uf}: falhou ({e})')
+    return falhas
+
+
+
+# MALHAS COMO ARQUIVOS ESTÁTICOS
+# O mapa não leva mais a malha dentro da figura: cada versão é gravada uma vez em static/malhas
+# com o hash do conteúdo no nome e a figura só aponta a URL (o plotly.js baixa o GeoJSON). O
+# navegador guarda o arquivo, e trocar um filtro só manda pelo websocket os códigos e as cores.
+# Como o nome muda quando a malha muda, o arquivo nunca fica velho e pode ser marcado como
+# imutável. O Streamlit serve a pasta static com server.enableStaticServing (respondendo com ETag,
+# então o navegador revalida com um 304); para cabeçalhos de cache longos, sirva a mesma pasta com
+# python malhas.py --serve PORTA (ou por um proxy/CDN) e aponte MAPA_URL_MALHAS para ela.
+DIR_ESTATICO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'malhas')
+URL_ESTATICO = os.environ.get('MAPA_URL_MALHAS', 'app/static/malhas')
+CACHE_ESTATICO = 'public, max-age=31536000, immutable'
+MAX_PUBLICADAS = 256
+_publicadas = OrderedDict()
+_trava_publicadas = threading.Lock()
+
+
+def publica_malha(malha, destino=DIR_ESTATICO, base=URL_ESTATICO):
+    # grava a malha com o hash do conteúdo no nome (se ainda não existe) e devolve a URL dela
+    texto = json.dumps(malha, separators=(',', ':'))
+    nome = hashlib.sha1(texto.encode('utf-8')).hexdigest()[:20] + '.json'
+    caminho = os.path.join(destino, nome)
+    if not os.path.exists(caminho):
+        salva_malha(malha, caminho)
+    return f'{base.rstrip("/")}/{nome}'
+
+
+def url_publicada(malha, destino=DIR_ESTATICO, base=URL_ESTATICO):
+    # publica_malha lembrada por objeto: as malhas do app são carregadas uma vez e reaproveitadas,
+    # então o hash de vários MB sai só no primeiro mapa. A malha fica referenciada enquanto está na
+    # lista, então o id não é reaproveitado por outro objeto
+    with _trava_publicadas:
+        guardada = _publicadas.get(id(malha))
+        if guardada is not None and guardada[1] == (destino, base):
+            _publicadas.move_to_end(id(malha))
+            return guardada[2]
+    url = publica_malha(malha, destino, base)
+    with _trava_publicadas:
+        _publicadas[id(malha)] = (malha, (destino, base), url)
+        while len(_publicadas) > MAX_PUBLICADAS:
+            _publicadas.popitem(last=False)
+    return url
+
+
+class ArquivosImutaveis(SimpleHTTPRequestHandler):
+    def end_headers(self):
+        self.send_header('Cache-Control', CACHE_ESTATICO)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        super().end_headers()
+
+
+def serve_estaticos(porta, destino=DIR_ESTATICO):
+    # serve static/malhas em http://<host>:<porta>/ com cache de um ano (os nomes são versionados)
+    def handler(*args, **kwargs):
+        return ArquivosImutaveis(*args, directory=destino, **kwargs)
+    os.makedirs(destino, exist_ok=True)
+    with ThreadingHTTPServer(('', porta), handler) as servidor:
+        print(f'Servindo {destino} em http://localhost:{porta}/ (MAPA_URL_MALHAS=http://<host>:{porta})')
+        servidor.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Baixa as malhas municipais do IBGE para o armazém local.')
+    parser.add_argument('--ufs', nargs='+', default=UFS)
+    parser.add_argument('--tipo', default='estados')
+    parser.add_argument('--intrarregiao', default='municipio')
+    parser.add_argument('--qualidade', default='minima')
+    parser.add_argument('--destino', default=DIR_MALHAS)
+    parser.add_argument('--base', default=URL_IBGE, help='URL base da API de malhas (ex.: um servidor local de testes)')
+    parser.add_argument('--trabalhadores', type=int, default=8)
+    parser.add_argument('--sobrescrever', action='store_true')
+    parser.add_argument('--simplifica', nargs='+', metavar='GEOJSON', help='apenas gera as versões simplificadas destes arquivos')
+    parser.add_argument('--indice', nargs='*', metavar='GEOJSON', help='apenas gera o índice por codarea destes arquivos (padrão: as malhas do app)')
+    parser.add_argument('--serve', type=int, metavar='PORTA', help='apenas serve as malhas publicadas (static/malhas) com cache longo')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_estaticos(args.serve)
+        raise SystemExit(0)
+
+    if args.indice is not None:
+        for caminho in args.indice or INDICES:
+            print(salva_indice(caminho, args.destino))
+        raise SystemExit(0)
+
+    if args.simplifica:
+        for caminho in args.simplifica:
+            with open(caminho, 'r') as f:
+                salva_versoes(json.load(f), caminho)
+        raise SystemExit(0)
+
+    for caminho in INDICES:
+        print(salva_indice(caminho, args.destino))
+    falhas = prefetch(args.ufs, args.tipo, args.intrarregiao, args.qualidade, args.destino, args.base, args.trabalhadores, args.sobrescrever)
+    raise SystemExit(1 if falhas else 0)
@@ -0,0 +1,104 @@
+import bisect
+import unicodedata
+import numpy as np
+import pandas as pd
+
+# CATÁLOGO DE MUNICÍPIOS
+# Um registro por code_muni (nome, UF, lat/lon, área, população e PIB per capita), montado uma vez
+# a partir das tabelas de áreas, coordenadas e pop/PIB. O zoom dos mapas passa a escolher pelo
+# código: nomes repetidos em UFs diferentes (São José, Bom Jesus, ...) não se confundem e a
+# consulta é um acesso ao dicionário. A busca por nome vale para os 5.570 municípios, sem acento e
+# sem diferença de maiúsculas: primeiro os nomes que começam com o texto (busca binária na lista
+# ordenada) e, depois, os parecidos por trigramas (como o pg_trgm), para erros de digitação.
+SIMILARIDADE_MINIMA = 0.3
+
+
+def normaliza(texto):
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(texto.replace('-', ' ').replace("'", '').split())
+
+
+def trigramas(texto):
+    # cada palavra com dois espaços antes e um depois, como no pg_trgm
+    return {f'  {palavra} '[i:i + 3] for palavra in texto.split() for i in range(len(palavra) + 1)}
+
+
+def cria_catalogo(areas, coordenadas, pop_pib):
+    tabela = areas[['code_muni', 'name_muni', 'abbrev_state', 'AREA_KM2']].astype({'code_muni': str})
+    tabela = tabela.drop_duplicates(subset='code_muni', keep='first')
+    tabela = tabela.merge(coordenadas[['codarea', 'lat', 'lon']].astype({'codarea': str}), how='left', left_on='code_muni', right_on='codarea')
+    tabela = tabela.merge(pop_pib[['code_muni', 'populacao', 'pib_per_capita']].astype({'code_muni': str}), how='left', on='code_muni')
+    tabela = tabela.drop(columns='codarea').reset_index(drop=True)
+
+    codigos = tabela.code_muni.to_numpy(dtype=object)
+    nomes = [normaliza(nome) for nome in tabela.name_muni]
+    registros = {
+        linha['code_muni']: {
+            'nome': linha['name_muni'],
+            'uf': linha['abbrev_state'],
+            'rotulo': f"{linha['name_muni']} ({linha['abbrev_state']})",
+            'lat': linha['lat'],
+            'lon': linha['lon'],
+            'area_km2': linha['AREA_KM2'],
+            'populacao': linha['populacao'],
+            'pib_per_capita': linha['pib_per_capita'],
+        }
+        for linha in tabela.astype(object).where(tabela.notna(), None).to_dict('records')
+    }
+
+    ordem = sorted(range(len(codigos)), key=lambda i: (nomes[i], tabela.abbrev_state[i]))
+    por_uf = {}
+    for i in ordem:
+        por_uf.setdefault(tabela.abbrev_state[i], []).append(codigos[i])
+
+    indice = {}
+    tri_por_nome = [trigramas(nome) for nome in nomes]
+    for i, tris in enumerate(tri_por_nome):
+        for tri in tris:
+            indice.setdefault(tri, []).append(i)
+
+    return {
+        'codigos': codigos,
+        'registros': registros,
+        'por_uf': por_uf,
+        'nomes_ordenados': [nomes[i] for i in ordem],
+        'ordem': np.array(ordem, dtype=np.int64),
+        'populacao': pd.to_numeric(tabela.populacao, errors='coerce').fillna(0).to_numpy(dtype=np.float64),
+        'trigramas': {tri: np.array(posicoes, dtype=np.int64) for tri, posicoes in indice.items()},
+        'total_trigramas': np.array([len(tris) for tris in tri_por_nome], dtype=np.int64),
+    }
+
+
+def municipio(catalogo, codigo):
+    return catalogo['registros'].get(str(codigo))
+
+
+def opcoes_uf(catalogo, uf):
+    # códigos da UF em ordem alfabética do nome
+    return catalogo['por_uf'].get(uf, [])
+
+
+def busca(catalogo, texto, limite=20):
+    # códigos dos municípios de qualquer UF: prefixo do nome primeiro (os mais populosos antes),
+    # depois os parecidos por trigramas, do mais ao menos parecido
+    consulta = normaliza(texto)
+    if not consulta:
+        return []
+    nomes = catalogo['nomes_ordenados']
+    inicio = bisect.bisect_left(nomes, consulta)
+    fim = bisect.bisect_left(nomes, consulta + '\uffff')
+    prefixo = catalogo['ordem'][inicio:fim]
+    prefixo = prefixo[np.argsort(-catalogo['populacao'][prefixo], kind='stable')]
+    if len(prefixo) >= limite:
+        return catalogo['codigos'][prefixo[:limite]].tolist()
+
+    tris = [catalogo['trigramas'][tri] for tri in trigramas(consulta) if tri in catalogo['trigramas']]
+    if not tris:
+        return catalogo['codigos'][prefixo].tolist()
+    comuns = np.bincount(np.concatenate(tris), minlength=len(catalogo['codigos']))
+    similaridade = comuns / (len(trigramas(consulta)) + catalogo['total_trigramas'] - comuns)
+    similaridade[prefixo] = 0
+    parecidos = np.flatnonzero(similaridade >= SIMILARIDADE_MINIMA)
+    parecidos = parecidos[np.lexsort((-catalogo['populacao'][parecidos], -similaridade[parecidos]))]
+    return catalogo['codigos'][np.r_[prefixo, parecidos][:limite].astype(np.int64)].tolist()
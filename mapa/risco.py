@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+# Classificação de risco em cinco classes a partir de quatro quebras. Um valor vai para a classe
+# i quando é maior que i quebras (mesmo critério do classificador original: > q80 é Muito Alto).
+# As quebras podem vir de esquemas diferentes e de um escopo maior que o mapa (o país inteiro,
+# por exemplo), por isso o cálculo das quebras é separado da classificação.
+CLASSES = ['Muito Baixo', 'Baixo', 'Moderado', 'Alto', 'Muito Alto']
+ESQUEMAS = ['quintis', 'jenks', 'intervalos']
+
+
+def quebras_quintis(valores, classes=len(CLASSES)):
+    return np.quantile(valores, np.arange(1, classes) / classes)
+
+
+def quebras_intervalos(valores, classes=len(CLASSES)):
+    return np.linspace(valores.min(), valores.max(), classes + 1)[1:-1]
+
+
+def quebras_jenks(valores, classes=len(CLASSES)):
+    # quebras naturais de Fisher-Jenks (soma dos desvios quadrados mínima dentro das classes).
+    # Roda sobre os valores distintos, pesados pela frequência: contagens de ocorrências têm
+    # poucos valores distintos mesmo com milhares de municípios.
+    x, w = np.unique(valores, return_counts=True)
+    n = len(x)
+    if n <= classes:
+        # menos valores distintos que classes: cada valor é uma classe e o maior fica no topo
+        return np.r_[np.repeat(x[0], classes - n), x[:-1]]
+
+    w = w.astype(np.float64)
+    W = np.r_[0, np.cumsum(w)]
+    S1 = np.r_[0, np.cumsum(w * x)]
+    S2 = np.r_[0, np.cumsum(w * x * x)]
+
+    def custo(i, j):
+        # soma dos desvios quadrados de x[i:j], com i vetor e j escalar
+        peso = W[j] - W[i]
+        soma = S1[j] - S1[i]
+        return S2[j] - S2[i] - soma * soma / peso
+
+    # melhor[k, j]: menor custo para x[:j] em k+1 classes; inicio[k, j]: onde começa a última
+    melhor = np.full((classes, n + 1), np.inf)
+    inicio = np.zeros((classes, n + 1), dtype=np.int64)
+    melhor[0, 1:] = custo(np.zeros(n, dtype=np.int64), np.arange(1, n + 1))
+    for k in range(1, classes):
+        for j in range(k + 1, n + 1):
+            i = np.arange(k, j)
+            total = melhor[k - 1, i] + custo(i, j)
+            m = int(np.argmin(total))
+            melhor[k, j] = total[m]
+            inicio[k, j] = i[m]
+
+    fins = [n]
+    for k in range(classes - 1, 0, -1):
+        fins.append(inicio[k, fins[-1]])
+    # a quebra é o maior valor de cada classe, exceto a última
+    return x[np.array(fins[:0:-1]) - 1]
+
+
+QUEBRAS = {
+    'quintis': quebras_quintis,
+    'jenks': quebras_jenks,
+    'intervalos': quebras_intervalos,
+}
+
+
+def quebras(valores, esquema='quintis'):
+    valores = np.asarray(valores, dtype=np.float64)
+    valores = valores[~np.isnan(valores)]
+    if len(valores) == 0:
+        return np.zeros(len(CLASSES) - 1)
+    return QUEBRAS[esquema](valores)
+
+
+def classifica(valores, quebras):
+    valores = np.asarray(valores, dtype=np.float64)
+    codigos = np.searchsorted(quebras, valores, side='left')
+    # sem valor conta como Muito Baixo, como nas comparações do classificador original
+    codigos[np.isnan(valores)] = 0
+    return pd.Categorical.from_codes(codigos, categories=CLASSES, ordered=True)
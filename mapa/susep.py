@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from agrega import codifica
+
+# ACUMULADO DA SUSEP
+# Os seis valores da SUSEP (e o número de linhas) somados por célula (uf, seguradora, ramo) e
+# data, acumulados ao longo das datas, como no cubo do atlas. A soma de qualquer janela
+# [inicio, fim) é a diferença entre duas posições do acumulado; as métricas, as seguradoras em
+# ordem de prêmio, as barras por mês e a pizza por ramo saem de arrays do tamanho das células
+# da uf, sem voltar à tabela. O eixo do tempo são as datas distintas da tabela (uma por mês nos
+# dados da SUSEP), então a janela é exata mesmo sem começar no dia 1.
+MEDIDAS = ['premio_dir', 'sin_dir', 'premio_ret', 'prem_ret_liq', 'salvados', 'recuperacao']
+DIMENSOES = ['uf', 'seguradora', 'ramo']
+
+
+def cria_acumulado(df):
+    df = df[df.data.notna().to_numpy()]
+    datas = np.unique(df.data.to_numpy(dtype='datetime64[ns]'))
+    posicao = np.searchsorted(datas, df.data.to_numpy(dtype='datetime64[ns]'))
+
+    # uf é a dimensão mais significativa: as células de cada uf ficam num intervalo contíguo
+    codigos, categorias = {}, {}
+    chaves = np.zeros(len(df), dtype=np.int64)
+    for d in DIMENSOES:
+        cod, categorias[d] = codifica(df[d])
+        codigos[d] = cod + 1  # 0 fica para o vazio
+        chaves = chaves * (len(categorias[d]) + 1) + codigos[d]
+    celula, chaves_celulas = pd.factorize(chaves, sort=True)
+
+    valores = np.column_stack([df[m].to_numpy(dtype=np.float64, na_value=0) for m in MEDIDAS] + [np.ones(len(df))])
+    n_celulas, n_datas = len(chaves_celulas), len(datas)
+    acumulado = np.zeros((n_celulas, n_datas + 1, valores.shape[1]))
+    posicao_celula = celula * n_datas + posicao
+    for j in range(valores.shape[1]):
+        somas = np.bincount(posicao_celula, weights=valores[:, j], minlength=n_celulas * n_datas)
+        np.cumsum(somas.reshape(n_celulas, n_datas), axis=1, out=acumulado[:, 1:, j])
+
+    tabela = {}
+    for d in reversed(DIMENSOES):
+        chaves_celulas, cod = np.divmod(chaves_celulas, len(categorias[d]) + 1)
+        tabela[d] = pd.Categorical.from_codes(cod - 1, categories=categorias[d])
+    celulas = pd.DataFrame({d: tabela[d] for d in DIMENSOES})
+    faixas = {uf: (pos[0], pos[-1] + 1) for uf, pos in celulas.groupby('uf', observed=True).indices.items()}
+    return {'datas': datas, 'celulas': celulas, 'acumulado': acumulado, 'faixas': faixas}
+
+
+def fatia_acumulado(acumulado, uf, inicio, fim, seguradoras=None):
+    # posições das células da uf (só das seguradoras dadas, se houver) e da janela [inicio, fim)
+    ini, fim_uf = acumulado['faixas'].get(uf, (0, 0))
+    posicoes = np.arange(ini, fim_uf)
+    if seguradoras:
+        posicoes = posicoes[acumulado['celulas'].seguradora.iloc[ini:fim_uf].isin(seguradoras).to_numpy(dtype=bool)]
+    i0, i1 = np.searchsorted(acumulado['datas'], [np.datetime64(pd.Timestamp(inicio), 'ns'), np.datetime64(pd.Timestamp(fim), 'ns')])
+    return posicoes, i0, i1
+
+
+def soma_periodo(acumulado, uf, inicio, fim, seguradoras=None, por=None):
+    # totais das MEDIDAS na janela; com `por` (seguradora ou ramo), por grupo, só os que têm linhas
+    posicoes, i0, i1 = fatia_acumulado(acumulado, uf, inicio, fim, seguradoras)
+    somas = acumulado['acumulado'][posicoes, i1] - acumulado['acumulado'][posicoes, i0]
+    if por is None:
+        return pd.Series(somas[:, :len(MEDIDAS)].sum(axis=0), index=MEDIDAS)
+    coluna = acumulado['celulas'][por]
+    codigos = coluna.cat.codes.to_numpy()[posicoes]
+    grupos = np.zeros((len(coluna.cat.categories), somas.shape[1]))
+    np.add.at(grupos, codigos[codigos >= 0], somas[codigos >= 0])
+    com_linhas = grupos[:, -1] > 0
+    return pd.DataFrame(grupos[com_linhas, :len(MEDIDAS)], columns=MEDIDAS,
+                        index=pd.Index(coluna.cat.categories[com_linhas], name=por))
+
+
+def soma_por_mes(acumulado, uf, inicio, fim, seguradoras=None):
+    # MEDIDAS por (ano, mês) na janela, só os meses com linhas
+    posicoes, i0, i1 = fatia_acumulado(acumulado, uf, inicio, fim, seguradoras)
+    por_data = np.diff(acumulado['acumulado'][posicoes, i0:i1 + 1].sum(axis=0), axis=0)
+    datas = pd.DatetimeIndex(acumulado['datas'][i0:i1])
+    meses, posicao_mes = np.unique(datas.year * 12 + datas.month - 1, return_inverse=True)
+    grupos = np.zeros((len(meses), por_data.shape[1]))
+    np.add.at(grupos, posicao_mes, por_data)
+    com_linhas = grupos[:, -1] > 0
+    indice = pd.MultiIndex.from_arrays([meses[com_linhas] // 12, meses[com_linhas] % 12 + 1], names=['ano', 'mes'])
+    return pd.DataFrame(grupos[com_linhas, :len(MEDIDAS)], columns=MEDIDAS, index=indice)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from consulta import (MOTORES, OPERADORES, NaoSuportado, disponivel, expressao, filtra, mascara, mascara_arrow,
+                      mascara_pandas, nova_cache, resolve_motor)
+
+UFS = ['PI', 'CE', 'BA', 'SP', None]
+
+
+def cria_tabela(semente, n=2000):
+    # tabela pequena com os tipos que o app filtra: categórica, texto do Arrow, object, int32, float e data
+    gerador = np.random.default_rng(semente)
+    return pd.DataFrame({
+        'uf': pd.Categorical(gerador.choice(UFS, n)),
+        'tipologia': pd.Series(gerador.choice(['Seca', 'Granizo', '-', None], n), dtype=pd.ArrowDtype(pa.string())),
+        'cultura': gerador.choice(['Soja', 'Milho', 'Café', None], n).astype(object),
+        'ano': pd.Series(gerador.integers(1991, 2023, n), dtype=pd.ArrowDtype(pa.int32())),
+        'valor': np.where(gerador.random(n) < 0.05, np.nan, gerador.normal(100, 30, n)),
+        'data': pd.Series(pd.to_datetime('2006-01-01') + pd.to_timedelta(gerador.integers(0, 5800, n), unit='D'), dtype=pd.ArrowDtype(pa.timestamp('ns'))),
+    })
+
+
+@pytest.fixture(scope='module')
+def tabela():
+    return cria_tabela(0)
+
+
+def candidatos(gerador):
+    return [
+        lambda: ('uf', gerador.choice(['==', '!=']), str(gerador.choice(UFS[:-1] + ['XX']))),
+        lambda: ('uf', 'isin', list(gerador.choice(UFS[:-1], 2))),
+        lambda: ('tipologia', gerador.choice(['==', '!=']), str(gerador.choice(['Seca', '-']))),
+        lambda: ('cultura', 'isin', list(gerador.choice(['Soja', 'Milho', 'Café'], gerador.integers(1, 3)))),
+        lambda: ('cultura', gerador.choice(['==', '!=']), 'Soja'),
+        lambda: ('ano', str(gerador.choice(list(OPERADORES))), int(gerador.integers(1991, 2023))),
+        lambda: ('valor', str(gerador.choice(['<', '>=', '!='])), float(gerador.normal(100, 30))),
+        lambda: ('data', str(gerador.choice(['>=', '<'])), pd.Timestamp('2006-01-01') + pd.Timedelta(days=int(gerador.integers(0, 5800)))),
+    ]
+
+
+def planos(semente, rodadas):
+    gerador = np.random.default_rng(semente)
+    opcoes = candidatos(gerador)
+    for _ in range(rodadas):
+        yield [opcoes[i]() for i in gerador.choice(len(opcoes), gerador.integers(1, 4), replace=False)]
+
+
+def planos_estreitando(semente, rodadas):
+    # como os filtros do app: um plano e depois planos cada vez mais restritos sobre ele
+    gerador = np.random.default_rng(semente)
+    opcoes = candidatos(gerador)
+    for rodada in range(rodadas):
+        if rodada % 4 == 0:
+            predicados = [opcoes[i]() for i in gerador.choice(len(opcoes), 2, replace=False)]
+        else:
+            predicados = predicados + [opcoes[gerador.integers(len(opcoes))]()]
+        yield predicados
+
+
+@pytest.mark.parametrize('motor', list(MOTORES))
+def test_motor_igual_ao_query(tabela, motor):
+    if not disponivel(motor):
+        pytest.skip(f'{motor} não instalado')
+    for predicados in planos(1, 150):
+        texto, variaveis = expressao(predicados)
+        esperado = tabela.query(texto, local_dict=variaveis).index
+        # o motor direto, sem o fallback para o pandas de mascara
+        obtido = tabela[MOTORES[motor](tabela, predicados)].index
+        assert obtido.equals(esperado), (predicados, len(obtido), len(esperado))
+
+
+def test_nao_suportado_cai_no_pandas(tabela):
+    # texto contra int32: o pyarrow recusa e o pandas responde
+    with pytest.raises(NaoSuportado):
+        mascara_arrow(tabela, [('ano', '==', '2000')])
+    assert (mascara(tabela, [('ano', '==', '2000')], 'arrow') == mascara_pandas(tabela, [('ano', '==', '2000')])).all()
+
+
+def test_isin_vazio(tabela):
+    assert not mascara(tabela, [('uf', 'isin', [])]).any()
+
+
+def test_motor_ausente_vira_arrow():
+    assert resolve_motor('inexistente') == 'arrow'
+    assert resolve_motor('pandas') == 'pandas'
+
+
+def test_fatias_em_cache_iguais_ao_query(tabela):
+    cache = nova_cache(max_planos=16)
+    for predicados in planos_estreitando(2, 200):
+        texto, variaveis = expressao(predicados)
+        esperado = tabela.query(texto, local_dict=variaveis)
+        obtido = filtra(tabela, predicados, cache=cache)
+        assert obtido.equals(esperado), (predicados, len(obtido), len(esperado))
+        assert filtra(tabela, predicados[::-1], cache=cache).index.equals(esperado.index)
+    assert cache['contagem']['acertos'] > 0 and cache['contagem']['estreitados'] > 0
+
+
+def test_cache_reconhece_visoes(tabela):
+    # as visões rasas que o app cria a cada rerun não esvaziam a cache
+    base = tabela.copy(deep=False)
+    base.attrs['carga'] = 1
+    cache = nova_cache()
+    predicados = [('uf', '==', 'PI')]
+    filtra(base, predicados, cache=cache)
+    filtra(base.copy(deep=False), predicados, cache=cache)
+    assert cache['contagem'] == {'acertos': 1, 'estreitados': 0, 'varreduras': 1}
+
+
+@pytest.mark.parametrize('carga', [True, False])
+def test_cache_recomeca_com_outra_tabela(carga):
+    # tabela recarregada com o mesmo número de linhas: as posições guardadas não valem mais
+    primeira, segunda = cria_tabela(3), cria_tabela(4)
+    if carga:
+        primeira.attrs['carga'], segunda.attrs['carga'] = 1, 2
+    cache = nova_cache()
+    predicados = [('uf', '==', 'PI'), ('ano', '>=', 2000)]
+    filtra(primeira, predicados, cache=cache)
+    texto, variaveis = expressao(predicados)
+    assert filtra(segunda, predicados, cache=cache).equals(segunda.query(texto, local_dict=variaveis))
+    assert cache['contagem']['varreduras'] == 2
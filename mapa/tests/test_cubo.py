@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from cubo import cria_cubo, conta_periodo, ocorrencias_por_municipio
+
+
+@pytest.fixture(scope='module')
+def atlas():
+    # atlas pequeno com vazios em todas as dimensões e um código ibge com dois nomes
+    gerador = np.random.default_rng(0)
+    n = 4000
+    ibge = gerador.choice([2200100, 2200200, 2200300, 2300100, np.nan], n)
+    nomes = {2200100: ['Acauã'], 2200200: ['Agricolândia', 'Agricolandia'], 2200300: ['Água Branca'], 2300100: ['Abaiara']}
+    municipio = [gerador.choice(nomes[i]) if i in nomes else None for i in ibge]
+    municipio = [None if gerador.random() < 0.02 else m for m in municipio]
+    df = pd.DataFrame({
+        'uf': [('PI' if i < 2300000 else 'CE') if not np.isnan(i) else gerador.choice(['PI', None]) for i in ibge],
+        'ibge': ibge,
+        'municipio': pd.Series(municipio, dtype=object),
+        'grupo_de_desastre': gerador.choice(['Climatológico', 'Hidrológico', None], n, p=[0.5, 0.45, 0.05]),
+        'descricao_tipologia': gerador.choice(['Estiagem e Seca', 'Enxurradas', 'Inundações', None], n, p=[0.4, 0.3, 0.25, 0.05]),
+        'ano': gerador.integers(1991, 2023, n),
+    })
+    # o app lê as colunas de texto como categóricas (dados.CATEGORICAS)
+    categorico = df.astype({c: 'category' for c in ['uf', 'municipio', 'grupo_de_desastre', 'descricao_tipologia']})
+    return df, cria_cubo(categorico)
+
+
+def filtra_e_conta(df, uf, ano_inicial, ano_final, grupo=None, tipologia=None):
+    # o caminho antigo do app: filtra a tabela e conta as linhas
+    consulta = df[(df.ano >= ano_inicial) & (df.ano <= ano_final)]
+    if uf is not None:
+        consulta = consulta[consulta.uf == uf]
+    if grupo is not None:
+        consulta = consulta[consulta.grupo_de_desastre == grupo]
+    if tipologia is not None:
+        consulta = consulta[consulta.descricao_tipologia == tipologia]
+    return consulta
+
+
+CASOS = [('PI', 1991, 2022, None, None), ('PI', 2000, 2010, 'Hidrológico', None), ('CE', 2005, 2005, None, 'Enxurradas'),
+         ('PI', 1980, 2030, 'Climatológico', 'Estiagem e Seca'), (None, 1995, 2015, None, None), ('SP', 1991, 2022, None, None)]
+
+
+@pytest.mark.parametrize('uf, ano_inicial, ano_final, grupo, tipologia', CASOS)
+def test_total_e_por_ano(atlas, uf, ano_inicial, ano_final, grupo, tipologia):
+    df, cubo = atlas
+    consulta = filtra_e_conta(df, uf, ano_inicial, ano_final, grupo, tipologia)
+    por_ano = conta_periodo(cubo, uf, ano_inicial, ano_final, grupo=grupo, tipologia=tipologia, por_ano=True)
+    assert por_ano.ocorrencias.sum() == len(consulta)
+    assert por_ano.groupby('ano').ocorrencias.sum().to_dict() == consulta.groupby('ano').size().to_dict()
+
+    esperado = consulta.groupby(['ano', 'descricao_tipologia']).size()
+    obtido = por_ano.groupby(['ano', 'descricao_tipologia'], observed=True).ocorrencias.sum()
+    assert obtido.to_dict() == esperado.to_dict()
+
+
+@pytest.mark.parametrize('uf, ano_inicial, ano_final, grupo, tipologia', CASOS)
+def test_ocorrencias_por_municipio(atlas, uf, ano_inicial, ano_final, grupo, tipologia):
+    df, cubo = atlas
+    consulta = filtra_e_conta(df, uf, ano_inicial, ano_final, grupo, tipologia)
+    esperado = (consulta.groupby(['ibge', 'municipio'], as_index=False).size().rename(columns={'size': 'ocorrencias'})
+                .sort_values('ocorrencias', ascending=False).drop_duplicates(subset='ibge', keep='first'))
+    obtido = ocorrencias_por_municipio(conta_periodo(cubo, uf, ano_inicial, ano_final, grupo=grupo, tipologia=tipologia, por_ano=True))
+    assert list(obtido.columns) == ['ibge', 'municipio', 'ocorrencias']
+    assert obtido.ibge.tolist() == esperado.ibge.tolist()
+    assert obtido.municipio.astype(object).tolist() == esperado.municipio.tolist()
+    assert obtido.ocorrencias.tolist() == esperado.ocorrencias.tolist()
@@ -0,0 +1,80 @@
+import json
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import pytest
+from malhas import ZOOMS, arquivo_malha, arquivo_versao, carrega_indice, malha_area, obtem_malha, obtem_versoes, prefetch, salva_indice
+
+MALHA = {'type': 'FeatureCollection', 'features': [
+    {'type': 'Feature', 'properties': {'codarea': str(2200000 + i)},
+     'geometry': {'type': 'Polygon', 'coordinates': [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]]}}
+    for i in range(3)]}
+
+
+@pytest.fixture
+def ibge_falso():
+    # servidor HTTP local no papel da API do IBGE: responde 503 na primeira vez que cada malha é pedida
+    pedidos = []
+
+    class IBGEFalso(BaseHTTPRequestHandler):
+        def do_GET(self):
+            caminho = urlparse(self.path).path
+            pedidos.append(caminho)
+            if pedidos.count(caminho) == 1:
+                self.send_response(503)
+                self.end_headers()
+                return
+            corpo = json.dumps(MALHA).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), IBGEFalso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{servidor.server_address[1]}', pedidos
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_falta_download_disco_acerto(ibge_falso, tmp_path):
+    base, pedidos = ibge_falso
+    caminho = arquivo_malha(uf='PI', destino=tmp_path)
+    assert obtem_malha(uf='PI', destino=tmp_path, base=base) == MALHA
+    assert pedidos == ['/estados/PI', '/estados/PI']  # 503 e a nova tentativa
+    assert os.path.exists(caminho) and all(os.path.exists(arquivo_versao(caminho, z)) for z in ZOOMS)
+
+    # acerto: lido do disco, sem ir ao servidor
+    assert obtem_malha(uf='PI', destino=tmp_path, base=base) == MALHA
+    assert set(obtem_versoes(uf='PI', destino=tmp_path, base=base)) == {math.inf, *ZOOMS}
+    assert len(pedidos) == 2
+
+
+def test_prefetch_baixa_so_o_que_falta(ibge_falso, tmp_path):
+    base, pedidos = ibge_falso
+    obtem_malha(uf='PI', destino=tmp_path, base=base)
+    falhas = prefetch(['PI', 'CE'], destino=tmp_path, base=base, trabalhadores=2)
+    assert not falhas
+    assert pedidos.count('/estados/PI') == 2 and pedidos.count('/estados/CE') == 2 and len(pedidos) == 4
+
+
+@pytest.mark.parametrize('gravado', [True, False])
+def test_indice_por_codarea(tmp_path, gravado):
+    caminho = tmp_path / 'malha.json'
+    caminho.write_text(json.dumps(MALHA))
+    if gravado:
+        salva_indice(caminho, tmp_path)
+    # sem o parquet, o índice é montado em memória e nada é gravado
+    indice = carrega_indice(caminho, tmp_path)
+    assert (tmp_path / 'malha.parquet').exists() == gravado
+    assert malha_area(indice, 2200001) == {'type': 'FeatureCollection', 'features': [MALHA['features'][1]]}
+    assert len(malha_area(indice, 2200002, zoom=1)['features']) == 1
+    assert malha_area(indice, 9999999)['features'] == []